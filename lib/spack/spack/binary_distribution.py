@@ -4,30 +4,40 @@
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
 import codecs
+import gzip
+import io
 import os
 import re
 import tarfile
 import shutil
 import tempfile
 import hashlib
-import glob
+import multiprocessing
 import platform
+import random
+import threading
+import time
 
 from contextlib import closing
+from multiprocessing.pool import ThreadPool
 import ruamel.yaml as yaml
 
 import json
 
+from six.moves import queue
 from six.moves.urllib.error import URLError
 
 import llnl.util.tty as tty
 from llnl.util.filesystem import mkdirp
 
+import spack.caches
 import spack.cmd
 import spack.config as config
 import spack.fetch_strategy as fs
 import spack.util.gpg
 import spack.relocate as relocate
+import spack.util.compression as compression_util
+import spack.util.spack_json as sjson
 import spack.util.spack_yaml as syaml
 import spack.mirror
 import spack.util.url as url_util
@@ -35,6 +45,7 @@
 
 from spack.spec import Spec
 from spack.stage import Stage
+from spack.util.file_cache import CacheError
 from spack.util.gpg import Gpg
 import spack.architecture as architecture
 
@@ -55,6 +66,39 @@
 
 BUILD_CACHE_INDEX_ENTRY_TEMPLATE = '  <li><a href="{path}">{path}</a></li>'
 
+#: Name of the index of the specs of a build cache, as gzip compressed JSON
+BUILD_CACHE_INDEX_NAME = 'index.json.gz'
+
+#: Name of the file holding the sha256 checksum of the index
+BUILD_CACHE_INDEX_HASH_NAME = 'index.json.hash'
+
+#: Version of the format of the index
+_index_version = 1
+
+#: Number of spec.yaml files downloaded at the same time to check if specs
+#: need to be rebuilt
+_rebuild_check_jobs = 16
+
+#: Directory of the misc cache holding copies of the indices of mirrors
+_index_cache_dir = 'buildcache-indices'
+
+#: Number of times the index is read and written before giving up, when
+#: other processes update it at the same time
+_index_update_attempts = 10
+
+#: Directory of the build cache holding the content of the files of the
+#: packages pushed with the ``blobs`` layout, by sha256 checksum
+_blobs_relative_path = 'blobs'
+
+#: Extensions of the blobs, by compression
+_blob_extensions = {'gzip': '.gz', 'zstd': '.zst'}
+
+#: Version of the format of the manifests of the ``blobs`` layout
+_manifest_version = 1
+
+#: Number of blobs pushed or downloaded at the same time
+_blob_transfer_jobs = 16
+
 
 class NoOverwriteException(spack.error.SpackError):
     """
@@ -67,6 +111,30 @@ def __init__(self, file_path):
         super(NoOverwriteException, self).__init__(err_msg)
 
 
+class TarballCreationError(spack.error.SpackError):
+    """
+    Raised when the tarballs of some specs could not be created or pushed.
+    """
+
+    def __init__(self, errors):
+        super(TarballCreationError, self).__init__(
+            'Could not create the buildcache of {0} spec(s)'
+            .format(len(errors)),
+            '\n'.join('{0}: {1}'.format(spec.format(), error)
+                      for spec, error in errors))
+
+
+class MissingBlobsException(spack.error.SpackError):
+    """
+    Raised when blobs of a package cannot be downloaded from any mirror.
+    """
+
+    def __init__(self, digests):
+        super(MissingBlobsException, self).__init__(
+            'Could not download {0} blob(s) of the package'
+            .format(len(digests)), '\n'.join(sorted(digests)))
+
+
 class NoGpgException(spack.error.SpackError):
     """
     Raised when gpg2 is not in PATH
@@ -146,10 +214,10 @@ def read_buildinfo_file(prefix):
     return buildinfo
 
 
-def write_buildinfo_file(spec, workdir, rel=False):
+def get_buildinfo_dict(spec, rel=False):
     """
-    Create a cache file containing information
-    required for the relocation
+    Create the information required for the relocation of
+    the install prefix of a spec
     """
     prefix = spec.prefix
     text_to_relocate = []
@@ -162,7 +230,7 @@ def write_buildinfo_file(spec, workdir, rel=False):
     for d in deps:
         prefix_to_hash[str(d.prefix)] = d.dag_hash()
     # Do this at during tarball creation to save time when tarball unpacked.
-    # Used by make_package_relative to determine binaries to change.
+    # Used by make_binary_relative to determine binaries to change.
     for root, dirs, files in os.walk(prefix, topdown=True):
         dirs[:] = [d for d in dirs if d not in blacklist]
         for filename in files:
@@ -200,9 +268,36 @@ def write_buildinfo_file(spec, workdir, rel=False):
     buildinfo['relocate_binaries'] = binary_to_relocate
     buildinfo['relocate_links'] = link_to_relocate
     buildinfo['prefix_to_hash'] = prefix_to_hash
-    filename = buildinfo_file_name(workdir)
-    with open(filename, 'w') as outfile:
-        outfile.write(syaml.dump(buildinfo, default_flow_style=True))
+    return buildinfo
+
+
+def relocation_prefixes(buildinfo):
+    """Prefixes of the build machine whose occurrences are relocated."""
+    prefixes = list(buildinfo.get('prefix_to_hash', {}))
+    prefixes.append(buildinfo['buildpath'])
+    prefixes.append(buildinfo['spackprefix'])
+    prefixes.append(relocate.sbang_shebang(buildinfo['spackprefix']))
+    return prefixes
+
+
+def read_relocation_offsets(workdir, buildinfo, filenames):
+    """
+    Return the files to relocate and their recorded offsets, as
+    expected by relocate_text and relocate_text_bin, or None for
+    buildcaches created without offsets
+    """
+    if 'relocation_offsets' not in buildinfo:
+        return None
+    prefixes = buildinfo['relocation_prefixes']
+    offsets = {}
+    for filename in filenames:
+        if filename not in buildinfo['relocation_offsets']:
+            continue
+        size, occurrences = buildinfo['relocation_offsets'][filename]
+        offsets[os.path.join(workdir, filename)] = (
+            size, [(offset, prefixes[index], length)
+                   for offset, index, length in occurrences])
+    return offsets
 
 
 def tarball_directory_name(spec):
@@ -237,6 +332,15 @@ def tarball_path_name(spec, ext):
                         tarball_name(spec, ext))
 
 
+def blob_path_name(digest, compression):
+    """
+    Return the path of a blob, relative to the build cache directory,
+    from the sha256 checksum of its uncompressed content
+    """
+    return os.path.join(_blobs_relative_path, 'sha256', digest[:2],
+                        digest + _blob_extensions[compression])
+
+
 def checksum_tarball(file):
     # calculate sha256 hash of tar file
     block_size = 65536
@@ -280,128 +384,770 @@ def sign_tarball(key, force, specfile_path):
 
 
 def generate_package_index(cache_prefix):
-    """Create the build cache index page.
+    """Create the build cache index page and spec index.
 
     Creates (or replaces) the "index.html" page at the location given in
     cache_prefix.  This page contains a link for each binary package (*.yaml)
     and public key (*.key) under cache_prefix.
+
+    The content of every spec.yaml file is also gathered in a single
+    index, BUILD_CACHE_INDEX_NAME, so that clients can read the specs of
+    the build cache with one request. Its sha256 checksum is written to
+    BUILD_CACHE_INDEX_HASH_NAME, for clients to check if the index they
+    have read before is still current.
+
+    This lists the whole build cache, and repairs an index that
+    ``update_package_index`` can't update.
     """
+    index_url = url_util.join(cache_prefix, BUILD_CACHE_INDEX_NAME)
     tmpdir = tempfile.mkdtemp()
     try:
-        index_html_path = os.path.join(tmpdir, 'index.html')
-        file_list = (
-            entry
-            for entry in web_util.list_url(cache_prefix)
-            if (entry.endswith('.yaml')
-                or entry.endswith('.key')))
-
-        with open(index_html_path, 'w') as f:
-            f.write(BUILD_CACHE_INDEX_TEMPLATE.format(
-                title='Spack Package Index',
-                path_list='\n'.join(
-                    BUILD_CACHE_INDEX_ENTRY_TEMPLATE.format(path=path)
-                    for path in file_list)))
-
-        web_util.push_to_url(
-            index_html_path,
-            url_util.join(cache_prefix, 'index.html'),
-            keep_original=False,
-            extra_args={'ContentType': 'text/html'})
+        for attempt in range(_index_update_attempts):
+            # read first, so that the specs pushed while the build cache is
+            # listed are not lost
+            _, version = web_util.read_versioned_url(index_url)
+
+            index_html_path = os.path.join(tmpdir, 'index.html')
+            file_list = [
+                entry
+                for entry in web_util.list_url(cache_prefix)
+                if (entry.endswith('.yaml')
+                    or entry.endswith('.key'))]
+
+            with open(index_html_path, 'w') as f:
+                f.write(BUILD_CACHE_INDEX_TEMPLATE.format(
+                    title='Spack Package Index',
+                    path_list='\n'.join(
+                        BUILD_CACHE_INDEX_ENTRY_TEMPLATE.format(path=path)
+                        for path in file_list)))
+
+            web_util.push_to_url(
+                index_html_path,
+                url_util.join(cache_prefix, 'index.html'),
+                keep_original=False,
+                extra_args={'ContentType': 'text/html'})
+
+            index = {}
+            for entry in file_list:
+                if not entry.endswith('.spec.yaml'):
+                    continue
+                try:
+                    index[entry] = _read_spec_file(
+                        url_util.join(cache_prefix, entry))
+                except (URLError, web_util.SpackWebError,
+                        yaml.YAMLError) as e:
+                    tty.warn('Leaving {0} out of the index: {1}'.format(
+                        entry, str(e)))
+
+            if _push_index(cache_prefix, index, version, tmpdir, attempt):
+                return
     finally:
         shutil.rmtree(tmpdir)
 
 
-def build_tarball(spec, outdir, force=False, rel=False, unsigned=False,
-                  allow_root=False, key=None, regenerate_index=False):
+def update_package_index(cache_prefix, spec_files):
+    """Add or replace entries of the spec index of a build cache, without
+    listing the build cache.
+
+    The index is read, updated, and written back only if no other process
+    replaced it in between, or else read again, so that concurrent pushes
+    to the build cache don't lose each other's entries. Build caches
+    without an index get a complete one from ``generate_package_index``.
+    The "index.html" page is left as it is.
+
+    Args:
+        cache_prefix (str): URL of the build cache
+        spec_files (dict): content of the spec.yaml files to add, by file
+            name
     """
-    Build a tarball from given spec and put it into the directory structure
-    used at the mirror (following <tarball_directory_name>).
+    index_url = url_util.join(cache_prefix, BUILD_CACHE_INDEX_NAME)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for attempt in range(_index_update_attempts):
+            data, version = web_util.read_versioned_url(index_url)
+            index = None
+            if data is not None:
+                try:
+                    index = read_index_data(data)
+                except (IOError, ValueError) as e:
+                    tty.warn('Ignoring the index of {0}: {1}'.format(
+                        url_util.format(cache_prefix), str(e)))
+            if index is None:
+                break
+
+            index.update(spec_files)
+            if _push_index(cache_prefix, index, version, tmpdir, attempt):
+                return
+    finally:
+        shutil.rmtree(tmpdir)
+
+    generate_package_index(cache_prefix)
+
+
+def _push_index(cache_prefix, index, version, tmpdir, attempt):
     """
-    if not spec.concrete:
-        raise ValueError('spec must be concrete to build tarball')
+    Push the spec index of a build cache, if the index was not replaced
+    since it was read at ``version``, and then its hash.
 
-    # set up some paths
-    tmpdir = tempfile.mkdtemp()
-    cache_prefix = build_cache_prefix(tmpdir)
+    Returns:
+        (bool): True if the index was pushed, False if it is to be read
+            and updated again
 
-    tarfile_name = tarball_name(spec, '.tar.gz')
-    tarfile_dir = os.path.join(cache_prefix, tarball_directory_name(spec))
-    tarfile_path = os.path.join(tarfile_dir, tarfile_name)
-    spackfile_path = os.path.join(
-        cache_prefix, tarball_path_name(spec, '.spack'))
+    Raises:
+        PreconditionFailedError: if the index was replaced at the last
+            attempt
+    """
+    index_path = os.path.join(tmpdir, BUILD_CACHE_INDEX_NAME)
+    write_index_file(index, index_path)
+    try:
+        web_util.push_to_url_if_version(
+            index_path,
+            url_util.join(cache_prefix, BUILD_CACHE_INDEX_NAME),
+            version,
+            extra_args={'ContentType': 'application/gzip'})
+    except web_util.PreconditionFailedError:
+        if attempt + 1 == _index_update_attempts:
+            raise
+        tty.debug('The index of {0} was updated concurrently, retrying'
+                  .format(url_util.format(cache_prefix)))
+        # wait a bit more at each attempt, at random to spread the retries
+        time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        return False
+
+    _push_index_hash(cache_prefix, tmpdir)
+    return True
 
-    remote_spackfile_path = url_util.join(
-        outdir, os.path.relpath(spackfile_path, tmpdir))
 
-    mkdirp(tarfile_dir)
-    if web_util.url_exists(remote_spackfile_path):
-        if force:
-            web_util.remove_url(remote_spackfile_path)
+def _push_index_hash(cache_prefix, tmpdir):
+    """
+    Push the hash of the spec index stored in a build cache.
+
+    The hash is computed from the index read back from the build cache,
+    rather than from the index pushed, which another process may have
+    replaced already. It is replaced only if no other process replaced it
+    in between, and the index is read again afterwards, so that the hash
+    of an index replaced since is not the last one pushed: clients with a
+    copy of that index would keep using it.
+    """
+    index_url = url_util.join(cache_prefix, BUILD_CACHE_INDEX_NAME)
+    hash_url = url_util.join(cache_prefix, BUILD_CACHE_INDEX_HASH_NAME)
+    hash_path = os.path.join(tmpdir, BUILD_CACHE_INDEX_HASH_NAME)
+    for attempt in range(_index_update_attempts):
+        pushed_hash, hash_version = web_util.read_versioned_url(hash_url)
+        data, _ = web_util.read_versioned_url(index_url)
+        if data is None:
+            return
+        index_hash = hashlib.sha256(data).hexdigest()
+        if pushed_hash is not None and \
+                pushed_hash.decode('utf-8').strip() == index_hash:
+            return
+
+        with open(hash_path, 'w') as f:
+            f.write(index_hash)
+        try:
+            web_util.push_to_url_if_version(
+                hash_path, hash_url, hash_version,
+                extra_args={'ContentType': 'text/plain'})
+        except web_util.PreconditionFailedError:
+            tty.debug('The index hash of {0} was updated concurrently, '
+                      'retrying'.format(url_util.format(cache_prefix)))
+            time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+            continue
+
+        data, _ = web_util.read_versioned_url(index_url)
+        if data is None or hashlib.sha256(data).hexdigest() == index_hash:
+            return
+
+    tty.warn('Could not update the index hash of {0}, clients may not see '
+             'the latest specs'.format(url_util.format(cache_prefix)))
+
+
+def _read_spec_file(url):
+    """Read a spec.yaml file of a build cache, as a dict."""
+    _, _, spec_file = web_util.read_from_url(url)
+    return syaml.load(codecs.getreader('utf-8')(spec_file).read())
+
+
+def write_index_file(index, path):
+    """
+    Write the index of the specs of a build cache to a file, as gzip
+    compressed JSON.
+
+    Args:
+        index (dict): content of the spec.yaml files of the build cache, by
+            file name
+        path (str): path of the file to write
+
+    Returns:
+        (str): sha256 checksum of the file
+    """
+    data = json.dumps(
+        {'buildcache_index': {'version': _index_version, 'specs': index}},
+        sort_keys=True, separators=(',', ':'))
+    with open(path, 'wb') as f:
+        # the file, and its hash, only depend on the index
+        f.write(compression_util.gzip_member(data.encode('utf-8')))
+    return checksum_tarball(path)
+
+
+def read_index_data(data):
+    """
+    Read the index of the specs of a build cache, written by
+    ``write_index_file``.
+
+    Args:
+        data (bytes): content of the index file
+
+    Returns:
+        (dict): content of the spec.yaml files of the build cache, by file
+            name, or None if the index is in an unknown format
+    """
+    return _load_index_text(_index_text(data))
+
+
+def _index_text(data):
+    """Decompress the content of an index file to JSON text."""
+    with closing(gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb')) as gz:
+        return gz.read().decode('utf-8')
+
+
+def _load_index_text(text):
+    index = sjson.load(text).get('buildcache_index', {})
+    if index.get('version') != _index_version:
+        return None
+    return index['specs']
+
+
+class _HashingWriter(object):
+    """Write-only file object counting and hashing the data written to
+    another file object through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        self.fileobj.write(data)
+
+
+class _HashingReader(object):
+    """Read-only file object hashing the data read from another file
+    object through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        """Return the sha256 checksum of all the data of the file object,
+        including what was not read through this one."""
+        while self.read(65536):
+            pass
+        return self.hasher.hexdigest()
+
+
+def _outside_prefix(path):
+    """Whether a path of a tarball member may point outside of the
+    directory it is extracted to."""
+    return os.path.isabs(path) or '..' in path.split('/')
+
+
+def _prefix_members(tar):
+    """
+    Generate the members of a tarball of an install prefix, read in stream
+    mode, with their paths relative to the prefix. The top-level directory
+    named after the original prefix becomes '.', and is stripped from the
+    other paths and from the targets of hard links.
+
+    The tarball is extracted before its checksum can be checked, so the
+    members that could write outside of the prefix are skipped: the ones
+    with an absolute path or a '..' component, the ones extracted through
+    or over a symbolic link of the tarball, and hard links to anything
+    but a file extracted before.
+    """
+    top = None
+    files, symlinks = set(), set()
+    for member in tar:
+        if top is None:
+            top = member.name.split('/', 1)[0]
+        if member.name == top:
+            member.name = '.'
+        elif member.name.startswith(top + '/'):
+            member.name = member.name[len(top) + 1:]
         else:
-            raise NoOverwriteException(url_util.format(remote_spackfile_path))
+            tty.warn('Skipping %s, outside of the prefix' % member.name)
+            continue
+        if member.islnk() and member.linkname.startswith(top + '/'):
+            member.linkname = member.linkname[len(top) + 1:]
+
+        name = os.path.normpath(member.name)
+        parts = name.split('/')
+        if (_outside_prefix(member.name) or
+                any('/'.join(parts[:i]) in symlinks
+                    for i in range(1, len(parts) + 1)) or
+                (member.islnk() and
+                 (_outside_prefix(member.linkname) or
+                  os.path.normpath(member.linkname) not in files))):
+            tty.warn('Skipping %s, which could be extracted outside of '
+                     'the prefix' % member.name)
+            continue
 
-    # need to copy the spec file so the build cache can be downloaded
-    # without concretizing with the current spack packages
-    # and preferences
-    spec_file = os.path.join(spec.prefix, ".spack", "spec.yaml")
-    specfile_name = tarball_name(spec, '.spec.yaml')
-    specfile_path = os.path.realpath(
-        os.path.join(cache_prefix, specfile_name))
+        if member.issym():
+            symlinks.add(name)
+        elif member.isreg() or member.islnk():
+            files.add(name)
+        yield member
 
-    remote_specfile_path = url_util.join(
-        outdir, os.path.relpath(specfile_path, os.path.realpath(tmpdir)))
 
-    if web_util.url_exists(remote_specfile_path):
-        if force:
-            web_util.remove_url(remote_specfile_path)
+class _BlobWriter(object):
+    """
+    Stands in for the tar archive ``add_prefix_to_tarball`` adds an install
+    prefix to, for the ``blobs`` layout. The members are recorded for the
+    manifest, and the content of each regular file is compressed to a blob
+    named after its sha256 checksum, once per content.
+    """
+
+    def __init__(self, blob_dir, compression, compression_level):
+        self.blob_dir = blob_dir
+        self.compression = compression
+        self.compression_level = compression_level
+        self.members = []
+        # makes the members from the files of the prefix
+        self.tar = tarfile.open(fileobj=io.BytesIO(), mode='w')
+
+    def gettarinfo(self, *args, **kwargs):
+        return self.tar.gettarinfo(*args, **kwargs)
+
+    def addfile(self, info, fileobj=None):
+        member = {
+            'name': info.name,
+            'type': info.type.decode('ascii'),
+            'mode': info.mode,
+            'mtime': int(info.mtime),
+            'uid': info.uid,
+            'gid': info.gid,
+            'uname': info.uname,
+            'gname': info.gname,
+            'linkname': info.linkname,
+        }
+        if info.isreg():
+            member['size'] = info.size
+            member['sha256'] = self._add_blob(fileobj, info.size)
+        self.members.append(member)
+
+    def _add_blob(self, fileobj, size):
+        """Compress the content of a file to its blob, unless there is one
+        already, and return its sha256 checksum."""
+        mkdirp(self.blob_dir)
+        fd, partial_path = tempfile.mkstemp(dir=self.blob_dir)
+        hasher = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f:
+            stream = compression_util.compressed_writer(
+                f, self.compression, self.compression_level)
+            while size > 0:
+                data = fileobj.read(min(size, 1 << 20))
+                if not data:
+                    raise IOError('file shrank while being read')
+                hasher.update(data)
+                stream.write(data)
+                size -= len(data)
+            stream.close()
+
+        digest = hasher.hexdigest()
+        path = os.path.join(os.path.dirname(self.blob_dir),
+                            blob_path_name(digest, self.compression))
+        if os.path.exists(path):
+            os.remove(partial_path)
         else:
-            raise NoOverwriteException(url_util.format(remote_specfile_path))
-
-    # make a copy of the install directory to work with
-    workdir = os.path.join(tmpdir, os.path.basename(spec.prefix))
-    # install_tree copies hardlinks
-    # create a temporary tarfile from prefix and exract it to workdir
-    # tarfile preserves hardlinks
-    temp_tarfile_name = tarball_name(spec, '.tar')
-    temp_tarfile_path = os.path.join(tarfile_dir, temp_tarfile_name)
-    with closing(tarfile.open(temp_tarfile_path, 'w')) as tar:
-        tar.add(name='%s' % spec.prefix,
-                arcname='.')
-    with closing(tarfile.open(temp_tarfile_path, 'r')) as tar:
-        tar.extractall(workdir)
-    os.remove(temp_tarfile_path)
-
-    # create info for later relocation and create tar
-    write_buildinfo_file(spec, workdir, rel)
-
-    # optionally make the paths in the binaries relative to each other
-    # in the spack install tree before creating tarball
-    if rel:
+            mkdirp(os.path.dirname(path))
+            os.rename(partial_path, path)
+        return digest
+
+    def manifest(self):
+        """Return the JSON text of the manifest of the prefix."""
+        return json.dumps({'manifest': {
+            'version': _manifest_version,
+            'compression': self.compression,
+            'members': self.members,
+        }}, sort_keys=True)
+
+
+def _blob_checksum(path, compression):
+    """Return the sha256 checksum of the uncompressed content of a blob."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        stream = compression_util.decompressed_reader(f, compression)
+        data = stream.read(1 << 20)
+        while data:
+            hasher.update(data)
+            data = stream.read(1 << 20)
+    return hasher.hexdigest()
+
+
+def _blob_tarball_chunks(members, blob_paths, compression):
+    """
+    Generate the uncompressed tarball of an install prefix from the members
+    of its manifest and the blobs of their content, checking the sha256
+    checksum of each blob as it is read.
+    """
+    for member in members:
+        info = tarfile.TarInfo(member['name'])
+        info.type = member['type'].encode('ascii')
+        for attr in ('mode', 'mtime', 'uid', 'gid', 'uname', 'gname',
+                     'linkname'):
+            setattr(info, attr, member[attr])
+        if not info.isreg():
+            yield info.tobuf(tarfile.GNU_FORMAT)
+            continue
+
+        info.size = member['size']
+        yield info.tobuf(tarfile.GNU_FORMAT)
+        hasher = hashlib.sha256()
+        size = 0
+        with open(blob_paths[member['sha256']], 'rb') as f:
+            stream = compression_util.decompressed_reader(f, compression)
+            data = stream.read(1 << 20)
+            while data and size + len(data) <= info.size:
+                hasher.update(data)
+                size += len(data)
+                yield data
+                data = stream.read(1 << 20)
+        if data or size != info.size or \
+                hasher.hexdigest() != member['sha256']:
+            raise NoChecksumException(
+                'Blob {0} of {1} failed checksum verification'
+                .format(member['sha256'], member['name']))
+        if size % tarfile.BLOCKSIZE:
+            yield b'\0' * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+class _ChunksReader(object):
+    """Read-only file object reading the chunks of bytes of an iterator."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _push_blobs(blob_dir, cache_url):
+    """
+    Push the blobs written under blob_dir, in the build cache layout, that
+    are not in the build cache at cache_url yet.
+    """
+    paths = []
+    for root, _, files in os.walk(blob_dir):
+        paths.extend(os.path.join(root, name) for name in files)
+
+    def push(path):
+        remote_path = url_util.join(
+            cache_url, os.path.relpath(path, os.path.dirname(blob_dir)))
+        if web_util.url_exists(remote_path):
+            return False
+        web_util.push_to_url(path, remote_path, keep_original=False)
+        return True
+
+    jobs = min(_blob_transfer_jobs, len(paths))
+    if jobs > 1:
+        pool = ThreadPool(jobs)
         try:
-            make_package_relative(workdir, spec, allow_root)
-        except Exception as e:
-            shutil.rmtree(workdir)
-            shutil.rmtree(tarfile_dir)
-            shutil.rmtree(tmpdir)
-            tty.die(e)
+            pushed = pool.map(push, paths)
+        finally:
+            pool.terminate()
     else:
+        pushed = [push(path) for path in paths]
+    tty.debug('Pushed {0} of {1} blobs to {2}'.format(
+        sum(pushed), len(paths), url_util.format(cache_url)))
+
+
+def _fetch_blobs(digests, compression):
+    """
+    Download the blobs missing from the local blob cache, kept in the
+    source cache, from the mirrors.
+
+    Args:
+        digests (set): sha256 checksums of the content of the blobs
+        compression (str): compression of the blobs
+
+    Returns:
+        (dict): paths of the blobs in the local blob cache, by checksum
+
+    Raises:
+        MissingBlobsException: if some blobs cannot be downloaded
+    """
+    cache_root = os.path.join(
+        spack.caches.fetch_cache.root, _build_cache_relative_path)
+    paths = dict((digest, os.path.join(
+        cache_root, blob_path_name(digest, compression)))
+        for digest in digests)
+    missing = [d for d in sorted(paths) if not os.path.exists(paths[d])]
+    cache_urls = [
+        url_util.join(mirror.fetch_url, _build_cache_relative_path)
+        for mirror in spack.mirror.MirrorCollection().values()]
+
+    def fetch(digest):
+        path = paths[digest]
+        mkdirp(os.path.dirname(path))
+        partial_path = '{0}.{1}.part'.format(path, os.getpid())
+        for cache_url in cache_urls:
+            url = url_util.join(cache_url, blob_path_name(digest, compression))
+            try:
+                _, _, response = web_util.read_from_url(url)
+                with open(partial_path, 'wb') as f:
+                    shutil.copyfileobj(response, f, 1 << 20)
+                if _blob_checksum(partial_path, compression) == digest:
+                    os.rename(partial_path, path)
+                    return None
+                tty.debug('Checksum of {0} does not match'.format(url))
+            except Exception as e:
+                tty.debug('Cannot read {0}: {1}'.format(url, str(e)))
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return digest
+
+    jobs = min(_blob_transfer_jobs, len(missing))
+    if jobs > 1:
+        pool = ThreadPool(jobs)
         try:
-            check_package_relocatable(workdir, spec, allow_root)
-        except Exception as e:
-            shutil.rmtree(workdir)
-            shutil.rmtree(tarfile_dir)
-            shutil.rmtree(tmpdir)
-            tty.die(e)
+            failed = pool.map(fetch, missing)
+        finally:
+            pool.terminate()
+    else:
+        failed = [fetch(digest) for digest in missing]
+    failed = [digest for digest in failed if digest is not None]
+    if failed:
+        raise MissingBlobsException(failed)
+
+    tty.debug('Downloaded {0} of {1} blobs'.format(len(missing), len(paths)))
+    return paths
 
-    # create gzip compressed tarball of the install prefix
-    with closing(tarfile.open(tarfile_path, 'w:gz')) as tar:
-        tar.add(name='%s' % workdir,
-                arcname='%s' % os.path.basename(spec.prefix))
-    # remove copy of install directory
-    shutil.rmtree(workdir)
 
-    # get the sha256 checksum of the tarball
-    checksum = checksum_tarball(tarfile_path)
+def _add_streamed_member(fileobj, name, write):
+    """
+    Add a member to the uncompressed tar archive being written to fileobj,
+    with the content written by ``write(fileobj)``, so that it does not need
+    to be written to a file first. The header of the member is written once
+    the size of its content is known.
+    Return the sha256 checksum of the content.
+    """
+    info = tarfile.TarInfo(name)
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    # The length of a GNU header depends on the name but not on the size
+    header_size = len(info.tobuf(tarfile.GNU_FORMAT))
+    start = fileobj.tell()
+    fileobj.write(b'\0' * header_size)
+
+    writer = _HashingWriter(fileobj)
+    write(writer)
+    remainder = writer.size % tarfile.BLOCKSIZE
+    if remainder:
+        fileobj.write(b'\0' * (tarfile.BLOCKSIZE - remainder))
+    end = fileobj.tell()
+
+    info.size = writer.size
+    fileobj.seek(start)
+    fileobj.write(info.tobuf(tarfile.GNU_FORMAT))
+    fileobj.seek(end)
+    return writer.hasher.hexdigest()
+
+
+def add_prefix_to_tarball(tar, spec, buildinfo, rel, tmpdir):
+    """
+    Add the install prefix of a spec to a tarball, with the buildinfo file
+    for its relocation. Each file is read once from the prefix: the files
+    to relocate are scanned for the offsets of the prefixes in memory, and,
+    if rel is True, binaries and links are made relative in memory.
+    """
+    prefix = str(spec.prefix)
+    arcroot = os.path.basename(prefix)
+    buildinfo_path = buildinfo_file_name(prefix)
+    prefixes = relocation_prefixes(buildinfo)
+    textfiles = set(buildinfo['relocate_textfiles'])
+    binaries = set(buildinfo['relocate_binaries'])
+    links = set(buildinfo['relocate_links'] if rel else [])
+
+    offsets = {}
+    for root, dirs, files in os.walk(prefix):
+        dirs.sort()
+        rel_root = os.path.relpath(root, prefix)
+        tar.addfile(tar.gettarinfo(
+            root, arcname=os.path.normpath(os.path.join(arcroot, rel_root))))
+
+        # directories are added as they are walked, except symlinks to them
+        names = sorted(files + [d for d in dirs
+                                if os.path.islink(os.path.join(root, d))])
+        for name in names:
+            path_name = os.path.join(root, name)
+            if path_name == buildinfo_path:
+                continue
+            rel_path_name = os.path.normpath(os.path.join(rel_root, name))
+            info = tar.gettarinfo(
+                path_name, arcname=os.path.join(arcroot, rel_path_name))
+
+            if info.issym() and rel_path_name in links:
+                info.linkname = os.path.relpath(
+                    info.linkname, os.path.dirname(path_name))
+            if not info.isreg():
+                tar.addfile(info)
+                continue
+
+            binary = rel_path_name in binaries
+            if not binary and rel_path_name not in textfiles:
+                with open(path_name, 'rb') as f:
+                    tar.addfile(info, f)
+                continue
+
+            with open(path_name, 'rb') as f:
+                data = f.read()
+            if binary and rel:
+                data = make_binary_relative(
+                    spec, path_name, data, buildinfo['buildpath'], tmpdir)
+            occurrences = relocate.data_prefix_offsets(
+                data, prefixes, binary=binary)
+            if occurrences:
+                offsets[rel_path_name] = [len(data),
+                                          [list(o) for o in occurrences]]
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    # record where the prefixes appear in the final files
+    buildinfo['relocation_prefixes'] = prefixes
+    buildinfo['relocation_offsets'] = offsets
+    data = syaml.dump(buildinfo, default_flow_style=True).encode('utf-8')
+    info = tarfile.TarInfo(
+        os.path.join(arcroot, os.path.relpath(buildinfo_path, prefix)))
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _compression_settings(compression, compression_level):
+    """Return the compression of tarballs and its level, defaulting to the
+    ``config:buildcache_compression`` and
+    ``config:buildcache_compression_level`` settings."""
+    if compression is None:
+        compression = config.get('config:buildcache_compression', 'gzip')
+    if compression_level is None:
+        compression_level = config.get('config:buildcache_compression_level')
+    compression_util.check_compression(compression)
+    return compression, compression_level
+
+
+def _layout_setting(layout):
+    """Return the layout of build caches, defaulting to the
+    ``config:buildcache_layout`` setting."""
+    if layout is None:
+        layout = config.get('config:buildcache_layout', 'archive')
+    if layout not in ('archive', 'blobs'):
+        raise ValueError('unknown build cache layout: {0}'.format(layout))
+    return layout
+
+
+def _remote_paths(spec, outdir, force):
+    """
+    Return the URLs of the .spack archive and of the spec.yaml file of a
+    spec in the build cache of the mirror at outdir. Existing files are
+    removed if force is True, otherwise NoOverwriteException is raised.
+    """
+    remote_paths = (
+        url_util.join(outdir, _build_cache_relative_path,
+                      tarball_path_name(spec, '.spack')),
+        url_util.join(outdir, _build_cache_relative_path,
+                      tarball_name(spec, '.spec.yaml')))
+    for remote_path in remote_paths:
+        if web_util.url_exists(remote_path):
+            if force:
+                web_util.remove_url(remote_path)
+            else:
+                raise NoOverwriteException(url_util.format(remote_path))
+    return remote_paths
+
+
+def _write_archive(spec, tmpdir, rel, allow_root, compression,
+                   compression_level, jobs, layout='archive'):
+    """
+    Write the .spack archive of an installed spec, without its spec.yaml
+    file, and the spec.yaml file, in the build cache layout under tmpdir.
+    The install prefix is compressed with ``jobs`` threads.
+
+    With the ``blobs`` layout, the .spack archive holds a manifest of the
+    prefix instead of a tarball, and the content of its files is written
+    to blobs, in the blobs directory of the build cache under tmpdir.
+
+    Returns:
+        (tuple): the paths of the .spack archive and of the spec.yaml file,
+            and the content of the spec.yaml file
+    """
+    cache_prefix = build_cache_prefix(tmpdir)
+
+    tarfile_name = tarball_name(
+        spec, compression_util.tarball_extensions[compression])
+    tarfile_dir = os.path.join(cache_prefix, tarball_directory_name(spec))
+    spackfile_path = os.path.join(
+        cache_prefix, tarball_path_name(spec, '.spack'))
+    mkdirp(tarfile_dir)
+
+    # need to copy the spec file so the build cache can be downloaded
+    # without concretizing with the current spack packages
+    # and preferences
+    spec_file = os.path.join(spec.prefix, ".spack", "spec.yaml")
+    specfile_path = os.path.realpath(
+        os.path.join(cache_prefix, tarball_name(spec, '.spec.yaml')))
+
+    # check the binaries before writing anything
+    buildinfo = get_buildinfo_dict(spec, rel)
+    check_package_relocatable(spec, buildinfo, allow_root)
+
+    # stream the install prefix into a compressed tarball, written
+    # directly as the first member of the .spack archive
+    def write_prefix(fileobj):
+        stream = compression_util.compressed_writer(
+            fileobj, compression, compression_level, jobs)
+        with closing(tarfile.open(mode='w|', fileobj=stream)) as tar:
+            add_prefix_to_tarball(tar, spec, buildinfo, rel, tmpdir)
+        stream.close()
+
+    # or into blobs and their manifest
+    def write_manifest(fileobj):
+        blobs = _BlobWriter(
+            os.path.join(cache_prefix, _blobs_relative_path), compression,
+            compression_level)
+        add_prefix_to_tarball(blobs, spec, buildinfo, rel, tmpdir)
+        fileobj.write(blobs.manifest().encode('utf-8'))
+
+    with open(spackfile_path, 'wb') as spackfile:
+        if layout == 'blobs':
+            checksum = _add_streamed_member(
+                spackfile, tarball_name(spec, '.manifest.json'),
+                write_manifest)
+        else:
+            checksum = _add_streamed_member(
+                spackfile, tarfile_name, write_prefix)
 
     # add sha256 checksum to spec.yaml
     with open(spec_file, 'r') as inputfile:
@@ -411,6 +1157,10 @@ def build_tarball(spec, outdir, force=False, rel=False, unsigned=False,
     bchecksum['hash_algorithm'] = 'sha256'
     bchecksum['hash'] = checksum
     spec_dict['binary_cache_checksum'] = bchecksum
+    # the format of the tarball tells extract_tarball how to decompress it
+    spec_dict['binary_cache_compression'] = compression
+    if layout == 'blobs':
+        spec_dict['binary_cache_layout'] = layout
     # Add original install prefix relative to layout root to spec.yaml.
     # This will be used to determine is the directory layout has changed.
     buildinfo = {}
@@ -420,31 +1170,58 @@ def build_tarball(spec, outdir, force=False, rel=False, unsigned=False,
     spec_dict['buildinfo'] = buildinfo
     spec_dict['full_hash'] = spec.full_hash()
 
-    tty.debug('The full_hash ({0}) of {1} will be written into {2}'.format(
-        spec_dict['full_hash'],
-        spec.name,
-        url_util.format(remote_specfile_path)))
-    tty.debug(spec.tree())
-
     with open(specfile_path, 'w') as outfile:
         outfile.write(syaml.dump(spec_dict))
 
-    # sign the tarball and spec file with gpg
+    return spackfile_path, specfile_path, spec_dict
+
+
+def _write_archive_call(args, spec=None):
+    """
+    Call ``_write_archive`` for the installed spec with the DAG hash given
+    as second argument, from a process of a pool if spec is None.
+
+    Specs and exceptions cannot always be pickled, so the index of the
+    call, given as first argument, is returned with the result and the
+    error message of the call.
+    """
+    index, dag_hash = args[:2]
+    try:
+        if spec is None:
+            specs = spack.store.db.get_by_hash(dag_hash, installed=True)
+            if not specs:
+                raise ValueError('/{0} is not installed'.format(dag_hash))
+            spec = specs[0]
+        return index, _write_archive(spec, *args[2:]), None
+    except Exception as e:
+        return index, None, str(e) or e.__class__.__name__
+
+
+def _sign_archive(spackfile_path, specfile_path, key, force, unsigned):
+    """
+    Sign the spec.yaml file with gpg, unless unsigned is True, and add it
+    with its signature to the .spack archive.
+    """
+    specfile_name = os.path.basename(specfile_path)
     if not unsigned:
         sign_tarball(key, force, specfile_path)
-    # put tarball, spec and signature files in .spack archive
-    with closing(tarfile.open(spackfile_path, 'w')) as tar:
-        tar.add(name=tarfile_path, arcname='%s' % tarfile_name)
-        tar.add(name=specfile_path, arcname='%s' % specfile_name)
-        if not unsigned:
-            tar.add(name='%s.asc' % specfile_path,
-                    arcname='%s.asc' % specfile_name)
+    # add spec and signature files to the .spack archive
+    with open(spackfile_path, 'r+b') as spackfile:
+        spackfile.seek(0, os.SEEK_END)
+        with closing(tarfile.open(fileobj=spackfile, mode='w')) as tar:
+            tar.add(name=specfile_path, arcname='%s' % specfile_name)
+            if not unsigned:
+                tar.add(name='%s.asc' % specfile_path,
+                        arcname='%s.asc' % specfile_name)
 
     # cleanup file moved to archive
-    os.remove(tarfile_path)
     if not unsigned:
         os.remove('%s.asc' % specfile_path)
 
+
+def _push_archive(spec, spackfile_path, specfile_path,
+                  remote_spackfile_path, remote_specfile_path):
+    """Push the .spack archive and the spec.yaml file of a spec."""
     web_util.push_to_url(
         spackfile_path, remote_spackfile_path, keep_original=False)
     web_util.push_to_url(
@@ -453,18 +1230,190 @@ def build_tarball(spec, outdir, force=False, rel=False, unsigned=False,
     tty.msg('Buildache for "%s" written to \n %s' %
             (spec, remote_spackfile_path))
 
+
+def build_tarball(spec, outdir, force=False, rel=False, unsigned=False,
+                  allow_root=False, key=None, regenerate_index=False,
+                  compression=None, compression_level=None, layout=None):
+    """
+    Build a tarball from given spec and put it into the directory structure
+    used at the mirror (following <tarball_directory_name>).
+
+    The install prefix is compressed with ``compression``, 'gzip' or
+    'zstd', at ``compression_level``. They default to the
+    ``config:buildcache_compression`` and
+    ``config:buildcache_compression_level`` settings, and the compression
+    uses ``config:build_jobs`` threads.
+
+    With the 'blobs' ``layout``, which defaults to the
+    ``config:buildcache_layout`` setting, the content of each file is
+    compressed on its own to a blob named after its sha256 checksum, in
+    the blobs directory of the build cache, and only the blobs missing from
+    the mirror are pushed.
+    """
+    if not spec.concrete:
+        raise ValueError('spec must be concrete to build tarball')
+
+    compression, compression_level = _compression_settings(
+        compression, compression_level)
+    layout = _layout_setting(layout)
+    jobs = config.get('config:build_jobs') or 1
+
+    remote_spackfile_path, remote_specfile_path = _remote_paths(
+        spec, outdir, force)
+
+    tmpdir = tempfile.mkdtemp()
     try:
-        # create an index.html for the build_cache directory so specs can be
-        # found
+        try:
+            spackfile_path, specfile_path, spec_dict = _write_archive(
+                spec, tmpdir, rel, allow_root, compression,
+                compression_level, jobs, layout)
+        except Exception as e:
+            tty.die(e)
+
+        tty.debug('The full_hash ({0}) of {1} will be written into {2}'
+                  .format(spec_dict['full_hash'], spec.name,
+                          url_util.format(remote_specfile_path)))
+        tty.debug(spec.tree())
+
+        _sign_archive(spackfile_path, specfile_path, key, force, unsigned)
+        # the blobs are pushed first, so that they can be found as soon
+        # as the archive can
+        if layout == 'blobs':
+            _push_blobs(
+                os.path.join(build_cache_prefix(tmpdir), _blobs_relative_path),
+                url_util.join(outdir, _build_cache_relative_path))
+        _push_archive(spec, spackfile_path, specfile_path,
+                      remote_spackfile_path, remote_specfile_path)
+
+        # add the spec to the index of the build_cache directory so it can
+        # be found
         if regenerate_index:
-            generate_package_index(url_util.join(
-                outdir, os.path.relpath(cache_prefix, tmpdir)))
+            update_package_index(
+                url_util.join(outdir, _build_cache_relative_path),
+                {os.path.basename(specfile_path): spec_dict})
     finally:
         shutil.rmtree(tmpdir)
 
     return None
 
 
+def build_tarballs(specs, outdir, force=False, rel=False, unsigned=False,
+                   allow_root=False, key=None, regenerate_index=False,
+                   compression=None, compression_level=None, jobs=1,
+                   layout=None):
+    """
+    Build the tarballs of several installed specs and push them to the
+    mirror at outdir, like ``build_tarball`` does for each spec.
+
+    The tarballs are written by a pool of ``jobs`` processes, which share
+    the ``config:build_jobs`` compression threads. Each finished tarball
+    is signed in this process, one at a time, and put on a bounded queue
+    read by ``jobs`` upload threads, so that writing and uploading
+    tarballs overlap. The index of the build cache is updated once, with
+    all the specs pushed. With the 'blobs' ``layout``, the blobs of each
+    spec are pushed by its upload thread, before its archive.
+
+    Raises:
+        TarballCreationError: listing the specs that could not be pushed,
+            once the other specs are pushed and indexed
+    """
+    specs = list(specs)
+    if not all(spec.concrete for spec in specs):
+        raise ValueError('spec must be concrete to build tarball')
+    if not specs:
+        return
+
+    compression, compression_level = _compression_settings(
+        compression, compression_level)
+    layout = _layout_setting(layout)
+    jobs = max(1, min(jobs, len(specs)))
+    threads = max(1, (config.get('config:build_jobs') or 1) // jobs)
+
+    errors = []
+    cache_url = url_util.join(outdir, _build_cache_relative_path)
+    remote_paths, pushed = {}, {}
+    uploads = queue.Queue(jobs)
+    tmpdir = tempfile.mkdtemp()
+
+    def upload():
+        while True:
+            item = uploads.get()
+            if item is None:
+                return
+            i, spackfile_path, specfile_path, spec_dict = item
+            try:
+                if layout == 'blobs':
+                    _push_blobs(os.path.join(
+                        build_cache_prefix(os.path.join(tmpdir, str(i))),
+                        _blobs_relative_path), cache_url)
+                _push_archive(specs[i], spackfile_path, specfile_path,
+                              *remote_paths[i])
+                pushed[os.path.basename(specfile_path)] = spec_dict
+            except Exception as e:
+                errors.append((specs[i], e))
+
+    # the pool and the threads are stopped whatever fails, or the
+    # processes of the pool would keep the output of spack open
+    pool, uploaders = None, []
+    try:
+        calls = []
+        for i, spec in enumerate(specs):
+            try:
+                remote_paths[i] = _remote_paths(spec, outdir, force)
+            except Exception as e:
+                errors.append((spec, e))
+                continue
+            calls.append((i, spec.dag_hash(), os.path.join(tmpdir, str(i)),
+                          rel, allow_root, compression, compression_level,
+                          threads, layout))
+
+        # fork the processes before starting any thread
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs)
+
+        for _ in range(jobs):
+            uploader = threading.Thread(target=upload)
+            uploader.daemon = True
+            uploader.start()
+            uploaders.append(uploader)
+
+        if pool:
+            results = pool.imap_unordered(_write_archive_call, calls)
+        else:
+            results = (_write_archive_call(call, specs[call[0]])
+                       for call in calls)
+
+        for i, result, error in results:
+            spec = specs[i]
+            if error is not None:
+                errors.append((spec, error))
+                continue
+            spackfile_path, specfile_path, spec_dict = result
+            # signing uses the gpg agent, so it is not done concurrently
+            try:
+                _sign_archive(
+                    spackfile_path, specfile_path, key, force, unsigned)
+            except Exception as e:
+                errors.append((spec, e))
+                continue
+            uploads.put((i, spackfile_path, specfile_path, spec_dict))
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        for _ in uploaders:
+            uploads.put(None)
+        for uploader in uploaders:
+            uploader.join()
+        shutil.rmtree(tmpdir)
+
+    if regenerate_index and pushed:
+        update_package_index(cache_url, pushed)
+
+    if errors:
+        raise TarballCreationError(errors)
+
+
 def download_tarball(spec):
     """
     Download binary tarball for given package into stage area
@@ -491,54 +1440,265 @@ def download_tarball(spec):
     return None
 
 
-def make_package_relative(workdir, spec, allow_root):
+class TarballPrefetcher(object):
     """
-    Change paths in binaries to relative paths. Change absolute symlinks
-    to relative symlinks.
+    Download the tarballs of specs in the background, in the order given,
+    ahead of their installation.
+
+    The tarballs are saved where ``download_tarball`` saves them. They are
+    read with ``web_util.read_from_url``, since the fetch strategies used
+    by ``download_tarball`` change the working directory and cannot be used
+    from several threads.
+
+    At most ``jobs`` tarballs are downloaded at a time, within ``budget``
+    bytes: the size of each tarball, given by the mirror, is reserved before
+    it is downloaded, and released when it is taken with ``take``. A
+    download waits until tarballs are taken if its tarball does not fit,
+    unless nothing else is stored. Tarballs of unknown size reserve the
+    whole budget.
     """
-    prefix = spec.prefix
-    buildinfo = read_buildinfo_file(workdir)
-    old_layout_root = buildinfo['buildpath']
-    orig_path_names = list()
-    cur_path_names = list()
-    for filename in buildinfo['relocate_binaries']:
-        orig_path_names.append(os.path.join(prefix, filename))
-        cur_path_names.append(os.path.join(workdir, filename))
-    if (spec.architecture.platform == 'darwin' or
-        spec.architecture.platform == 'test' and
-            platform.system().lower() == 'darwin'):
-        relocate.make_macho_binaries_relative(cur_path_names, orig_path_names,
-                                              old_layout_root)
-    if (spec.architecture.platform == 'linux' or
-        spec.architecture.platform == 'test' and
-            platform.system().lower() == 'linux'):
-        relocate.make_elf_binaries_relative(cur_path_names, orig_path_names,
-                                            old_layout_root)
-    relocate.check_files_relocatable(cur_path_names, allow_root)
-    orig_path_names = list()
-    cur_path_names = list()
-    for linkname in buildinfo.get('relocate_links', []):
-        orig_path_names.append(os.path.join(prefix, linkname))
-        cur_path_names.append(os.path.join(workdir, linkname))
-    relocate.make_link_relative(cur_path_names, orig_path_names)
+
+    def __init__(self, specs, jobs, budget):
+        """
+        Start downloading the tarballs of specs.
+
+        Args:
+            specs (list): concrete specs found in the build caches, in the
+                order they are installed
+            jobs (int): maximum number of downloads at the same time
+            budget (int): disk space, in bytes, for the tarballs downloaded
+                ahead of their installation
+        """
+        self.budget = budget
+        self.pending = []
+        self.paths = {}
+        # Download of each spec not taken yet, by DAG hash: None if pending
+        # or running, otherwise (path, size), with a None path if the
+        # tarball could not be downloaded
+        self.downloads = {}
+        # Bytes reserved by the downloads running or not taken yet
+        self.stored = 0
+        # Bytes to reserve for the downloads waiting for tarballs to be
+        # taken, to fit in the budget, by DAG hash
+        self.waiting = {}
+        self.stopped = False
+        self.condition = threading.Condition()
+
+        mirrors = list(spack.mirror.MirrorCollection().values())
+        for spec in specs:
+            tarball = tarball_path_name(spec, '.spack')
+            urls = [url_util.join(mirror.fetch_url,
+                                  _build_cache_relative_path, tarball)
+                    for mirror in mirrors]
+            if not urls:
+                continue
+            # the stage is only used to find where to save the tarball
+            stage = Stage(urls[0], name="build_cache", keep=True)
+            self.paths[spec.dag_hash()] = (urls, stage.save_filename)
+            self.pending.append(spec.dag_hash())
+            self.downloads[spec.dag_hash()] = None
+
+        self.threads = []
+        for _ in range(min(jobs, len(self.pending))):
+            thread = threading.Thread(target=self._download_pending)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _download_pending(self):
+        while True:
+            with self.condition:
+                while (self.pending and not self.stopped and
+                       self.stored >= self.budget):
+                    self.condition.wait()
+                if self.stopped or not self.pending:
+                    return
+                dag_hash = self.pending.pop(0)
+
+            urls, path = self.paths[dag_hash]
+            try:
+                path, size = self._download(dag_hash, urls, path)
+            except Exception as e:
+                tty.debug('Cannot prefetch {0}: {1}'.format(path, str(e)))
+                path, size = None, 0
+
+            with self.condition:
+                if dag_hash in self.downloads:
+                    self.downloads[dag_hash] = (path, size)
+                else:
+                    # taken or stopped in the meantime
+                    self.stored -= size
+                self.condition.notify_all()
+
+    def _reserve(self, dag_hash, size):
+        """Reserve size bytes of the budget for the download of a tarball,
+        waiting for tarballs to be taken if needed. Return False if the
+        download was cancelled in the meantime."""
+        with self.condition:
+            while (dag_hash in self.downloads and not self.stopped and
+                   not self._fits(size)):
+                # take() cancels the downloads it would wait for
+                self.waiting[dag_hash] = size
+                self.condition.notify_all()
+                self.condition.wait()
+            self.waiting.pop(dag_hash, None)
+            if dag_hash not in self.downloads or self.stopped:
+                return False
+            self.stored += size
+            return True
+
+    def _fits(self, size):
+        """Whether size more bytes fit in the budget. A tarball larger than
+        the budget fits when nothing else is stored."""
+        return self.stored == 0 or self.stored + size <= self.budget
+
+    def _adjust(self, size):
+        """Change the bytes reserved by size."""
+        with self.condition:
+            self.stored += size
+            self.condition.notify_all()
+
+    def _download(self, dag_hash, urls, path):
+        """
+        Save the tarball from the first URL that can be read to path.
+
+        Returns:
+            (tuple): path, or None if no URL can be read or the download was
+                cancelled, and the bytes reserved for it
+        """
+        if os.path.exists(path):
+            return path, 0
+        mkdirp(os.path.dirname(path))
+        partial_path = path + '.prefetch'
+        for url in urls:
+            reserved = 0
+            try:
+                _, headers, response = web_util.read_from_url(url)
+                try:
+                    size = int(web_util.get_header(headers, 'Content-Length'))
+                except (KeyError, TypeError, ValueError):
+                    size = self.budget
+                if not self._reserve(dag_hash, size):
+                    response.close()
+                    return None, 0
+                reserved = size
+                with open(partial_path, 'wb') as f:
+                    shutil.copyfileobj(response, f, 1 << 20)
+                os.rename(partial_path, path)
+                tty.debug('Prefetched {0}'.format(url_util.format(url)))
+                size = os.path.getsize(path)
+                self._adjust(size - reserved)
+                return path, size
+            except Exception as e:
+                tty.debug('Cannot prefetch {0}: {1}'.format(
+                    url_util.format(url), str(e)))
+                self._adjust(-reserved)
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+        return None, 0
+
+    def take(self, spec):
+        """
+        Wait for the download of the tarball of a spec.
+
+        Returns:
+            (str or None): the path of the downloaded tarball, or None if
+                the tarball must be downloaded with ``download_tarball``:
+                its download failed, or cannot start or complete within
+                the budget, or the spec was not given
+        """
+        dag_hash = spec.dag_hash()
+        with self.condition:
+            if dag_hash not in self.downloads:
+                return None
+            if dag_hash in self.pending:
+                self.pending.remove(dag_hash)
+                if self.stored >= self.budget:
+                    # it cannot start before tarballs are taken
+                    del self.downloads[dag_hash]
+                    return None
+                # download it next
+                self.pending.insert(0, dag_hash)
+            while self.downloads[dag_hash] is None:
+                if (dag_hash in self.waiting and
+                        not self._fits(self.waiting[dag_hash])):
+                    # it cannot complete before tarballs are taken
+                    del self.downloads[dag_hash]
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait()
+            path, size = self.downloads.pop(dag_hash)
+            self.stored -= size
+            self.condition.notify_all()
+            return path
+
+    def stop(self):
+        """Start no more downloads. Downloads in progress are completed in
+        the background."""
+        with self.condition:
+            self.stopped = True
+            for dag_hash in self.pending + list(self.waiting):
+                self.downloads.pop(dag_hash, None)
+            del self.pending[:]
+            self.condition.notify_all()
+
+
+def _platform_is(spec, name):
+    """Whether binaries of the spec are relocated as those of a platform,
+    i.e. they are for that platform, or for the test platform on it."""
+    return (spec.architecture.platform == name or
+            spec.architecture.platform == 'test' and
+            platform.system().lower() == name)
 
 
-def check_package_relocatable(workdir, spec, allow_root):
+def make_binary_relative(spec, path_name, data, old_layout_root, tmpdir):
+    """
+    Return the content of a binary of the install prefix with its
+    paths made relative. Only the binaries whose rpaths cannot be
+    changed in memory are written to a temporary copy to be changed.
+    """
+    if _platform_is(spec, 'linux'):
+        new_data = relocate.make_elf_data_relative(
+            data, path_name, old_layout_root)
+        if new_data is not None:
+            return new_data
+
+    cur_path_name = os.path.join(tmpdir, os.path.basename(path_name))
+    with open(cur_path_name, 'wb') as f:
+        f.write(data)
+    try:
+        if _platform_is(spec, 'darwin'):
+            relocate.make_macho_binaries_relative(
+                [cur_path_name], [path_name], old_layout_root)
+        if _platform_is(spec, 'linux'):
+            relocate.make_elf_binaries_relative(
+                [cur_path_name], [path_name], old_layout_root)
+        with open(cur_path_name, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(cur_path_name)
+
+
+def check_package_relocatable(spec, buildinfo, allow_root):
     """
     Check if package binaries are relocatable.
-    Change links to placeholder links.
     """
-    buildinfo = read_buildinfo_file(workdir)
     cur_path_names = list()
     for filename in buildinfo['relocate_binaries']:
-        cur_path_names.append(os.path.join(workdir, filename))
+        cur_path_names.append(os.path.join(spec.prefix, filename))
     relocate.check_files_relocatable(cur_path_names, allow_root)
 
 
-def relocate_package(spec, allow_root):
+def relocate_package(spec, allow_root, jobs=None):
     """
-    Relocate the given package
+    Relocate the given package, with ``jobs`` processes relocating its
+    files. The number of processes defaults to ``config:relocation_jobs``,
+    or to ``config:build_jobs`` if that is not set.
     """
+    if jobs is None:
+        jobs = (spack.config.get('config:relocation_jobs') or
+                spack.config.get('config:build_jobs', 1))
+    jobs = max(1, jobs)
     workdir = str(spec.prefix)
     buildinfo = read_buildinfo_file(workdir)
     new_layout_root = str(spack.store.layout.root)
@@ -578,23 +1738,37 @@ def relocate_package(spec, allow_root):
     def is_backup_file(file):
         return file.endswith('~')
 
+    # Offsets of the prefixes in the files, recorded by buildcache create
+    offsets = read_relocation_offsets(
+        workdir, buildinfo,
+        buildinfo['relocate_textfiles'] + buildinfo['relocate_binaries'])
+
     # Text files containing the prefix text
     text_names = list()
     for filename in buildinfo['relocate_textfiles']:
         text_name = os.path.join(workdir, filename)
+        # Files recorded without any prefix need not be relocated
+        if offsets is not None and text_name not in offsets:
+            continue
         # Don't add backup files generated by filter_file during install step.
         if not is_backup_file(text_name):
             text_names.append(text_name)
 
 # If we are installing back to the same location don't replace anything
     if old_layout_root != new_layout_root:
-        paths_to_relocate = [old_spack_prefix, old_layout_root]
-        paths_to_relocate.extend(prefix_to_hash.keys())
-        files_to_relocate = list(filter(
-            lambda pathname: not relocate.file_is_relocatable(
-                pathname, paths_to_relocate=paths_to_relocate),
-            map(lambda filename: os.path.join(workdir, filename),
-                buildinfo['relocate_binaries'])))
+        if offsets is not None:
+            # Binaries without any prefix need not be relocated
+            files_to_relocate = [
+                os.path.join(workdir, filename)
+                for filename in buildinfo['relocate_binaries']
+                if os.path.join(workdir, filename) in offsets]
+        else:
+            paths_to_relocate = [old_spack_prefix, old_layout_root]
+            paths_to_relocate.extend(prefix_to_hash.keys())
+            files_to_relocate = relocate.non_relocatable_files(
+                [os.path.join(workdir, filename)
+                 for filename in buildinfo['relocate_binaries']],
+                paths_to_relocate, jobs)
         # If the buildcache was not created with relativized rpaths
         # do the relocation of path in binaries
         if (spec.architecture.platform == 'darwin' or
@@ -614,7 +1788,7 @@ def is_backup_file(file):
                                            new_layout_root,
                                            prefix_to_prefix, rel,
                                            old_prefix,
-                                           new_prefix)
+                                           new_prefix, jobs)
         # Relocate links to the new install prefix
             link_names = [linkname
                           for linkname in buildinfo.get('relocate_links', [])]
@@ -632,7 +1806,7 @@ def is_backup_file(file):
                                old_prefix, new_prefix,
                                old_spack_prefix,
                                new_spack_prefix,
-                               prefix_to_prefix)
+                               prefix_to_prefix, offsets, jobs)
 
         # relocate the install prefixes in binary files including dependencies
         relocate.relocate_text_bin(files_to_relocate,
@@ -640,7 +1814,42 @@ def is_backup_file(file):
                                    old_prefix, new_prefix,
                                    old_spack_prefix,
                                    new_spack_prefix,
-                                   prefix_to_prefix)
+                                   prefix_to_prefix, offsets, jobs)
+
+
+def _extract_blobs(spec, spackfile, bchecksum, compression):
+    """
+    Extract the install prefix of a spec from the manifest in its .spack
+    archive and the blobs of its files, fetching the blobs missing from
+    the local blob cache from the mirrors.
+
+    Returns:
+        (str): the sha256 checksum of the manifest, checked against
+            bchecksum before anything is downloaded
+    """
+    manifest_name = tarball_name(spec, '.manifest.json')
+    stream = _HashingReader(spackfile.extractfile(manifest_name))
+    data = b''.join(iter(lambda: stream.read(65536), b''))
+    manifest = sjson.load(data.decode('utf-8'))['manifest']
+    checksum = stream.hexdigest()
+    if bchecksum['hash'] != checksum:
+        raise NoChecksumException(
+            "Package manifest failed checksum verification.\n"
+            "It cannot be installed.")
+    if manifest['version'] > _manifest_version:
+        raise ValueError('manifest version {0} is not supported'
+                         .format(manifest['version']))
+
+    members = manifest['members']
+    blob_paths = _fetch_blobs(
+        set(m['sha256'] for m in members if 'sha256' in m), compression)
+
+    mkdirp(spec.prefix)
+    chunks = _blob_tarball_chunks(members, blob_paths, compression)
+    with closing(tarfile.open(fileobj=_ChunksReader(chunks), mode='r|')) \
+            as tar:
+        tar.extractall(spec.prefix, members=_prefix_members(tar))
+    return checksum
 
 
 def extract_tarball(spec, filename, allow_root=False, unsigned=False,
@@ -658,43 +1867,81 @@ def extract_tarball(spec, filename, allow_root=False, unsigned=False,
     stagepath = os.path.dirname(filename)
     spackfile_name = tarball_name(spec, '.spack')
     spackfile_path = os.path.join(stagepath, spackfile_name)
-    tarfile_name = tarball_name(spec, '.tar.gz')
-    tarfile_path = os.path.join(tmpdir, tarfile_name)
     specfile_name = tarball_name(spec, '.spec.yaml')
     specfile_path = os.path.join(tmpdir, specfile_name)
 
-    with closing(tarfile.open(spackfile_path, 'r')) as tar:
-        tar.extractall(tmpdir)
-    # some buildcache tarfiles use bzip2 compression
-    if not os.path.exists(tarfile_path):
-        tarfile_name = tarball_name(spec, '.tar.bz2')
-        tarfile_path = os.path.join(tmpdir, tarfile_name)
+    # only the spec file and its signature are extracted from the .spack
+    # archive, the tarball is read from it while it is installed
+    spackfile = tarfile.open(spackfile_path, 'r')
+    names = spackfile.getnames()
+    for name in (specfile_name, '%s.asc' % specfile_name):
+        if name in names:
+            spackfile.extract(name, tmpdir)
     if not unsigned:
         if os.path.exists('%s.asc' % specfile_path):
             try:
                 suppress = config.get('config:suppress_gpg_warnings', False)
                 Gpg.verify('%s.asc' % specfile_path, specfile_path, suppress)
             except Exception as e:
+                spackfile.close()
                 shutil.rmtree(tmpdir)
                 raise e
         else:
+            spackfile.close()
             shutil.rmtree(tmpdir)
             raise NoVerifyException(
                 "Package spec file failed signature verification.\n"
                 "Use spack buildcache keys to download "
                 "and install a key for verification from the mirror.")
-    # get the sha256 checksum of the tarball
-    checksum = checksum_tarball(tarfile_path)
-
-    # get the sha256 checksum recorded at creation
     spec_dict = {}
     with open(specfile_path, 'r') as inputfile:
         content = inputfile.read()
         spec_dict = syaml.load(content)
+
+    # tarballs made before the compression was recorded use gzip
+    compression = spec_dict.get('binary_cache_compression', 'gzip')
+    try:
+        compression_util.check_compression(compression)
+    except compression_util.UnsupportedCompressionError as e:
+        spackfile.close()
+        shutil.rmtree(tmpdir)
+        raise e
+    tarfile_name = tarball_name(
+        spec, compression_util.tarball_extensions[compression])
+    layout = spec_dict.get('binary_cache_layout', 'archive')
+    # some buildcache tarfiles use bzip2 compression
+    if layout == 'archive' and tarfile_name not in names:
+        compression = None
+        tarfile_name = tarball_name(spec, '.tar.bz2')
+
+    # extract the tarball directly into the prefix, checking its sha256
+    # checksum, recorded at creation, on the way
     bchecksum = spec_dict['binary_cache_checksum']
+    try:
+        if layout == 'blobs':
+            checksum = _extract_blobs(spec, spackfile, bchecksum, compression)
+        else:
+            stream = _HashingReader(spackfile.extractfile(tarfile_name))
+            if compression is None:
+                tar = tarfile.open(fileobj=stream, mode='r|bz2')
+            else:
+                tar = tarfile.open(
+                    fileobj=compression_util.decompressed_reader(
+                        stream, compression), mode='r|')
+            mkdirp(spec.prefix)
+            with closing(tar):
+                tar.extractall(spec.prefix, members=_prefix_members(tar))
+            checksum = stream.hexdigest()
+    except Exception as e:
+        shutil.rmtree(spec.prefix, ignore_errors=True)
+        shutil.rmtree(tmpdir)
+        raise e
+    finally:
+        spackfile.close()
 
     # if the checksums don't match don't install
     if bchecksum['hash'] != checksum:
+        shutil.rmtree(spec.prefix)
         shutil.rmtree(tmpdir)
         raise NoChecksumException(
             "Package tarball failed checksum verification.\n"
@@ -720,29 +1967,7 @@ def extract_tarball(spec, filename, allow_root=False, unsigned=False,
 #        msg += "uses relative rpaths."
 #        raise NewLayoutException(msg)
 
-    # extract the tarball in a temp directory
-    with closing(tarfile.open(tarfile_path, 'r')) as tar:
-        tar.extractall(path=tmpdir)
-    # get the parent directory of the file .spack/binary_distribution
-    # this should the directory unpacked from the tarball whose
-    # name is unknown because the prefix naming is unknown
-    bindist_file = glob.glob('%s/*/.spack/binary_distribution' % tmpdir)[0]
-    workdir = re.sub('/.spack/binary_distribution$', '', bindist_file)
-    tty.debug('workdir %s' % workdir)
-    # install_tree copies hardlinks
-    # create a temporary tarfile from prefix and exract it to workdir
-    # tarfile preserves hardlinks
-    temp_tarfile_name = tarball_name(spec, '.tar')
-    temp_tarfile_path = os.path.join(tmpdir, temp_tarfile_name)
-    with closing(tarfile.open(temp_tarfile_path, 'w')) as tar:
-        tar.add(name='%s' % workdir,
-                arcname='.')
-    with closing(tarfile.open(temp_tarfile_path, 'r')) as tar:
-        tar.extractall(spec.prefix)
-    os.remove(temp_tarfile_path)
-
     # cleanup
-    os.remove(tarfile_path)
     os.remove(specfile_path)
 
     try:
@@ -766,6 +1991,125 @@ def extract_tarball(spec, filename, allow_root=False, unsigned=False,
 # Internal cache for downloaded specs
 _cached_specs = set()
 
+# Indices of the build caches read by this process, as (sha256 checksum,
+# index) tuples by URL of the build cache, or (None, None) if the build
+# cache has no index. Copies of the indices are kept in the misc cache.
+_cached_indices = {}
+
+
+def _read_url(url):
+    """Return the content of a URL, or None if it can't be read."""
+    try:
+        _, _, response = web_util.read_from_url(url)
+        return response.read()
+    except (URLError, web_util.SpackWebError) as e:
+        tty.debug('Cannot read {0}: {1}'.format(url, str(e)))
+        return None
+
+
+def _index_cache_key(cache_url):
+    """Key of the copy of the index of a build cache in the misc cache."""
+    url_hash = hashlib.sha256(
+        url_util.format(cache_url).encode('utf-8')).hexdigest()
+    return '{0}/{1}.json'.format(_index_cache_dir, url_hash)
+
+
+def _read_cached_index(cache_url):
+    """Return the copy of the index of a build cache kept in the misc cache,
+    as a (sha256 checksum, index) tuple, or None if there is none."""
+    cache = spack.caches.misc_cache
+    key = _index_cache_key(cache_url)
+    try:
+        if not cache.init_entry(key):
+            return None
+        with cache.read_transaction(key) as f:
+            index_hash = f.readline().strip()
+            index = _load_index_text(f.read())
+    except (CacheError, IOError, OSError, ValueError) as e:
+        tty.debug('Ignoring cached index {0}: {1}'.format(key, str(e)))
+        return None
+    if index is None:
+        return None
+    return index_hash, index
+
+
+def _write_cached_index(cache_url, index_hash, text):
+    """Keep a copy of the index of a build cache in the misc cache, as
+    its checksum on the first line followed by its JSON text."""
+    key = _index_cache_key(cache_url)
+    try:
+        with spack.caches.misc_cache.write_transaction(key) as (old, new):
+            new.write(index_hash + '\n')
+            new.write(text)
+    except (CacheError, IOError, OSError) as e:
+        tty.debug('Cannot cache index {0}: {1}'.format(key, str(e)))
+
+
+def get_index(cache_url, revalidate=True):
+    """
+    Return the index of the specs of a build cache, as generated by
+    ``generate_package_index``.
+
+    A copy of the index is kept in the misc cache, shared by all Spack
+    processes, and in memory. The first time a process reads the index,
+    and every time after when ``revalidate`` is True, the small index hash
+    file of the build cache is read to check that the copy is current. The
+    index itself is only downloaded if it changed.
+
+    Args:
+        cache_url (str): URL of the build cache of a mirror
+        revalidate (bool): whether to check an index read before by this
+            process
+
+    Returns:
+        (dict or None): content of the spec.yaml files of the build cache,
+            by file name, or None if the build cache has no index
+    """
+    cached = _cached_indices.get(cache_url)
+    if cached is not None and not revalidate:
+        return cached[1]
+    if cached is None:
+        cached = _read_cached_index(cache_url)
+
+    if cached is not None:
+        remote_hash = _read_url(
+            url_util.join(cache_url, BUILD_CACHE_INDEX_HASH_NAME))
+        if (remote_hash is not None and
+                remote_hash.decode('utf-8').strip() == cached[0]):
+            _cached_indices[cache_url] = cached
+            return cached[1]
+
+    data = _read_url(url_util.join(cache_url, BUILD_CACHE_INDEX_NAME))
+    index = None
+    if data is not None:
+        try:
+            text = _index_text(data)
+            index = _load_index_text(text)
+        except (IOError, ValueError) as e:
+            tty.warn('Ignoring the index of {0}: {1}'.format(
+                url_util.format(cache_url), str(e)))
+    if index is None:
+        # remember build caches without an index too
+        _cached_indices[cache_url] = (None, None)
+        return None
+
+    index_hash = hashlib.sha256(data).hexdigest()
+    _cached_indices[cache_url] = (index_hash, index)
+    _write_cached_index(cache_url, index_hash, text)
+    return index
+
+
+def _specs_from_index(index, names):
+    """Add the specs of the index with the given spec file names to the
+    cached specs, and return them."""
+    global _cached_specs
+    for name in names:
+        # All specs in build caches are concrete (as they are built)
+        spec = Spec.from_dict(index[name])
+        spec._mark_concrete()
+        _cached_specs.add(spec)
+    return _cached_specs
+
 
 def try_download_specs(urls=None, force=False):
     '''
@@ -815,6 +2159,13 @@ def get_spec(spec=None, force=False):
         fetch_url_build_cache = url_util.join(
             mirror.fetch_url, _build_cache_relative_path)
 
+        # the spec is looked up in the index of the build cache, read once,
+        # and downloaded if it was pushed without updating the index
+        index = get_index(fetch_url_build_cache, revalidate=False)
+        if index is not None and specfile_name in index:
+            _specs_from_index(index, [specfile_name])
+            continue
+
         mirror_dir = url_util.local_file_path(fetch_url_build_cache)
         if mirror_dir:
             tty.msg("Finding buildcaches in %s" % mirror_dir)
@@ -852,6 +2203,17 @@ def get_specs(force=False, allarch=False):
         fetch_url_build_cache = url_util.join(
             mirror.fetch_url, _build_cache_relative_path)
 
+        # build caches with an index are read with a single request
+        if force:
+            _cached_indices.pop(fetch_url_build_cache, None)
+        index = get_index(fetch_url_build_cache)
+        if index is not None:
+            tty.msg("Reading the index of buildcaches at %s" %
+                    url_util.format(fetch_url_build_cache))
+            _specs_from_index(
+                index, [name for name in index if arch_re.search(name)])
+            continue
+
         mirror_dir = url_util.local_file_path(fetch_url_build_cache)
         if mirror_dir:
             tty.msg("Finding buildcaches in %s" % mirror_dir)
@@ -971,6 +2333,13 @@ def needs_rebuild(spec, mirror_url, rebuild_on_errors=False):
         return rebuild_on_errors
 
     spec_yaml = syaml.load(yaml_contents)
+    return _full_hash_changed(spec, spec_yaml)
+
+
+def _full_hash_changed(spec, spec_yaml):
+    """Whether the full hash of a spec differs from the one of its
+    spec.yaml on a mirror, reporting why it must be rebuilt if so."""
+    pkg_full_hash = spec.full_hash()
 
     # If either the full_hash didn't exist in the .spec.yaml file, or it
     # did, but didn't match the one we computed locally, then we should
@@ -991,6 +2360,57 @@ def needs_rebuild(spec, mirror_url, rebuild_on_errors=False):
     return False
 
 
+def specs_needing_rebuild(specs, mirror_url, rebuild_on_errors=False):
+    """Return the specs that need to be rebuilt for a mirror, as decided by
+    ``needs_rebuild``, checking them in bulk.
+
+    When the build cache of the mirror has an index, it is read once and
+    the full hashes of all the specs are compared to it in memory. Specs
+    missing from the index are rebuilt. Without an index, the spec.yaml
+    files of the specs are downloaded by a bounded pool of threads.
+
+    Arguments:
+        specs (list): concrete specs to check
+        mirror_url (str): URL of the mirror
+        rebuild_on_errors (boolean): Treat any errors encountered while
+            checking a spec as a signal to rebuild it.
+
+    Returns:
+        (list): the specs to rebuild, in the order of ``specs``
+    """
+    for spec in specs:
+        if not spec.concrete:
+            raise ValueError('spec must be concrete to check against mirror')
+
+    index = get_index(url_util.join(mirror_url, _build_cache_relative_path))
+    if index is not None:
+        rebuilds = []
+        for spec in specs:
+            spec_yaml = index.get(tarball_name(spec, '.spec.yaml'))
+            if spec_yaml is None:
+                tty.msg('Rebuilding {0}, reason: missing from the index of '
+                        'the build cache'.format(spec.short_spec))
+                rebuilds.append(spec)
+            elif _full_hash_changed(spec, spec_yaml):
+                rebuilds.append(spec)
+        return rebuilds
+
+    def check(spec):
+        return needs_rebuild(spec, mirror_url, rebuild_on_errors)
+
+    jobs = min(_rebuild_check_jobs, len(specs))
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        try:
+            rebuilds = pool.map(check, specs)
+        finally:
+            pool.terminate()
+    else:
+        rebuilds = [check(spec) for spec in specs]
+
+    return [spec for spec, rebuild in zip(specs, rebuilds) if rebuild]
+
+
 def check_specs_against_mirrors(mirrors, specs, output_file=None,
                                 rebuild_on_errors=False):
     """Check all the given specs against buildcaches on the given mirrors and
@@ -1014,14 +2434,11 @@ def check_specs_against_mirrors(mirrors, specs, output_file=None,
     for mirror in spack.mirror.MirrorCollection(mirrors).values():
         tty.msg('Checking for built specs at %s' % mirror.fetch_url)
 
-        rebuild_list = []
-
-        for spec in specs:
-            if needs_rebuild(spec, mirror.fetch_url, rebuild_on_errors):
-                rebuild_list.append({
-                    'short_spec': spec.short_spec,
-                    'hash': spec.dag_hash()
-                })
+        rebuild_list = [{
+            'short_spec': spec.short_spec,
+            'hash': spec.dag_hash()
+        } for spec in specs_needing_rebuild(
+            specs, mirror.fetch_url, rebuild_on_errors)]
 
         if rebuild_list:
             rebuilds[mirror.fetch_url] = {
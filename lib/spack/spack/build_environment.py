@@ -44,7 +44,7 @@
 import llnl.util.tty as tty
 from llnl.util.tty.color import cescape, colorize
 from llnl.util.filesystem import mkdirp, install, install_tree
-from llnl.util.lang import dedupe
+from llnl.util.lang import dedupe, memoized
 
 import spack.build_systems.cmake
 import spack.build_systems.meson
@@ -53,6 +53,8 @@
 import spack.paths
 import spack.schema.environment
 import spack.store
+import spack.util.jobserver
+import spack.version
 from spack.util.string import plural
 from spack.util.environment import (
     env_flag, filter_system_paths, get_path, is_system_path,
@@ -104,13 +106,18 @@ class MakeExecutable(Executable):
        parallelism level (without affecting the normal invocation with
        -j).
 
+       If a jobserver is given, parallel calls of make, and of ninja where
+       it supports jobservers, take their jobs from it instead of running
+       a fixed number of them.
+
        Note that if the SPACK_NO_PARALLEL_MAKE env var is set it overrides
        everything.
     """
 
-    def __init__(self, name, jobs):
+    def __init__(self, name, jobs, jobserver=None):
         super(MakeExecutable, self).__init__(name)
         self.jobs = jobs
+        self.jobserver = jobserver
 
     def __call__(self, *args, **kwargs):
         """parallel, and jobs_env from kwargs are swallowed and used here;
@@ -121,15 +128,46 @@ def __call__(self, *args, **kwargs):
         parallel = (not disable) and kwargs.pop('parallel', self.jobs > 1)
 
         if parallel:
-            args = ('-j{0}'.format(self.jobs),) + args
+            extra_env = dict(kwargs.get('extra_env', {}))
+            makeflags = self._jobserver_makeflags()
+            if makeflags:
+                extra_env['MAKEFLAGS'] = makeflags
+                kwargs['pass_fds'] = self.jobserver.fds
+            else:
+                args = ('-j{0}'.format(self.jobs),) + args
             jobs_env = kwargs.pop('jobs_env', None)
             if jobs_env:
                 # Caller wants us to set an environment variable to
                 # control the parallelism.
-                kwargs['extra_env'] = {jobs_env: str(self.jobs)}
+                extra_env[jobs_env] = str(self.jobs)
+            kwargs['extra_env'] = extra_env
 
         return super(MakeExecutable, self).__call__(*args, **kwargs)
 
+    def _jobserver_makeflags(self):
+        """MAKEFLAGS passing the jobserver to this executable, or None if
+        there is no jobserver or the executable cannot use it."""
+        if self.jobserver is None:
+            return None
+        if self.name in ('make', 'gmake'):
+            return self.jobserver.makeflags()
+        if self.name == 'ninja' and self.jobserver.fifo and \
+                _ninja_supports_jobserver(self.path):
+            return self.jobserver.makeflags(fifo=True)
+        return None
+
+
+@memoized
+def _ninja_supports_jobserver(path):
+    """Ninja is a jobserver client as of version 1.13."""
+    version = Executable(path)(
+        '--version', output=str, error=os.devnull, fail_on_error=False)
+    try:
+        return spack.version.Version(version.strip()) >= \
+            spack.version.Version('1.13')
+    except (TypeError, ValueError):
+        return False
+
 
 def clean_environment():
     # Stuff in here sanitizes the build environment to eliminate
@@ -421,11 +459,14 @@ def _set_variables_for_single_module(pkg, module):
     m = module
     m.make_jobs = jobs
 
+    # Share the jobs of the install session with make and ninja
+    jobserver = spack.util.jobserver.current()
+
     # TODO: make these build deps that can be installed if not found.
-    m.make = MakeExecutable('make', jobs)
-    m.gmake = MakeExecutable('gmake', jobs)
+    m.make = MakeExecutable('make', jobs, jobserver)
+    m.gmake = MakeExecutable('gmake', jobs, jobserver)
     m.scons = MakeExecutable('scons', jobs)
-    m.ninja = MakeExecutable('ninja', jobs)
+    m.ninja = MakeExecutable('ninja', jobs, jobserver)
 
     # easy shortcut to os.environ
     m.env = os.environ
@@ -785,6 +826,32 @@ def child_fun():
     passes it to the parent wrapped in a ChildError.  The parent is
     expected to handle (or re-raise) the ChildError.
     """
+    return start_build_process(pkg, function, dirty, fake).complete()
+
+
+def start_build_process(pkg, function, dirty, fake, jobs=None,
+                        forward_input=True):
+    """Start a child process to do part of a spack build, without waiting.
+
+    This is the non-blocking half of ``fork()``, which allows several
+    builds to run at the same time.
+
+    Args:
+        pkg (PackageBase): package whose environment we should set up the
+            forked process for.
+        function (callable): argless function to run in the child
+            process.
+        dirty (bool): If True, do NOT clean the environment before
+            building.
+        fake (bool): If True, skip package setup b/c it's not a real build
+        jobs (int or None): if set, the number of build jobs the child uses
+            in place of ``config:build_jobs``
+        forward_input (bool): If True, the child reads from the terminal
+            (e.g. to toggle verbosity). Only one concurrent build should.
+
+    Returns:
+        (BuildProcess): the running child process
+    """
 
     def child_process(child_pipe, input_stream):
         # We are in the child process. Python sets sys.stdin to
@@ -796,6 +863,9 @@ def child_process(child_pipe, input_stream):
             sys.stdin = input_stream
 
         try:
+            if jobs is not None:
+                spack.config.set('config:build_jobs', jobs,
+                                 scope='command_line')
             if not fake:
                 setup_package(pkg, dirty=dirty)
             return_value = function()
@@ -838,7 +908,8 @@ def child_process(child_pipe, input_stream):
     input_stream = None
     try:
         # Forward sys.stdin when appropriate, to allow toggling verbosity
-        if sys.stdin.isatty() and hasattr(sys.stdin, 'fileno'):
+        if forward_input and sys.stdin.isatty() and \
+                hasattr(sys.stdin, 'fileno'):
             input_stream = os.fdopen(os.dup(sys.stdin.fileno()))
 
         p = multiprocessing.Process(
@@ -854,22 +925,62 @@ def child_process(child_pipe, input_stream):
         if input_stream is not None:
             input_stream.close()
 
-    child_result = parent_pipe.recv()
-    p.join()
+    # Only the child writes to its end of the pipe. Closing it here lets
+    # the parent see EOF if the child dies without sending a result.
+    child_pipe.close()
+
+    return BuildProcess(pkg, p, parent_pipe)
 
-    # let the caller know which package went wrong.
-    if isinstance(child_result, InstallError):
-        child_result.pkg = pkg
 
-    # If the child process raised an error, print its output here rather
-    # than waiting until the call to SpackError.die() in main(). This
-    # allows exception handling output to be logged from within Spack.
-    # see spack.main.SpackCommand.
-    if isinstance(child_result, ChildError):
-        child_result.print_context()
-        raise child_result
+class BuildProcess(object):
+    """A child process started by ``start_build_process()``."""
 
-    return child_result
+    def __init__(self, pkg, process, pipe):
+        self.pkg = pkg
+        self.process = process
+        self.pipe = pipe
+
+    def fileno(self):
+        """File descriptor that becomes readable when the child is done,
+        so that running builds can be waited on with ``select``."""
+        return self.pipe.fileno()
+
+    def complete(self):
+        """Wait for the child and return the result of its function.
+
+        Raises the ChildError sent by the child if the build failed.
+        """
+        try:
+            child_result = self.pipe.recv()
+        except EOFError:
+            self.process.join()
+            raise InstallError(
+                'Build process for {0} exited without a result (code {1})'
+                .format(self.pkg.name, self.process.exitcode))
+        finally:
+            self.pipe.close()
+        self.process.join()
+
+        # let the caller know which package went wrong.
+        if isinstance(child_result, InstallError):
+            child_result.pkg = self.pkg
+
+        # If the child process raised an error, print its output here rather
+        # than waiting until the call to SpackError.die() in main(). This
+        # allows exception handling output to be logged from within Spack.
+        # see spack.main.SpackCommand.
+        if isinstance(child_result, ChildError):
+            child_result.print_context()
+            raise child_result
+
+        return child_result
+
+    def terminate(self):
+        """Stop the child without waiting for its result."""
+        self.pipe.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
 
 
 def get_package_context(traceback, context=3):
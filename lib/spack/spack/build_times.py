@@ -0,0 +1,90 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+"""Durations of past builds, used to schedule installations.
+
+The duration of each phase of a build is recorded in the misc cache, in one
+file per package, keyed on the version, variants and compiler of the spec
+that was built.  The installer uses these durations to start the builds on
+the longest chains of dependents first.
+"""
+import json
+
+import llnl.util.tty as tty
+
+import spack.caches
+import spack.util.spack_json as sjson
+from spack.util.file_cache import CacheError
+
+#: Directory of the misc cache holding build durations
+_build_times_dir = 'build-times'
+
+#: Duration assumed, in seconds, for packages never built before
+default_duration = 60.0
+
+
+def _cache_key(name):
+    return '{0}/{1}.json'.format(_build_times_dir, name)
+
+
+def _spec_key(spec):
+    """Identify builds of the same package that should take as long."""
+    return spec.format(
+        '{version}{variants}{%compiler.name}{@compiler.version}')
+
+
+def _read(name):
+    """Return the recorded build durations of a package, by spec key."""
+    cache = spack.caches.misc_cache
+    key = _cache_key(name)
+    try:
+        if not cache.init_entry(key):
+            return {}
+        with cache.read_transaction(key) as f:
+            return sjson.load(f)
+    except (CacheError, IOError, OSError, ValueError) as e:
+        tty.debug('Ignoring build times {0}: {1}'.format(key, str(e)))
+        return {}
+
+
+def record(spec, phases):
+    """Record the duration of the build of a spec.
+
+    Args:
+        spec (Spec): concrete spec that was built
+        phases (dict): duration of each phase of the build, in seconds
+    """
+    key = _cache_key(spec.name)
+    try:
+        with spack.caches.misc_cache.write_transaction(key) as (old, new):
+            times = {}
+            if old:
+                try:
+                    times = sjson.load(old)
+                except ValueError:
+                    # Start over rather than keep a corrupt file
+                    pass
+            times[_spec_key(spec)] = phases
+            json.dump(times, new, separators=(',', ':'))
+    except (CacheError, IOError, OSError, ValueError) as e:
+        tty.debug('Cannot record build time of {0}: {1}'
+                  .format(spec.name, str(e)))
+
+
+def duration(spec):
+    """Estimate how long the build of a spec takes, in seconds.
+
+    The recorded duration of the same build is used if there is one,
+    otherwise the mean duration of the other builds of the package, or
+    ``default_duration`` if the package has never been built.
+    """
+    times = _read(spec.name)
+    if not times:
+        return default_duration
+
+    phases = times.get(_spec_key(spec))
+    if phases is not None:
+        return sum(phases.values())
+    return sum(sum(p.values()) for p in times.values()) / len(times)
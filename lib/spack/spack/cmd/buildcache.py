@@ -73,6 +73,24 @@ def setup_parser(subparser):
                                             "building package(s)")
     create.add_argument('-y', '--spec-yaml', default=None,
                         help='Create buildcache entry for spec from yaml file')
+    create.add_argument('--compression', default=None,
+                        choices=['gzip', 'zstd'],
+                        help="compression of the tarballs. defaults to " +
+                             "config:buildcache_compression")
+    create.add_argument('--compression-level', default=None, type=int,
+                        metavar='level',
+                        help="compression level of the tarballs. defaults" +
+                             " to config:buildcache_compression_level")
+    create.add_argument('--layout', default=None,
+                        choices=['archive', 'blobs'],
+                        help="layout of the buildcaches. blobs stores " +
+                             "each file once per mirror, by checksum. " +
+                             "defaults to config:buildcache_layout")
+    create.add_argument('-j', '--jobs', action='store', type=int,
+                        default=None,
+                        help="create and upload the buildcaches of this " +
+                             "many specs at a time, and update the index " +
+                             "once at the end")
     create.add_argument('--only', default='package,dependencies',
                         dest='things_to_install',
                         choices=['package', 'dependencies'],
@@ -325,7 +343,8 @@ def match_downloaded_specs(pkgs, allow_multiple_matches=False, force=False,
 
 def _createtarball(env, spec_yaml, packages, add_spec, add_deps,
                    output_location, key, force, rel, unsigned, allow_root,
-                   no_rebuild_index):
+                   no_rebuild_index, compression=None,
+                   compression_level=None, jobs=None, layout=None):
     if spec_yaml:
         packages = set()
         with open(spec_yaml, 'r') as fd:
@@ -392,11 +411,19 @@ def _createtarball(env, spec_yaml, packages, add_spec, add_deps,
 
     tty.debug('writing tarballs to %s/build_cache' % outdir)
 
+    if jobs is not None:
+        bindist.build_tarballs(specs, outdir, force, rel, unsigned,
+                               allow_root, signkey, not no_rebuild_index,
+                               compression, compression_level, jobs,
+                               layout)
+        return
+
     for spec in specs:
         tty.debug('creating binary cache file for package %s ' % spec.format())
         bindist.build_tarball(spec, outdir, force, rel,
                               unsigned, allow_root, signkey,
-                              not no_rebuild_index)
+                              not no_rebuild_index, compression,
+                              compression_level, layout)
 
 
 def createtarball(args):
@@ -440,12 +467,17 @@ def createtarball(args):
         if scheme == '<missing>':
             raise ValueError(
                 '"{url}" is not a valid URL'.format(url=output_location))
+    if args.jobs is not None and args.jobs < 1:
+        tty.die('invalid value for --jobs: expected a positive integer')
+
     add_spec = ('package' in args.things_to_install)
     add_deps = ('dependencies' in args.things_to_install)
 
     _createtarball(env, args.spec_yaml, args.specs, add_spec, add_deps,
                    output_location, args.key, args.force, args.rel,
-                   args.unsigned, args.allow_root, args.no_rebuild_index)
+                   args.unsigned, args.allow_root, args.no_rebuild_index,
+                   args.compression, args.compression_level, args.jobs,
+                   args.layout)
 
 
 def installtarball(args):
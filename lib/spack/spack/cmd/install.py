@@ -44,6 +44,7 @@ def update_kwargs_from_args(args, kwargs):
         'explicit': True,  # Always true for install command
         'stop_at': args.until,
         'unsigned': args.unsigned,
+        'concurrent_packages': args.concurrent_packages,
     })
 
     kwargs.update({
@@ -75,6 +76,10 @@ def setup_parser(subparser):
         '-u', '--until', type=str, dest='until', default=None,
         help="phase to stop after when installing (default None)")
     arguments.add_common_arguments(subparser, ['jobs'])
+    subparser.add_argument(
+        '-p', '--concurrent-packages', type=int, default=None,
+        help="maximum number of packages to build at the same time, "
+             "sharing the --jobs cores (default: config:concurrent_packages)")
     subparser.add_argument(
         '--overwrite', action='store_true',
         help="reinstall an existing spec, even if it has dependents")
@@ -3,6 +3,8 @@
 #
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
+import llnl.util.tty as tty
+
 import spack.store
 
 description = "rebuild Spack's package database"
@@ -10,5 +12,14 @@
 level = "long"
 
 
+def setup_parser(subparser):
+    subparser.add_argument(
+        '-j', '--jobs', action='store', type=int, default=None,
+        help="number of processes reading the install tree "
+             "(default: config:db_reindex_jobs)")
+
+
 def reindex(parser, args):
-    spack.store.store.reindex()
+    if args.jobs is not None and args.jobs < 1:
+        tty.die('invalid value for --jobs: expected a positive integer')
+    spack.store.store.reindex(jobs=args.jobs)
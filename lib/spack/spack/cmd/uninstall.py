@@ -122,10 +122,9 @@ def installed_dependents(specs, env):
 
     env_hashes = set(env.all_hashes()) if env else set()
 
-    all_specs_in_db = spack.store.db.query()
-
     for spec in specs:
-        installed = [x for x in all_specs_in_db if spec in x]
+        installed = spack.store.db.installed_relatives(
+            spec, 'parents', True)
 
         # separate installed dependents into dpts in this environment and
         # dpts that are outside this environment
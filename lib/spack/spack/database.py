@@ -20,8 +20,15 @@
 filesystem.
 """
 
+import bisect
 import contextlib
 import datetime
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
 import socket
 import sys
@@ -32,20 +39,28 @@
 except ImportError:
     _use_uuid = False
     pass
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 import llnl.util.tty as tty
+import ruamel.yaml as yaml
 import six
+import spack.caches
+import spack.dependency
 import spack.repo
 import spack.spec
 import spack.store
 import spack.util.lock as lk
 import spack.util.spack_json as sjson
 from llnl.util.filesystem import mkdirp
-from spack.directory_layout import DirectoryLayoutError
+from spack.directory_layout import DirectoryLayoutError, SpecReadError
 from spack.error import SpackError
 from spack.filesystem_view import YamlFilesystemView
 from spack.util.crypto import bit_length
-from spack.version import Version
+from spack.util.file_cache import CacheError
+from spack.version import Version, VersionList
 
 # TODO: Provide an API automatically retyring a build after detecting and
 # TODO: clearing a failure.
@@ -86,6 +101,66 @@
 # Types of dependencies tracked by the database
 _tracked_deps = ('link', 'run')
 
+# Directory of the misc cache holding copies of upstream database indexes
+_upstream_cache_dir = 'upstream-db'
+
+# Minimum number of seconds between two progress reports during a reindex
+_reindex_report_interval = 10
+
+
+def _glob_spec_files(pattern):
+    """Expand one of the spec file globs of a layout (reindex worker)."""
+    return glob.glob(pattern)
+
+
+def _read_spec_file(path):
+    """Parse a spec file found during a reindex (reindex worker).
+
+    Returns a ``(path, data, ctime, error)`` tuple holding only plain
+    data, which is cheap to send back to the parent process. ``ctime`` is
+    the change time of the prefix and ``error`` is None on success.
+    """
+    try:
+        with open(path) as f:
+            data = yaml.load(f)
+        prefix = os.path.dirname(os.path.dirname(path))
+        return path, data, os.stat(prefix).st_ctime, None
+    except Exception as e:
+        return path, None, None, str(e)
+
+
+class _ReindexProgress(object):
+    """Periodically reports the progress and throughput of a reindex."""
+
+    def __init__(self, action, total):
+        self.action = action
+        self.total = total
+        self.done = 0
+        self.start = self.last_report = time.time()
+
+    def update(self, count=1):
+        self.done += count
+        now = time.time()
+        if now - self.last_report < _reindex_report_interval:
+            return
+
+        self.last_report = now
+        rate = self.done / (now - self.start)
+        left = (self.total - self.done) / rate if rate else 0
+        tty.msg('{0} {1}/{2} spec files [{3:.1f}/s, about {4}m{5:02d}s left]'
+                .format(self.action, self.done, self.total, rate,
+                        *divmod(int(left), 60)))
+
+    def finish(self):
+        elapsed = time.time() - self.start
+        msg = '{0} {1} spec files in {2:.1f}s'.format(
+            self.action, self.done, elapsed)
+        # Only long phases, which reported progress, get a summary
+        if self.last_report != self.start:
+            tty.msg(msg)
+        else:
+            tty.debug(msg)
+
 
 def _now():
     """Returns the time since the epoch"""
@@ -157,6 +232,10 @@ class InstallRecord(object):
         explicit (bool, optional): whether or not this spec was explicitly
             installed, or pulled-in as a dependency of something else
         installation_time (time, optional): time of the installation
+
+    Records read from the database file are created without a spec. They
+    keep the node dictionary of the spec from the file instead, and the
+    spec is built the first time it is accessed.
     """
 
     def __init__(
@@ -169,7 +248,7 @@ def __init__(
             installation_time=None,
             deprecated_for=None
     ):
-        self.spec = spec
+        self._spec = spec
         self.path = str(path) if path else None
         self.installed = bool(installed)
         self.ref_count = ref_count
@@ -177,6 +256,23 @@ def __init__(
         self.installation_time = installation_time or _now()
         self.deprecated_for = deprecated_for
 
+        # Node dictionary and loader for records whose spec is built lazily
+        self._spec_dict = None
+        self._spec_loader = None
+
+    @property
+    def spec(self):
+        if self._spec is None and self._spec_loader is not None:
+            loader, self._spec_loader = self._spec_loader, None
+            loader()
+        return self._spec
+
+    @spec.setter
+    def spec(self, value):
+        self._spec = value
+        self._spec_dict = None
+        self._spec_loader = None
+
     def install_type_matches(self, installed):
         installed = InstallStatuses.canonicalize(installed)
         if self.installed:
@@ -187,8 +283,13 @@ def install_type_matches(self, installed):
             return InstallStatuses.MISSING in installed
 
     def to_dict(self):
+        # Don't build a spec just to serialize it again
+        spec_dict = self._spec_dict
+        if spec_dict is None:
+            spec_dict = self.spec.to_node_dict()
+
         rec_dict = {
-            'spec': self.spec.to_node_dict(),
+            'spec': spec_dict,
             'path': self.path,
             'installed': self.installed,
             'ref_count': self.ref_count,
@@ -211,6 +312,582 @@ def from_dict(cls, spec, dictionary):
         return InstallRecord(spec, **d)
 
 
+class InstallRecordIndex(object):
+    """Secondary indexes over the install records of a database.
+
+    The indexes map package names, versions, compilers, targets, the
+    explicit flag and installation times to the DAG hashes of the records
+    having them.  They are used by ``Database._query`` to narrow down the
+    records that must be checked with ``Spec.satisfies``, which is by far
+    the most expensive part of a query.
+
+    Candidate sets computed here are always a superset of the records
+    actually matching a query, so every filter applied afterwards by the
+    database still runs on the narrowed set.
+
+    The index also keeps the dependency edges between records in both
+    directions, split by dependency type, so that dependents can be found
+    without rebuilding parent links through the specs.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.by_name = {}
+        self.by_version = {}
+        self.by_compiler = {}
+        self.by_target = {}
+        self.by_explicit = {True: set(), False: set()}
+        self.by_time = []
+
+        # child hash -> deptype -> hashes of the records depending on it
+        self.dependents = {}
+        # parent hash -> list of (child hash, deptypes)
+        self.dependencies = {}
+
+        # hash -> values the record was indexed with, needed for removal
+        self._indexed = {}
+
+    @staticmethod
+    def _keys_for(rec):
+        # Records whose spec wasn't built yet are indexed from the node
+        # dictionary read from the database file.
+        if rec._spec is None and rec._spec_dict is not None:
+            name, node = next(iter(rec._spec_dict.items()))
+            versions = VersionList()
+            if 'version' in node or 'versions' in node:
+                versions = VersionList.from_dict(node)
+            compiler = node['compiler']['name'] if 'compiler' in node \
+                else None
+            target = None
+            if 'arch' in node:
+                arch = node['arch']
+                target = arch['target'] if isinstance(arch, dict) else arch
+                if isinstance(target, dict):
+                    target = target['name']
+            return name, versions, compiler, target
+
+        spec = rec.spec
+        target = None
+        if spec.architecture and spec.architecture.target:
+            target = str(spec.architecture.target)
+        compiler = spec.compiler.name if spec.compiler else None
+        return spec.name, spec.versions, compiler, target
+
+    @staticmethod
+    def _edges_for(rec):
+        if rec._spec is None and rec._spec_dict is not None:
+            _, node = next(iter(rec._spec_dict.items()))
+            deps = spack.spec.Spec.read_yaml_dep_specs(
+                node.get('dependencies', {}))
+            return [(dag_hash, tuple(deptypes))
+                    for _, dag_hash, deptypes in deps]
+
+        return [(dspec.spec.dag_hash(), tuple(dspec.deptypes))
+                for dspec in rec.spec.dependencies_dict().values()]
+
+    def add(self, key, rec):
+        """Index the record ``rec`` stored under the DAG hash ``key``."""
+        edges = self._edges_for(rec)
+        self.dependencies[key] = edges
+        for child, deptypes in edges:
+            by_type = self.dependents.setdefault(child, {})
+            for deptype in deptypes:
+                by_type.setdefault(deptype, set()).add(key)
+
+        name, versions, compiler, target = self._keys_for(rec)
+        self.by_name.setdefault(name, set()).add(key)
+        self.by_version.setdefault(versions, set()).add(key)
+        self.by_compiler.setdefault(compiler, set()).add(key)
+        self.by_target.setdefault(target, set()).add(key)
+        self.by_explicit[bool(rec.explicit)].add(key)
+        bisect.insort(self.by_time, (rec.installation_time, key))
+        self._indexed[key] = (
+            name, versions, compiler, target, rec.installation_time)
+
+    def remove(self, key):
+        """Drop the record stored under ``key`` from the indexes."""
+        for child, deptypes in self.dependencies.pop(key, ()):
+            by_type = self.dependents.get(child, {})
+            for deptype in deptypes:
+                parents = by_type.get(deptype)
+                if parents is not None:
+                    parents.discard(key)
+                    if not parents:
+                        del by_type[deptype]
+            if not by_type:
+                self.dependents.pop(child, None)
+
+        indexed = self._indexed.pop(key, None)
+        if indexed is None:
+            return
+
+        name, versions, compiler, target, installation_time = indexed
+        for index, value in ((self.by_name, name),
+                             (self.by_version, versions),
+                             (self.by_compiler, compiler),
+                             (self.by_target, target)):
+            keys = index.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+        self.by_explicit[True].discard(key)
+        self.by_explicit[False].discard(key)
+
+        item = (installation_time, key)
+        i = bisect.bisect_left(self.by_time, item)
+        if i < len(self.by_time) and self.by_time[i] == item:
+            del self.by_time[i]
+
+    def parents(self, key, deptype='all'):
+        """Hashes of the records depending on ``key`` through ``deptype``."""
+        by_type = self.dependents.get(key)
+        if not by_type:
+            return set()
+
+        parents = set()
+        for dt in spack.dependency.canonical_deptype(deptype):
+            parents.update(by_type.get(dt, ()))
+        return parents
+
+    def children(self, key, deptype='all'):
+        """Hashes of the dependencies of ``key`` through ``deptype``."""
+        deptype = spack.dependency.canonical_deptype(deptype)
+        return set(child for child, deptypes in self.dependencies.get(key, ())
+                   if any(dt in deptype for dt in deptypes))
+
+    def rebuild(self, data):
+        """Recompute all the indexes from a hash -> record dictionary."""
+        self.clear()
+        for key, rec in data.items():
+            self.add(key, rec)
+
+    def _keys_in_time_range(self, start_date, end_date):
+        # Dates are compared exactly by the caller, so allow one second
+        # of slack on both sides to be safe against rounding
+        try:
+            lo = time.mktime(start_date.timetuple()) - 1 \
+                if start_date else None
+            hi = time.mktime(end_date.timetuple()) + 1 \
+                if end_date else None
+        except (OverflowError, ValueError):
+            return None
+
+        i = bisect.bisect_left(self.by_time, (lo,)) if lo is not None else 0
+        j = (bisect.bisect_right(self.by_time, (hi,))
+             if hi is not None else len(self.by_time))
+        return set(key for _, key in self.by_time[i:j])
+
+    def candidates(self, query_spec=any, explicit=any,
+                   start_date=None, end_date=None):
+        """Return the set of hashes that may match a query, or None if the
+        query cannot be narrowed down by any index.
+        """
+        candidate_sets = []
+
+        if isinstance(query_spec, spack.spec.Spec):
+            # Virtual specs are matched by their providers, and their
+            # versions by the versions the providers provide, so none of
+            # the indices apply to them
+            if query_spec.virtual:
+                return None
+
+            if query_spec.name:
+                candidate_sets.append(
+                    self.by_name.get(query_spec.name, set()))
+
+            if query_spec.versions and \
+                    query_spec.versions != spack.spec._any_version:
+                matching = set()
+                for versions, keys in self.by_version.items():
+                    if versions.satisfies(query_spec.versions, strict=True):
+                        matching.update(keys)
+                candidate_sets.append(matching)
+
+            if query_spec.compiler:
+                candidate_sets.append(
+                    self.by_compiler.get(query_spec.compiler.name, set()))
+
+            arch = query_spec.architecture
+            if arch and arch.target:
+                target = str(arch.target)
+                # Target ranges and lists need the full microarchitecture
+                # comparison done by satisfies()
+                if ':' not in target and ',' not in target:
+                    candidate_sets.append(self.by_target.get(target, set()))
+
+        if explicit is not any:
+            candidate_sets.append(self.by_explicit[bool(explicit)])
+
+        if start_date or end_date:
+            in_range = self._keys_in_time_range(start_date, end_date)
+            if in_range is not None:
+                candidate_sets.append(in_range)
+
+        if not candidate_sets:
+            return None
+
+        candidate_sets.sort(key=len)
+        return candidate_sets[0].intersection(*candidate_sets[1:])
+
+
+class SQLiteIndex(object):
+    """Stores the records of a database in an SQLite file.
+
+    Each record is a row of the ``records`` table, with the node dictionary
+    of its spec stored as JSON, and with the fields used to query installs
+    stored in indexed columns.  Dependency edges are stored separately in
+    the ``dependencies`` table.
+
+    Writes only touch the rows of the records that changed, and the file is
+    in WAL mode so that readers don't block on writers.  Note that WAL mode
+    requires a filesystem with working shared memory, which most network
+    filesystems don't provide.
+
+    The schema is only created, and WAL mode only set, by writes: reads
+    open the file read-only, and with ``immutable`` set, reads don't need
+    write access to the directory either, as for upstream databases.
+
+    This class does not do any locking: it is meant to be used by a
+    ``Database`` holding its own lock.
+    """
+
+    _schema = [
+        'CREATE TABLE IF NOT EXISTS meta ('
+        '  key TEXT PRIMARY KEY, value TEXT)',
+        'CREATE TABLE IF NOT EXISTS records ('
+        '  hash TEXT PRIMARY KEY, name TEXT, version TEXT, compiler TEXT,'
+        '  path TEXT, installed INTEGER, explicit INTEGER,'
+        '  ref_count INTEGER, installation_time REAL,'
+        '  deprecated_for TEXT, spec TEXT)',
+        'CREATE TABLE IF NOT EXISTS dependencies ('
+        '  parent TEXT, child TEXT, deptypes TEXT,'
+        '  PRIMARY KEY (parent, child))',
+        'CREATE INDEX IF NOT EXISTS records_name ON records (name)',
+        'CREATE INDEX IF NOT EXISTS records_version ON records (version)',
+        'CREATE INDEX IF NOT EXISTS records_compiler ON records (compiler)',
+        'CREATE INDEX IF NOT EXISTS records_explicit ON records (explicit)',
+        'CREATE INDEX IF NOT EXISTS records_installed ON records (installed)',
+        'CREATE INDEX IF NOT EXISTS records_ref_count'
+        '  ON records (ref_count)',
+        'CREATE INDEX IF NOT EXISTS dependencies_child'
+        '  ON dependencies (child)',
+    ]
+
+    def __init__(self, path, immutable=False):
+        if sqlite3 is None:
+            raise SpackError(
+                'The sqlite database backend requires the sqlite3 module',
+                'Set `config:db_backend` to `json` to use this Python.')
+        self.path = path
+        self.immutable = immutable
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def _connect(self, write):
+        if write:
+            return sqlite3.connect(self.path)
+        # URIs are only supported from Python 3.4
+        if sys.version_info < (3, 4):
+            return sqlite3.connect(self.path)
+        uri = 'file:{0}?mode=ro'.format(
+            six.moves.urllib.request.pathname2url(self.path))
+        if self.immutable:
+            uri += '&immutable=1'
+        return sqlite3.connect(uri, uri=True)
+
+    @contextlib.contextmanager
+    def _connection(self, write=False):
+        try:
+            connection = self._connect(write)
+        except sqlite3.Error as e:
+            raise CorruptDatabaseError(
+                'error opening database:', '{0}: {1}'.format(self.path, e))
+
+        try:
+            if write:
+                connection.execute('PRAGMA journal_mode=WAL')
+                for statement in self._schema:
+                    connection.execute(statement)
+            with connection:
+                yield connection
+        except sqlite3.Error as e:
+            raise CorruptDatabaseError(
+                'error accessing database:', '{0}: {1}'.format(self.path, e))
+        finally:
+            connection.close()
+
+    _columns = ('hash, spec, path, installed, ref_count, explicit,'
+                ' installation_time, deprecated_for')
+
+    @staticmethod
+    def _records(connection, where='', args=()):
+        """Return the records selected by a ``WHERE`` clause as a
+        dictionary mapping hashes to records in ``index.json`` format."""
+        installs = {}
+        rows = connection.execute(
+            'SELECT {0} FROM records{1}'.format(SQLiteIndex._columns, where),
+            args)
+        for row in rows:
+            rec = {
+                'spec': sjson.load(row[1]),
+                'path': row[2],
+                'installed': bool(row[3]),
+                'ref_count': row[4],
+                'explicit': bool(row[5]),
+                'installation_time': row[6],
+            }
+            if row[7]:
+                rec['deprecated_for'] = row[7]
+            installs[str(row[0])] = rec
+        return installs
+
+    @staticmethod
+    def _version(connection):
+        version = connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return Version(version[0]) if version else None
+
+    def read(self):
+        """Return the version of the database and its records, as a
+        dictionary mapping hashes to records in ``index.json`` format.
+        """
+        with self._connection() as connection:
+            return self._version(connection), self._records(connection)
+
+    def read_version(self):
+        """Return the version of the database, or None if it has none."""
+        with self._connection() as connection:
+            return self._version(connection)
+
+    def get(self, keys):
+        """Return the records with the given hashes, as ``read``."""
+        keys = list(keys)
+        installs = {}
+        with self._connection() as connection:
+            # Stay below the default limit of 999 parameters per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                installs.update(self._records(
+                    connection, ' WHERE hash IN ({0})'.format(
+                        ', '.join('?' * len(chunk))), chunk))
+        return installs
+
+    def select(self, name=None, compiler=None, explicit=None):
+        """Return the records matching all the given values of the indexed
+        columns, as ``read``. Arguments left to None are not checked.
+        """
+        conditions, args = [], []
+        for column, value in (('name', name), ('compiler', compiler),
+                              ('explicit', explicit)):
+            if value is not None:
+                conditions.append('{0} = ?'.format(column))
+                args.append(value)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self._connection() as connection:
+            return self._records(connection, where, args)
+
+    def keys(self, prefix='', limit=None):
+        """Return the hashes starting with ``prefix``, up to ``limit`` of
+        them if given."""
+        where, args = '', []
+        if prefix:
+            # A range of the primary key, rather than LIKE, uses its index
+            upper = prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+            where, args = ' WHERE hash >= ? AND hash < ?', [prefix, upper]
+        if limit is not None:
+            where += ' LIMIT ?'
+            args.append(limit)
+        with self._connection() as connection:
+            return [str(row[0]) for row in connection.execute(
+                'SELECT hash FROM records' + where, args)]
+
+    def write(self, records, replace_all=False):
+        """Write records to the database.
+
+        Args:
+            records (dict): maps hashes to records in ``index.json`` format,
+                or to ``None`` for the records to be deleted
+            replace_all (bool): if ``True``, the database is emptied first
+        """
+        with self._connection(write=True) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (str(_db_version),))
+
+            if replace_all:
+                connection.execute('DELETE FROM records')
+                connection.execute('DELETE FROM dependencies')
+
+            for key, rec in records.items():
+                if not replace_all:
+                    connection.execute(
+                        'DELETE FROM records WHERE hash = ?', (key,))
+                    connection.execute(
+                        'DELETE FROM dependencies WHERE parent = ?', (key,))
+                if rec is None:
+                    continue
+
+                name, node = next(iter(rec['spec'].items()))
+                compiler = node.get('compiler', {}).get('name')
+                connection.execute(
+                    'INSERT INTO records VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, name, node.get('version'), compiler, rec['path'],
+                     rec['installed'], rec['explicit'], rec['ref_count'],
+                     rec['installation_time'], rec.get('deprecated_for'),
+                     json.dumps(rec['spec'], separators=(',', ':'))))
+
+                deps = node.get('dependencies', {})
+                connection.executemany(
+                    'INSERT INTO dependencies VALUES (?, ?, ?)',
+                    [(key, dhash, ','.join(dtypes)) for _, dhash, dtypes
+                     in spack.spec.Spec.read_yaml_dep_specs(deps)])
+
+
+class SQLiteRecords(object):
+    """The hash -> record dictionary of a database using the SQLite
+    backend, reading records from the SQLite index as they are needed.
+
+    Records are read by hash, or in bulk by the indexed columns through
+    ``candidates``, so that looking a few records up doesn't cost a read of
+    the whole database.  Only iterating over the records, or asking for
+    their number, reads all of them.
+
+    Changes made by the database are kept in memory, on top of the SQLite
+    index, until the database writes them. The keys of the records it
+    changed since its last write must be given to lookups by indexed
+    columns, which would otherwise only see the records as written.
+
+    This class does not do any locking: it is meant to be used by a
+    ``Database`` holding its own lock.
+    """
+
+    def __init__(self, sqlite, make_records):
+        """Read records from an SQLite index.
+
+        Args:
+            sqlite (SQLiteIndex): index to read the records from
+            make_records (callable): called with a hash -> record dictionary
+                in ``index.json`` format and with this object, returns the
+                corresponding ``InstallRecord`` objects by hash
+        """
+        self.sqlite = sqlite
+        self._make_records = make_records
+
+        self._records = {}
+        # keys known not to be in the index, or deleted from this object
+        self._missing = set()
+        self._deleted = set()
+        self._complete = False
+
+    def _add(self, installs):
+        """Add records read from the index, unless they changed since."""
+        installs = dict((k, v) for k, v in installs.items()
+                        if k not in self._records and k not in self._deleted)
+        self._records.update(self._make_records(installs, self))
+
+    def _fetch(self, keys):
+        keys = set(k for k in keys if k not in self._records and
+                   k not in self._deleted and k not in self._missing)
+        if keys and not self._complete:
+            installs = self.sqlite.get(keys)
+            self._add(installs)
+            self._missing.update(keys.difference(installs))
+
+    def _fetch_all(self):
+        if not self._complete:
+            _, installs = self.sqlite.read()
+            self._add(installs)
+            self._complete = True
+
+    def candidates(self, query_spec=any, explicit=any, changed=()):
+        """Read the records that may match a query from the indexed columns
+        and return their hashes, as ``InstallRecordIndex.candidates``, or
+        None if the query cannot be narrowed down by any column.
+
+        The records whose keys are in ``changed`` are returned too, as they
+        may not match the query as written.
+        """
+        conditions = {}
+        if isinstance(query_spec, spack.spec.Spec) and \
+                not query_spec.virtual:
+            if query_spec.name:
+                conditions['name'] = query_spec.name
+            if query_spec.compiler:
+                conditions['compiler'] = query_spec.compiler.name
+        if explicit is not any:
+            conditions['explicit'] = bool(explicit)
+        if not conditions:
+            return None
+
+        installs = self.sqlite.select(**conditions)
+        self._add(installs)
+        keys = set(installs).difference(self._deleted)
+        keys.update(k for k in changed if k in self._records)
+        return keys
+
+    def keys_with_prefix(self, prefix, changed=()):
+        """Return the hashes starting with ``prefix``, as ``candidates``
+        for the records in ``changed``."""
+        keys = set(self.sqlite.keys(prefix)).difference(self._deleted)
+        keys.update(k for k in changed
+                    if k in self._records and k.startswith(prefix))
+        return sorted(keys)
+
+    def __contains__(self, key):
+        self._fetch([key])
+        return key in self._records
+
+    def __getitem__(self, key):
+        self._fetch([key])
+        return self._records[key]
+
+    def get(self, key, default=None):
+        self._fetch([key])
+        return self._records.get(key, default)
+
+    def __setitem__(self, key, rec):
+        self._records[key] = rec
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        del self._records[key]
+        self._deleted.add(key)
+
+    def __bool__(self):
+        if self._records or self._complete:
+            return bool(self._records)
+        keys = self.sqlite.keys(limit=len(self._deleted) + 1)
+        return any(k not in self._deleted for k in keys)
+
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        self._fetch_all()
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        self._fetch_all()
+        return list(self._records.keys())
+
+    def values(self):
+        self._fetch_all()
+        return list(self._records.values())
+
+    def items(self):
+        self._fetch_all()
+        return list(self._records.items())
+
+
 class ForbiddenLockError(SpackError):
     """Raised when an upstream DB attempts to acquire a lock"""
 
@@ -301,6 +978,8 @@ def __init__(self, root, db_dir=None, upstream_dbs=None,
         # Set up layout of database files within the db dir
         self._index_path = os.path.join(self._db_dir, 'index.json')
         self._verifier_path = os.path.join(self._db_dir, 'index_verifier')
+        self._journal_path = os.path.join(self._db_dir, 'index.journal')
+        self._sqlite_path = os.path.join(self._db_dir, 'index.sqlite')
         self._lock_path = os.path.join(self._db_dir, 'lock')
 
         # This is for other classes to use to lock prefix directories.
@@ -324,6 +1003,26 @@ def __init__(self, root, db_dir=None, upstream_dbs=None,
         self.is_upstream = is_upstream
         self.last_seen_verifier = ''
 
+        # Journaled mode: write transactions append the records they changed
+        # to the journal instead of rewriting the whole index file.
+        self.journal = bool(spack.config.get('config:db_journal', False))
+
+        # Keys of the records changed since the last write, and how many
+        # bytes of the journal have been applied to the in-memory data.
+        self._journal_dirty = set()
+        self._journal_offset = 0
+
+        # Optional SQLite storage for the index.  Upstream databases are
+        # read with the backend they were written with.
+        backend = spack.config.get('config:db_backend', 'json')
+        if is_upstream:
+            backend = 'sqlite' if os.path.isfile(self._sqlite_path) \
+                else 'json'
+        self._sqlite = None
+        if backend == 'sqlite':
+            self._sqlite = SQLiteIndex(
+                self._sqlite_path, immutable=is_upstream)
+
         # initialize rest of state.
         self.db_lock_timeout = (
             spack.config.get('config:db_lock_timeout') or _db_lock_timeout)
@@ -345,6 +1044,10 @@ def __init__(self, root, db_dir=None, upstream_dbs=None,
                                 desc='database')
         self._data = {}
 
+        # secondary indexes over self._data, used to speed up queries,
+        # built the first time they are needed (see _index)
+        self._record_index = None
+
         self.upstream_dbs = list(upstream_dbs) if upstream_dbs else []
 
         # whether there was an error at the start of a read transaction
@@ -355,6 +1058,27 @@ def __init__(self, root, db_dir=None, upstream_dbs=None,
         # message)
         self._fail_when_missing_deps = False
 
+    @property
+    def _index(self):
+        """Secondary indexes over the records of the database.
+
+        They are built from all the records, so with the SQLite backend,
+        where records are otherwise read as needed, operations using them
+        read the whole database.
+        """
+        if self._record_index is None:
+            self._record_index = InstallRecordIndex()
+            self._record_index.rebuild(self._data)
+        return self._record_index
+
+    def _reindex(self, key):
+        """Update the secondary indexes, if built, for the record stored
+        under ``key`` after it was added, changed or removed."""
+        if self._record_index is not None:
+            self._record_index.remove(key)
+            if key in self._data:
+                self._record_index.add(key, self._data[key])
+
     def write_transaction(self):
         """Get a write lock context manager for use in a `with` block."""
         return lk.WriteTransaction(
@@ -575,6 +1299,45 @@ def _write_to_file(self, stream):
         except (TypeError, ValueError) as e:
             raise sjson.SpackJSONError("error writing JSON database:", str(e))
 
+    def export_json(self, filename=None):
+        """Write a snapshot of the database in ``index.json`` format.
+
+        This lets Spack instances that only know about ``index.json`` (e.g.
+        older versions using this store as an upstream) read a store that
+        uses the SQLite backend.
+
+        Args:
+            filename (str): where to write the snapshot (default: the
+                ``index.json`` file of this database)
+        """
+        filename = filename or self._index_path
+        temp_file = filename + (
+            '.%s.%s.temp' % (socket.getfqdn(), os.getpid()))
+
+        with self.read_transaction():
+            try:
+                with open(temp_file, 'w') as f:
+                    self._write_to_file(f)
+                os.rename(temp_file, filename)
+            except BaseException:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+
+    def import_json(self, filename=None):
+        """Replace the content of the database with an ``index.json`` file.
+
+        Args:
+            filename (str): file to import (default: the ``index.json`` file
+                of this database)
+        """
+        filename = filename or self._index_path
+        transaction = lk.WriteTransaction(
+            self.lock, acquire=self._read,
+            release=functools.partial(self._write, compact=True))
+        with transaction:
+            self._read_from_file(filename)
+
     def _read_spec_from_dict(self, hash_key, installs):
         """Recursively construct a spec from a hash in a YAML database.
 
@@ -612,10 +1375,9 @@ def query_by_spec_hash(self, hash_key, data=None):
                 return True, db._data[hash_key]
         return False, None
 
-    def _assign_dependencies(self, hash_key, installs, data):
+    def _assign_dependencies(self, spec, hash_key, installs, data):
         # Add dependencies from other records in the install DB to
         # form a full spec.
-        spec = data[hash_key].spec
         spec_dict = installs[hash_key]['spec']
         if 'dependencies' in spec_dict[spec.name]:
             yaml_deps = spec_dict[spec.name]['dependencies']
@@ -651,8 +1413,11 @@ def _read_from_file(self, filename):
         Does not do any locking.
         """
         try:
-            with open(filename, 'r') as f:
-                fdata = sjson.load(f)
+            if self.is_upstream and filename == self._index_path:
+                fdata = self._load_upstream_index()
+            else:
+                with open(filename, 'r') as f:
+                    fdata = sjson.load(f)
         except Exception as e:
             raise CorruptDatabaseError("error parsing database:", str(e))
 
@@ -692,76 +1457,166 @@ def check(cond, msg):
                     (k, v.to_dict()) for k, v in self._data.items()
                 )
 
-        def invalid_record(hash_key, error):
-            msg = ("Invalid record in Spack database: "
-                   "hash: %s, cause: %s: %s")
-            msg %= (hash_key, type(error).__name__, str(error))
-            raise CorruptDatabaseError(msg, self._index_path)
-
-        # Build up the database in three passes:
-        #
-        #   1. Read in all specs without dependencies.
-        #   2. Hook dependencies up among specs.
-        #   3. Mark all specs concrete.
-        #
-        # The database is built up so that ALL specs in it share nodes
-        # (i.e., its specs are a true Merkle DAG, unlike most specs.)
-
-        # Pass 1: Iterate through database and build specs w/o dependencies
+        self._load_records(installs)
+
+    def _load_records(self, installs):
+        """Replace the data in the database with records read from disk,
+        from a hash -> record dictionary in ``index.json`` format.
+
+        Does not do any locking.
+        """
+        # Records are created without specs: each spec, with its
+        # dependencies, is built from the node dictionaries the first time
+        # it is accessed, so commands looking at a few records don't pay
+        # for the whole database.
         data = {}
+        self._add_lazy_records(installs, data)
+
+        # For testing: report missing dependencies when reading
+        if self._fail_when_missing_deps:
+            for rec in data.values():
+                rec.spec
+
+        self._data = data
+        self._record_index = None
+
+    def _load_upstream_index(self):
+        """Load the JSON content of an upstream index file, through a copy
+        kept in the misc cache.
+
+        Upstream databases are often large, read-only, and on network
+        filesystems.  Their cached copy is used as long as the size and
+        modification time of the index file, and the content of its
+        verifier, are unchanged, so loading an upstream database costs a
+        couple of ``stat`` calls and a local read.
+        """
+        stat = os.stat(self._index_path)
+        verifier = ''
+        if os.path.isfile(self._verifier_path):
+            with open(self._verifier_path) as f:
+                verifier = f.read()
+        signature = [stat.st_size, stat.st_mtime, verifier]
+
+        path_hash = hashlib.sha1(
+            os.path.abspath(self._index_path).encode('utf-8')).hexdigest()
+        key = '{0}/{1}.json'.format(_upstream_cache_dir, path_hash)
+        cache = spack.caches.misc_cache
+
+        try:
+            if cache.init_entry(key):
+                with cache.read_transaction(key) as f:
+                    cached = sjson.load(f)
+                if cached.get('signature') == signature:
+                    return cached['index']
+        except (CacheError, IOError, OSError, ValueError, KeyError) as e:
+            tty.debug('Ignoring upstream database cache {0}: {1}'
+                      .format(key, str(e)))
+
+        with open(self._index_path, 'r') as f:
+            fdata = sjson.load(f)
+
+        try:
+            with cache.write_transaction(key) as (old, new):
+                json.dump({'signature': signature, 'index': fdata}, new,
+                          separators=(',', ':'))
+        except (CacheError, IOError, OSError) as e:
+            tty.debug('Cannot cache upstream database {0}: {1}'
+                      .format(self._index_path, str(e)))
+
+        return fdata
+
+    def _invalid_record(self, hash_key, error):
+        msg = ("Invalid record in Spack database: "
+               "hash: %s, cause: %s: %s")
+        msg %= (hash_key, type(error).__name__, str(error))
+        return CorruptDatabaseError(msg, self._index_path)
+
+    def _lazy_records(self, installs, data):
+        """Return records for a hash -> record dictionary read from disk,
+        deferring the construction of their specs, whose dependencies are
+        looked up in ``data``.
+
+        Does not do any locking.
+        """
+        records = {}
         for hash_key, rec in installs.items():
             try:
-                # This constructs a spec DAG from the list of all installs
-                spec = self._read_spec_from_dict(hash_key, installs)
-
-                # Insert the brand new spec in the database.  Each
-                # spec has its own copies of its dependency specs.
-                # TODO: would a more immmutable spec implementation simplify
-                #       this?
-                data[hash_key] = InstallRecord.from_dict(spec, rec)
+                record = InstallRecord.from_dict(None, rec)
             except Exception as e:
-                invalid_record(hash_key, e)
+                raise self._invalid_record(hash_key, e)
 
-        # Pass 2: Assign dependencies once all specs are created.
-        for hash_key in data:
-            try:
-                self._assign_dependencies(hash_key, installs, data)
-            except MissingDependenciesError:
-                raise
-            except Exception as e:
-                invalid_record(hash_key, e)
+            record._spec_dict = rec['spec']
+            record._spec_loader = functools.partial(
+                self._load_spec, record, hash_key, installs, data)
+            records[hash_key] = record
+        return records
 
-        # Pass 3: Mark all specs concrete.  Specs representing real
-        # installations must be explicitly marked.
-        # We do this *after* all dependencies are connected because if we
-        # do it *while* we're constructing specs,it causes hashes to be
-        # cached prematurely.
-        for hash_key, rec in data.items():
-            rec.spec._mark_concrete()
+    def _add_lazy_records(self, installs, data):
+        """Add records for a hash -> record dictionary read from disk to
+        ``data``, deferring the construction of their specs.
 
-        self._data = data
+        Does not do any locking.
+        """
+        data.update(self._lazy_records(installs, data))
 
-    def reindex(self, directory_layout):
+    def _load_spec(self, rec, hash_key, installs, data):
+        """Build the spec of a lazily read record, and the specs of its
+        dependencies if needed.
+
+        Dependencies are looked up in ``data`` first and then in upstream
+        databases, as for an eager read, so that all the specs in the
+        database share nodes (i.e., they form a true Merkle DAG).
+
+        Does not do any locking.
+        """
+        try:
+            rec.spec = self._read_spec_from_dict(hash_key, installs)
+            self._assign_dependencies(rec.spec, hash_key, installs, data)
+        except MissingDependenciesError:
+            raise
+        except Exception as e:
+            raise self._invalid_record(hash_key, e)
+
+        # Dependencies are complete at this point, so the hash won't be
+        # cached prematurely.
+        rec.spec._mark_concrete()
+        del installs[hash_key]
+
+    def reindex(self, directory_layout, jobs=None):
         """Build database index from scratch based on a directory layout.
 
         Locks the DB if it isn't locked already.
+
+        Args:
+            directory_layout: layout of the installations to index
+            jobs (int): number of processes scanning the layout and
+                reading spec files. Defaults to ``config:db_reindex_jobs``,
+                or to ``config:build_jobs`` if that is not set.
         """
         if self.is_upstream:
             raise UpstreamDatabaseLockingError(
                 "Cannot reindex an upstream database")
 
+        if jobs is None:
+            jobs = (spack.config.get('config:db_reindex_jobs') or
+                    spack.config.get('config:build_jobs', 1))
+        jobs = max(1, jobs)
+
         # Special transaction to avoid recursive reindex calls and to
         # ignore errors if we need to rebuild a corrupt database.
         def _read_suppress_error():
             try:
-                if os.path.isfile(self._index_path):
-                    self._read_from_file(self._index_path)
+                if self._index_exists():
+                    self._read_index()
             except CorruptDatabaseError as e:
                 self._error = e
                 self._data = {}
+                self._record_index = None
 
+        # Reindexing always compacts the journal into a new index file
         transaction = lk.WriteTransaction(
-            self.lock, acquire=_read_suppress_error, release=self._write
+            self.lock, acquire=_read_suppress_error,
+            release=functools.partial(self._write, compact=True)
         )
 
         with transaction:
@@ -775,15 +1630,17 @@ def _read_suppress_error():
             old_data = self._data
             try:
                 self._construct_from_directory_layout(
-                    directory_layout, old_data)
+                    directory_layout, old_data, jobs)
             except BaseException:
                 # If anything explodes, restore old data, skip write.
                 self._data = old_data
+                self._record_index = None
                 raise
 
     def _construct_entry_from_directory_layout(self, directory_layout,
                                                old_data, spec,
-                                               deprecator=None):
+                                               deprecator=None,
+                                               ctime=None):
         # Try to recover explicit value from old DB, but
         # default it to True if DB was corrupt. This is
         # just to be conservative in case a command like
@@ -791,7 +1648,8 @@ def _construct_entry_from_directory_layout(self, directory_layout,
         tty.debug(
             'RECONSTRUCTING FROM SPEC.YAML: {0}'.format(spec))
         explicit = True
-        inst_time = os.stat(spec.prefix).st_ctime
+        inst_time = ctime if ctime is not None else \
+            os.stat(spec.prefix).st_ctime
         if old_data is not None:
             old_info = old_data.get(spec.dag_hash())
             if old_info is not None:
@@ -806,29 +1664,82 @@ def _construct_entry_from_directory_layout(self, directory_layout,
         if deprecator:
             self._deprecate(spec, deprecator)
 
-    def _construct_from_directory_layout(self, directory_layout, old_data):
+    def _read_layout_specs(self, directory_layout, jobs):
+        """Scan a layout and parse its spec files with ``jobs`` processes.
+
+        Returns a list of ``(path, spec, ctime)`` tuples sorted by path.
+        """
+        patterns = directory_layout.spec_file_globs()
+        pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+        try:
+            imap = pool.imap_unordered if pool else six.moves.map
+            paths = sorted(itertools.chain.from_iterable(
+                imap(_glob_spec_files, patterns)))
+
+            tty.debug('Reading {0} spec files with {1} processes'.format(
+                len(paths), jobs))
+            progress = _ReindexProgress('Read', len(paths))
+            args = (_read_spec_file, paths)
+            if pool:
+                args += (max(1, min(64, len(paths) // (4 * jobs))),)
+
+            results = []
+            for path, data, ctime, error in imap(*args):
+                try:
+                    if error is not None:
+                        raise ValueError(error)
+                    spec = spack.spec.Spec.from_dict(data)
+                except Exception as e:
+                    raise SpecReadError(
+                        'Unable to read file: %s' % path, 'Cause: ' + str(e))
+
+                # Specs read from actual installations are always concrete
+                spec._mark_concrete()
+                results.append((path, spec, ctime))
+                progress.update()
+            progress.finish()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        return sorted(results, key=lambda result: result[0])
+
+    def _construct_from_directory_layout(self, directory_layout, old_data,
+                                         jobs=1):
         # Read first the `spec.yaml` files in the prefixes. They should be
         # considered authoritative with respect to DB reindexing, as
         # entries in the DB may be corrupted in a way that still makes
         # them readable. If we considered DB entries authoritative
         # instead, we would perpetuate errors over a reindex.
         with directory_layout.disable_upstream_check():
+            # Scanning the layout and parsing the spec files is done in
+            # parallel; the results are then merged here, in order.
+            layout_specs = self._read_layout_specs(directory_layout, jobs)
+            specs_by_path = dict((path, spec) for path, spec, _
+                                 in layout_specs)
+
             # Initialize data in the reconstructed DB
             self._data = {}
+            self._record_index = None
 
             # Start inspecting the installed prefixes
             processed_specs = set()
 
-            for spec in directory_layout.all_specs():
-                self._construct_entry_from_directory_layout(directory_layout,
-                                                            old_data, spec)
-                processed_specs.add(spec)
-
-            for spec, deprecator in directory_layout.all_deprecated_specs():
-                self._construct_entry_from_directory_layout(directory_layout,
-                                                            old_data, spec,
-                                                            deprecator)
-                processed_specs.add(spec)
+            with directory_layout.preloaded_specs(specs_by_path):
+                progress = _ReindexProgress('Indexed', len(layout_specs))
+                for _, spec, ctime in layout_specs:
+                    self._construct_entry_from_directory_layout(
+                        directory_layout, old_data, spec, ctime=ctime)
+                    processed_specs.add(spec)
+                    progress.update()
+                progress.finish()
+
+                for spec, deprecator in \
+                        directory_layout.all_deprecated_specs():
+                    self._construct_entry_from_directory_layout(
+                        directory_layout, old_data, spec, deprecator)
+                    processed_specs.add(spec)
 
             for key, entry in old_data.items():
                 # We already took care of this spec using
@@ -898,7 +1809,7 @@ def _check_ref_counts(self):
                     "Invalid ref_count: %s: %d (expected %d), in DB %s" %
                     (key, found, expected, self._index_path))
 
-    def _write(self, type, value, traceback):
+    def _write(self, type, value, traceback, compact=False):
         """Write the in-memory database index to its file path.
 
         This is a helper function called by the WriteTransaction context
@@ -907,10 +1818,24 @@ def _write(self, type, value, traceback):
         database *may* be left in an inconsistent state.  It will be consistent
         after the start of the next transaction, when it read from disk again.
 
+        In journaled mode only the records changed by the transaction are
+        appended to the journal, unless ``compact`` is ``True`` or the
+        journal has grown larger than the index file, in which case the
+        journal is folded into a new index file.
+
         This routine does no locking.
         """
         # Do not write if exceptions were raised
         if type is not None:
+            self._journal_dirty.clear()
+            return
+
+        if self._sqlite:
+            self._write_to_sqlite(compact or not self._sqlite.exists())
+            return
+
+        if self.journal and not compact and self._can_append_to_journal():
+            self._append_to_journal()
             return
 
         temp_file = self._index_path + (
@@ -921,11 +1846,13 @@ def _write(self, type, value, traceback):
             with open(temp_file, 'w') as f:
                 self._write_to_file(f)
             os.rename(temp_file, self._index_path)
-            if _use_uuid:
-                with open(self._verifier_path, 'w') as f:
-                    new_verifier = str(uuid.uuid4())
-                    f.write(new_verifier)
-                    self.last_seen_verifier = new_verifier
+
+            # The new index file contains everything in the journal
+            if os.path.exists(self._journal_path):
+                os.remove(self._journal_path)
+            self._journal_offset = 0
+            self._journal_dirty.clear()
+            self._update_verifier()
         except BaseException as e:
             tty.debug(e)
             # Clean up temp file if something goes wrong.
@@ -933,6 +1860,180 @@ def _write(self, type, value, traceback):
                 os.remove(temp_file)
             raise
 
+    def _update_verifier(self):
+        """Let other processes know that the index has changed."""
+        if _use_uuid:
+            with open(self._verifier_path, 'w') as f:
+                new_verifier = str(uuid.uuid4())
+                f.write(new_verifier)
+                self.last_seen_verifier = new_verifier
+
+    def _write_to_sqlite(self, replace_all):
+        """Write the records changed since the last write, or all of them
+        if ``replace_all`` is ``True``, to the SQLite index.
+
+        This routine does no locking.
+        """
+        if replace_all:
+            records = dict((k, v.to_dict()) for k, v in self._data.items())
+        else:
+            records = dict(
+                (k, self._data[k].to_dict() if k in self._data else None)
+                for k in self._journal_dirty)
+        self._journal_dirty.clear()
+
+        if records or replace_all:
+            self._sqlite.write(records, replace_all=replace_all)
+            self._update_verifier()
+
+    def _read_from_sqlite(self):
+        """Fill the database from the SQLite index.
+
+        Records are only read from the index when they are looked up, see
+        ``SQLiteRecords``.
+
+        Does not do any locking.
+        """
+        version = self._sqlite.read_version()
+        if version is not None and version > _db_version:
+            raise InvalidDatabaseVersionError(_db_version, version)
+
+        self._data = SQLiteRecords(self._sqlite, self._lazy_records)
+        self._record_index = None
+
+        # For testing: report missing dependencies when reading
+        if self._fail_when_missing_deps:
+            for rec in self._data.values():
+                rec.spec
+
+    def _index_exists(self):
+        """Whether there is an index on disk to read the database from.
+
+        With the SQLite backend, an existing ``index.json`` is imported the
+        first time the database is written.
+        """
+        if self._sqlite and self._sqlite.exists():
+            return True
+        return os.path.isfile(self._index_path)
+
+    def _can_append_to_journal(self):
+        """Whether the next write can go to the journal.
+
+        The journal is tied to the index file it was started on through the
+        verifier, so we need both to exist.  Once the journal is bigger than
+        the index file itself, it is compacted, which keeps the amortized
+        cost of a write independent of the size of the database.
+        """
+        if not _use_uuid or not self.last_seen_verifier:
+            return False
+
+        try:
+            index_size = os.path.getsize(self._index_path)
+        except OSError:
+            return False
+
+        return self._journal_offset <= index_size
+
+    def _append_to_journal(self):
+        """Append the records changed since the last write to the journal.
+
+        Each line of the journal is a JSON object with the DAG hash of a
+        record and either its new content or a ``deleted`` marker.  Replaying
+        the journal is idempotent, since each line holds the whole state of
+        a record.
+
+        This routine does no locking.
+        """
+        lines = []
+        for key in sorted(self._journal_dirty):
+            if key in self._data:
+                entry = {'key': key, 'record': self._data[key].to_dict()}
+            else:
+                entry = {'key': key, 'deleted': True}
+            lines.append(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._journal_dirty.clear()
+
+        if not lines:
+            return
+
+        with open(self._journal_path, 'ab') as f:
+            f.write(''.join(lines).encode('utf-8'))
+            self._journal_offset = f.tell()
+
+        # Readers on the same index file only need to replay the journal
+        # up to the offset recorded in the verifier
+        generation = self.last_seen_verifier.split(':')[0]
+        new_verifier = '{0}:{1}'.format(generation, self._journal_offset)
+        with open(self._verifier_path, 'w') as f:
+            f.write(new_verifier)
+        self.last_seen_verifier = new_verifier
+
+    def _replay_journal(self):
+        """Apply the journal entries past ``self._journal_offset`` on top of
+        the in-memory data.
+
+        Does not do any locking.
+        """
+        try:
+            with open(self._journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                text = f.read()
+        except (IOError, OSError):
+            return
+
+        # Only consider complete lines: a writer may not be done yet if we
+        # are an upstream database reading without locks.
+        end = text.rfind(b'\n') + 1
+        self._journal_offset += end
+
+        # Only the last state of each record matters
+        entries = {}
+        for line in text[:end].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = sjson.load(line)
+                entries[entry['key']] = entry
+            except Exception as e:
+                raise CorruptDatabaseError(
+                    "error parsing database journal:", str(e))
+
+        installs = {}
+        for key, entry in entries.items():
+            rec = self._data.get(key)
+            if entry.get('deleted'):
+                if rec is not None:
+                    del self._data[key]
+                    self._reindex(key)
+            elif rec is not None:
+                # The spec for a hash never changes, only the record fields
+                new_rec = InstallRecord.from_dict(None, entry['record'])
+                for attr in ('path', 'installed', 'ref_count', 'explicit',
+                             'installation_time', 'deprecated_for'):
+                    setattr(rec, attr, getattr(new_rec, attr))
+                self._reindex(key)
+            else:
+                installs[key] = entry['record']
+
+        # New records are read lazily, as in _read_from_file
+        self._add_lazy_records(installs, self._data)
+        for key in installs:
+            self._reindex(key)
+
+    def _read_index(self):
+        """Read the index file and replay the whole journal on top of it.
+
+        Does not do any locking.
+        """
+        if self._sqlite and self._sqlite.exists():
+            self._read_from_sqlite()
+            return
+
+        self._read_from_file(self._index_path)
+        self._journal_dirty.clear()
+        self._journal_offset = 0
+        self._replay_journal()
+
     def _read(self):
         """Re-read Database from the data in the set location.
 
@@ -940,7 +2041,7 @@ def _read(self):
         try to regenerate a missing DB if local. This requires taking a
         write lock.
         """
-        if os.path.isfile(self._index_path):
+        if self._index_exists():
             current_verifier = ''
             if _use_uuid:
                 try:
@@ -950,9 +2051,19 @@ def _read(self):
                     pass
             if ((current_verifier != self.last_seen_verifier) or
                     (current_verifier == '')):
+                last_generation = self.last_seen_verifier.split(':')[0]
                 self.last_seen_verifier = current_verifier
-                # Read from file if a database exists
-                self._read_from_file(self._index_path)
+
+                # If only the journal changed since we last read it, we
+                # just need to apply the new entries
+                generation, _, offset = current_verifier.partition(':')
+                if (not self._sqlite and
+                        generation and generation == last_generation and
+                        offset and int(offset) >= self._journal_offset):
+                    self._replay_journal()
+                else:
+                    # Read from file if a database exists
+                    self._read_index()
             return
         elif self.is_upstream:
             raise UpstreamDatabaseLockingError(
@@ -1051,17 +2162,22 @@ def _add(
                 new_spec._add_dependency(record.spec, dep.deptypes)
                 if not upstream:
                     record.ref_count += 1
+                    self._journal_dirty.add(dkey)
 
             # Mark concrete once everything is built, and preserve
             # the original hash of concrete specs.
             new_spec._mark_concrete()
             new_spec._hash = key
+            self._reindex(key)
+            self._journal_dirty.add(key)
 
         else:
             # If it is already there, mark it as installed.
             self._data[key].installed = True
 
         self._data[key].explicit = explicit
+        self._reindex(key)
+        self._journal_dirty.add(key)
 
     @_autospec
     def add(self, spec, directory_layout, explicit=False):
@@ -1086,6 +2202,25 @@ def _get_matching_spec_key(self, spec, **kwargs):
             raise KeyError("No such spec in database! %s" % spec)
         return key
 
+    @_autospec
+    def update_explicit(self, spec, explicit):
+        """Update the explicit flag of a spec in the database.
+
+        Args:
+            spec (Spec): spec whose install record is being updated
+            explicit (bool): ``True`` if the package was requested explicitly
+                by the user, ``False`` if it was pulled in as a dependency of
+                an explicit package.
+        """
+        with self.write_transaction():
+            key = self._get_matching_spec_key(spec)
+            rec = self._data.get(key)
+            if rec is None or rec.explicit == explicit:
+                return
+            rec.explicit = explicit
+            self._reindex(key)
+            self._journal_dirty.add(key)
+
     @_autospec
     def get_record(self, spec, **kwargs):
         key = self._get_matching_spec_key(spec, **kwargs)
@@ -1102,9 +2237,11 @@ def _decrement_ref_count(self, spec):
 
         rec = self._data[key]
         rec.ref_count -= 1
+        self._journal_dirty.add(key)
 
         if rec.ref_count == 0 and not rec.installed:
             del self._data[key]
+            self._reindex(key)
             for dep in spec.dependencies(_tracked_deps):
                 self._decrement_ref_count(dep)
 
@@ -1116,17 +2253,20 @@ def _increment_ref_count(self, spec):
 
         rec = self._data[key]
         rec.ref_count += 1
+        self._journal_dirty.add(key)
 
     def _remove(self, spec):
         """Non-locking version of remove(); does real work."""
         key = self._get_matching_spec_key(spec)
         rec = self._data[key]
+        self._journal_dirty.add(key)
 
         if rec.ref_count > 0:
             rec.installed = False
             return rec.spec
 
         del self._data[key]
+        self._reindex(key)
         for dep in rec.spec.dependencies(_tracked_deps):
             self._decrement_ref_count(dep)
 
@@ -1187,6 +2327,7 @@ def _deprecate(self, spec, deprecator):
         spec_rec.deprecated_for = deprecator_key
         spec_rec.installed = False
         self._data[spec_key] = spec_rec
+        self._journal_dirty.add(spec_key)
 
     @_autospec
     def deprecate(self, spec, deprecator):
@@ -1203,16 +2344,19 @@ def installed_relatives(self, spec, direction='children', transitive=True,
 
         relatives = set()
         for spec in self.query(spec):
-            if transitive:
-                to_add = spec.traverse(
-                    direction=direction, root=False, deptype=deptype)
-            elif direction == 'parents':
-                to_add = spec.dependents(deptype=deptype)
+            if direction == 'parents':
+                # Dependents come from the edge index instead of
+                # traversals, which need the parent links of all specs
+                to_add = self._dependents_of(
+                    spec.dag_hash(), transitive, deptype)
+            elif transitive:
+                to_add = (s.dag_hash() for s in spec.traverse(
+                    root=False, deptype=deptype))
             else:  # direction == 'children'
-                to_add = spec.dependencies(deptype=deptype)
+                to_add = (s.dag_hash()
+                          for s in spec.dependencies(deptype=deptype))
 
-            for relative in to_add:
-                hash_key = relative.dag_hash()
+            for hash_key in to_add:
                 upstream, record = self.query_by_spec_hash(hash_key)
                 if not record:
                     reltype = ('Dependent' if direction == 'parents'
@@ -1227,9 +2371,28 @@ def installed_relatives(self, spec, direction='children', transitive=True,
                 if not record.installed:
                     continue
 
-                relatives.add(relative)
+                relatives.add(record.spec)
         return relatives
 
+    def _dependents_of(self, key, transitive=True, deptype='all'):
+        """Return the hashes of the records depending on ``key``.
+
+        Dependents recorded in this database and in its upstreams are
+        returned, whether they are installed or not. The cost is
+        proportional to the number of dependents found.
+        """
+        indexes = [db._index for db in self.upstream_dbs] + [self._index]
+        dependents, stack = set(), [key]
+        while stack:
+            current = stack.pop()
+            for index in indexes:
+                for parent in index.parents(current, deptype):
+                    if parent not in dependents:
+                        dependents.add(parent)
+                        if transitive:
+                            stack.append(parent)
+        return dependents
+
     @_autospec
     def installed_extensions_for(self, extendee_spec):
         """
@@ -1268,9 +2431,12 @@ def _get_by_hash_local(self, dag_hash, default=None, installed=any):
 
         # check if hash is a prefix of some installed (or previously
         # installed) spec.
-        matches = [record.spec for h, record in self._data.items()
-                   if h.startswith(dag_hash) and
-                   record.install_type_matches(installed)]
+        if isinstance(self._data, SQLiteRecords):
+            keys = self._data.keys_with_prefix(dag_hash, self._journal_dirty)
+        else:
+            keys = [h for h in self._data if h.startswith(dag_hash)]
+        matches = [self._data[h].spec for h in keys
+                   if self._data[h].install_type_matches(installed)]
         if matches:
             return matches
 
@@ -1357,6 +2523,10 @@ def _query(
         # TODO: like installed and known that can be queried?  Or are
         # TODO: these really special cases that only belong here?
 
+        # Parse the query once, rather than once per record in satisfies()
+        if isinstance(query_spec, six.string_types):
+            query_spec = spack.spec.Spec(query_spec)
+
         # Just look up concrete specs with hashes; no fancy search.
         if isinstance(query_spec, spack.spec.Spec) and query_spec.concrete:
             # TODO: handling of hashes restriction is not particularly elegant.
@@ -1367,14 +2537,27 @@ def _query(
             else:
                 return []
 
-        # Abstract specs require more work -- currently we test
-        # against everything.
+        # Abstract specs require more work -- use the secondary indexes
+        # to narrow down the records we need to test, if possible.
         results = []
+        if (self._record_index is None and
+                isinstance(self._data, SQLiteRecords)):
+            # Rather than reading all the records to index them
+            candidates = self._data.candidates(
+                query_spec, explicit, self._journal_dirty)
+        else:
+            candidates = self._index.candidates(
+                query_spec, explicit, start_date, end_date)
+        if candidates is None:
+            records = self._data.items()
+        else:
+            records = ((key, self._data[key]) for key in candidates)
+
         start_date = start_date or datetime.datetime.min
         end_date = end_date or datetime.datetime.max
 
-        for key, rec in self._data.items():
-            if hashes is not None and rec.spec.dag_hash() not in hashes:
+        for key, rec in records:
+            if hashes is not None and key not in hashes:
                 continue
 
             if not rec.install_type_matches(installed):
@@ -1453,19 +2636,26 @@ def unused_specs(self):
             2. Installed as a "run" or "link" dependency (even transitive) of
                a spec at point 1.
         """
-        needed, visited = set(), set()
         with self.read_transaction():
-            for key, rec in self._data.items():
-                if rec.explicit:
-                    # recycle `visited` across calls to avoid
-                    # redundantly traversing
-                    for spec in rec.spec.traverse(visited=visited):
-                        needed.add(spec.dag_hash())
-
-            unused = [rec.spec for key, rec in self._data.items()
-                      if key not in needed and rec.installed]
-
-        return unused
+            # Start from the implicit records nothing depends on, then
+            # walk down to the dependencies whose dependents are all
+            # unused. Only the unused part of the store is visited.
+            index = self._index
+            unused = set()
+            stack = [key for key in index.by_explicit[False]
+                     if key not in index.dependents]
+            while stack:
+                key = stack.pop()
+                unused.add(key)
+                for child in index.children(key):
+                    rec = self._data.get(child)
+                    if (rec is not None and not rec.explicit and
+                            child not in unused and
+                            index.parents(child) <= unused):
+                        stack.append(child)
+
+            return [self._data[key].spec for key in unused
+                    if self._data[key].installed]
 
 
 class UpstreamDatabaseLockingError(SpackError):
@@ -35,6 +35,7 @@ class DirectoryLayout(object):
     def __init__(self, root):
         self.root = root
         self.check_upstream = True
+        self._preloaded_specs = None
 
     @property
     def hidden_file_paths(self):
@@ -54,6 +55,24 @@ def all_specs(self):
         """
         raise NotImplementedError()
 
+    def spec_file_globs(self):
+        """To be implemented by subclasses to return glob patterns that,
+           together, match the spec file of every spec in the layout.
+
+           Each pattern covers a disjoint part of the tree, so they can be
+           expanded concurrently.
+        """
+        raise NotImplementedError()
+
+    @contextmanager
+    def preloaded_specs(self, specs_by_path):
+        """Serve ``read_spec`` from already parsed specs, keyed by path."""
+        self._preloaded_specs = specs_by_path
+        try:
+            yield
+        finally:
+            self._preloaded_specs = None
+
     def relative_path_for_spec(self, spec):
         """Implemented by subclasses to return a relative path from the install
            root to a unique location for the provided spec."""
@@ -224,6 +243,9 @@ def write_spec(self, spec, path):
 
     def read_spec(self, path):
         """Read the contents of a file and parse them as a spec"""
+        if self._preloaded_specs and path in self._preloaded_specs:
+            return self._preloaded_specs[path]
+
         try:
             with open(path) as f:
                 spec = spack.spec.Spec.from_yaml(f)
@@ -341,6 +363,20 @@ def all_specs(self):
         spec_files = glob.glob(pattern)
         return [self.read_spec(s) for s in spec_files]
 
+    def spec_file_globs(self):
+        if not os.path.isdir(self.root):
+            return []
+
+        # One pattern per top-level directory of the install tree. Hidden
+        # entries are skipped, as "*" in all_specs() would skip them.
+        path_elems = ["*"] * (len(self.path_scheme.split(os.sep)) - 1)
+        path_elems += [self.metadata_dir, self.spec_file_name]
+        return [os.path.join(self.root, re.sub(r'([*?[])', r'[\1]', d),
+                             *path_elems)
+                for d in sorted(os.listdir(self.root))
+                if not d.startswith('.') and
+                os.path.isdir(os.path.join(self.root, d))]
+
     def all_deprecated_specs(self):
         if not os.path.isdir(self.root):
             return []
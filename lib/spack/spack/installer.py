@@ -27,10 +27,13 @@
 installations of packages in a Spack instance.
 """
 
+import functools
 import glob
 import heapq
 import itertools
+import multiprocessing
 import os
+import select
 import shutil
 import six
 import sys
@@ -40,13 +43,18 @@
 import llnl.util.lock as lk
 import llnl.util.tty as tty
 import spack.binary_distribution as binary_distribution
+import spack.build_environment
+import spack.build_times
 import spack.compilers
+import spack.config
 import spack.error
 import spack.hooks
+import spack.mirror
 import spack.package
 import spack.package_prefs as prefs
 import spack.repo
 import spack.store
+import spack.util.jobserver
 
 from llnl.util.tty.color import colorize
 from llnl.util.tty.log import log_output
@@ -213,7 +221,8 @@ def _hms(seconds):
     return ' '.join(parts)
 
 
-def _install_from_cache(pkg, cache_only, explicit, unsigned=False):
+def _install_from_cache(pkg, cache_only, explicit, unsigned=False,
+                        prefetcher=None):
     """
     Install the package from binary cache
 
@@ -224,13 +233,15 @@ def _install_from_cache(pkg, cache_only, explicit, unsigned=False):
             requested by the user, otherwise, ``False``
         unsigned (bool): ``True`` if binary package signatures to be checked,
             otherwise, ``False``
+        prefetcher (TarballPrefetcher or None): prefetcher of the tarballs
+            of the packages being installed, if any
 
     Return:
         (bool) ``True`` if the package was installed from binary cache,
             ``False`` otherwise
     """
-    installed_from_cache = _try_install_from_binary_cache(pkg, explicit,
-                                                          unsigned)
+    installed_from_cache = _try_install_from_binary_cache(
+        pkg, explicit, unsigned, prefetcher)
     pkg_id = package_id(pkg)
     if not installed_from_cache:
         pre = 'No binary for {0} found'.format(pkg_id)
@@ -302,7 +313,8 @@ def _process_external_package(pkg, explicit):
         spack.store.db.add(spec, None, explicit=explicit)
 
 
-def _process_binary_cache_tarball(pkg, binary_spec, explicit, unsigned):
+def _process_binary_cache_tarball(pkg, binary_spec, explicit, unsigned,
+                                  prefetcher=None):
     """
     Process the binary cache tarball.
 
@@ -312,12 +324,16 @@ def _process_binary_cache_tarball(pkg, binary_spec, explicit, unsigned):
         explicit (bool): the package was explicitly requested by the user
         unsigned (bool): ``True`` if binary package signatures to be checked,
             otherwise, ``False``
+        prefetcher (TarballPrefetcher or None): prefetcher of the tarballs
+            of the packages being installed, if any
 
     Return:
         (bool) ``True`` if the package was installed from binary cache,
             else ``False``
     """
-    tarball = binary_distribution.download_tarball(binary_spec)
+    tarball = prefetcher.take(binary_spec) if prefetcher else None
+    if tarball is None:
+        tarball = binary_distribution.download_tarball(binary_spec)
     # see #10063 : install from source if tarball doesn't exist
     if tarball is None:
         tty.msg('{0} exists in binary cache but with different hash'
@@ -333,25 +349,44 @@ def _process_binary_cache_tarball(pkg, binary_spec, explicit, unsigned):
     return True
 
 
-def _try_install_from_binary_cache(pkg, explicit, unsigned=False):
+def _binary_cache_spec(pkg):
     """
-    Try to install the package from binary cache.
+    Return the spec of the package in a binary cache.
 
     Args:
         pkg (PackageBase): the package to be installed from binary cache
-        explicit (bool): the package was explicitly requested by the user
-        unsigned (bool): ``True`` if binary package signatures to be checked,
-            otherwise, ``False``
+
+    Return:
+        (Spec or None) the spec of the package if it is in a binary cache,
+            otherwise ``None``
     """
     pkg_id = package_id(pkg)
     tty.debug('Searching for binary cache of {0}'.format(pkg_id))
     specs = binary_distribution.get_spec(pkg.spec, force=False)
     binary_spec = spack.spec.Spec.from_dict(pkg.spec.to_dict())
     binary_spec._mark_concrete()
-    if binary_spec not in specs:
+    return binary_spec if binary_spec in specs else None
+
+
+def _try_install_from_binary_cache(pkg, explicit, unsigned=False,
+                                   prefetcher=None):
+    """
+    Try to install the package from binary cache.
+
+    Args:
+        pkg (PackageBase): the package to be installed from binary cache
+        explicit (bool): the package was explicitly requested by the user
+        unsigned (bool): ``True`` if binary package signatures to be checked,
+            otherwise, ``False``
+        prefetcher (TarballPrefetcher or None): prefetcher of the tarballs
+            of the packages being installed, if any
+    """
+    binary_spec = _binary_cache_spec(pkg)
+    if binary_spec is None:
         return False
 
-    return _process_binary_cache_tarball(pkg, binary_spec, explicit, unsigned)
+    return _process_binary_cache_tarball(pkg, binary_spec, explicit, unsigned,
+                                         prefetcher)
 
 
 def _update_explicit_entry_in_db(pkg, rec, explicit):
@@ -366,11 +401,9 @@ def _update_explicit_entry_in_db(pkg, rec, explicit):
             package.
     """
     if explicit and not rec.explicit:
-        with spack.store.db.write_transaction():
-            rec = spack.store.db.get_record(pkg.spec)
-            message = '{s.name}@{s.version} : marking the package explicit'
-            tty.msg(message.format(s=pkg.spec))
-            rec.explicit = True
+        message = '{s.name}@{s.version} : marking the package explicit'
+        tty.msg(message.format(s=pkg.spec))
+        spack.store.db.update_explicit(pkg.spec, True)
 
 
 def dump_packages(spec, path):
@@ -569,6 +602,9 @@ def package_id(pkg):
             use_cache (bool): Install from binary package, if available.
             verbose (bool): Display verbose build output (by default,
                 suppresses it)
+            concurrent_packages (int): Maximum number of packages built at
+                the same time, sharing ``config:build_jobs`` cores. Defaults
+                to ``config:concurrent_packages``, or 1.
         """
 
 
@@ -627,6 +663,28 @@ def __init__(self, pkg):
         # Locks on specs being built, keyed on the package's unique id
         self.locks = {}
 
+        # Estimated time to build each package and its dependents being
+        # installed, in seconds, keyed on the package's unique id
+        self.critical_paths = {}
+
+        # Builds running in the background, keyed on the package's unique
+        # id, as (task, build process, build jobs, keep_prefix) tuples
+        self.building = {}
+
+        # Jobserver shared by the builds, if enabled
+        self.jobserver = None
+
+        # Whether a jobserver token is held for the next background build,
+        # and the ids of the running builds holding one
+        self.jobserver_token = False
+        self.token_holders = set()
+
+        # Whether the next build waits for a jobserver token
+        self.waiting_for_token = False
+
+        # Downloads of the binary packages ahead of their installation
+        self.prefetcher = None
+
     def __repr__(self):
         """Returns a formal representation of the package installer."""
         rep = '{0}('.format(self.__class__.__name__)
@@ -793,6 +851,19 @@ def _check_last_phase(self, **kwargs):
 
     def _cleanup_all_tasks(self):
         """Cleanup all build tasks to include releasing their locks."""
+        for pkg_id, (task, build, _, keep_prefix) in self.building.items():
+            tty.warn('Terminating the build of {0}'.format(pkg_id))
+            build.terminate()
+            if not keep_prefix:
+                task.pkg.remove_prefix()
+            task.pkg.stage.created = False
+        self.building.clear()
+        self._release_tokens()
+
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+
         for pkg_id in self.locks:
             self._release_lock(pkg_id)
 
@@ -896,9 +967,9 @@ def _ensure_locked(self, lock_type, pkg):
         if lock_type == 'read':
             # Wait until the other process finishes if there are no more
             # build tasks with priority 0 (i.e., with no uninstalled
-            # dependencies).
+            # dependencies) and no background builds to complete.
             no_p0 = len(self.build_tasks) == 0 or not self._next_is_pri0()
-            timeout = None if no_p0 else 3
+            timeout = None if no_p0 and not self.building else 3
         else:
             timeout = 1e-9  # Near 0 to iterate through install specs quickly
 
@@ -994,6 +1065,63 @@ def _init_queue(self, install_deps, install_package):
             # Now add the package itself, if appropriate
             self._push_task(self.pkg, False, 0, 0, STATUS_ADDED)
 
+        self._prioritize_critical_paths()
+
+    def _start_prefetcher(self):
+        """
+        Start downloading the binary cache tarballs of the queued packages,
+        dependencies first, up to ``config:buildcache_prefetch_jobs`` at a
+        time and within ``config:buildcache_prefetch_size`` megabytes.
+        """
+        jobs = spack.config.get('config:buildcache_prefetch_jobs', 4)
+        if not jobs or not spack.mirror.MirrorCollection():
+            return
+
+        specs = []
+        for spec in self.pkg.spec.traverse(order='post'):
+            pkg = spec.package
+            if package_id(pkg) not in self.build_tasks or spec.external or \
+                    pkg.installed_upstream or pkg.installed:
+                continue
+            binary_spec = _binary_cache_spec(pkg)
+            if binary_spec is not None:
+                specs.append(binary_spec)
+        if not specs:
+            return
+
+        budget = spack.config.get('config:buildcache_prefetch_size', 2048)
+        tty.debug('Prefetching {0} binary packages'.format(len(specs)))
+        self.prefetcher = binary_distribution.TarballPrefetcher(
+            specs, jobs, budget << 20)
+
+    def _prioritize_critical_paths(self):
+        """
+        Order the build tasks of the queue by their critical path, i.e. the
+        time to build the package and the longest chain of its dependents
+        being installed, estimated from the durations of past builds.
+
+        Ready tasks on the longest chains are then started first, so that
+        the installation is not held up by a long build started last.
+        """
+        durations = dict((pkg_id, spack.build_times.duration(task.pkg.spec))
+                         for pkg_id, task in self.build_tasks.items())
+
+        def critical_path(pkg_id):
+            if pkg_id not in self.critical_paths:
+                dependents = [critical_path(dep_id) for dep_id in
+                              self.build_tasks[pkg_id].dependents
+                              if dep_id in self.build_tasks]
+                self.critical_paths[pkg_id] = durations[pkg_id] + \
+                    max(dependents or [0])
+            return self.critical_paths[pkg_id]
+
+        for pkg_id, task in self.build_tasks.items():
+            task.critical_path = critical_path(pkg_id)
+
+        self.build_pq = [(task.key, task)
+                         for task in self.build_tasks.values()]
+        heapq.heapify(self.build_pq)
+
     def _install_task(self, task, **kwargs):
         """
         Perform the installation of the requested spec and/or dependency
@@ -1001,9 +1129,63 @@ def _install_task(self, task, **kwargs):
 
         Args:
             task (BuildTask): the installation build task for a package"""
+        build_process = self._prepare_build_process(task, **kwargs)
+        if build_process is None:
+            return
+
+        pkg = task.pkg
+        self._setup_install_dir(pkg)
+
+        # Fork a child to do the actual installation.
+        fork = functools.partial(
+            spack.build_environment.fork, pkg, build_process,
+            dirty=kwargs.get('dirty', False), fake=kwargs.get('fake', False))
+        self._complete_install_task(task, fork)
+
+    _install_task.__doc__ += install_args_docstring
+
+    def _start_install_task(self, task, jobs=None, **kwargs):
+        """
+        Start the installation of the package of the build task in a forked
+        build process, without waiting for it to finish.
+
+        The build process does not read from the terminal, since several
+        of them may run at the same time.
+
+        Args:
+            task (BuildTask): the installation build task for a package
+            jobs (int or None): number of build jobs for the package, or
+                None to use ``config:build_jobs``
+
+        Return:
+            (BuildProcess) the running build, whose ``complete`` method is to
+                be passed to ``_complete_install_task``, or None if there is
+                nothing left to wait for (e.g., installed from a binary
+                cache)"""
+        build_process = self._prepare_build_process(task, **kwargs)
+        if build_process is None:
+            return None
+
+        pkg = task.pkg
+        self._setup_install_dir(pkg)
+        return spack.build_environment.start_build_process(
+            pkg, build_process, dirty=kwargs.get('dirty', False),
+            fake=kwargs.get('fake', False), jobs=jobs, forward_input=False)
+
+    def _prepare_build_process(self, task, **kwargs):
+        """
+        Prepare the installation of the package of the build task and
+        return the function to run in its build process.
+
+        Args:
+            task (BuildTask): the installation build task for a package
+
+        Return:
+            (callable) the build process function, or None if the package
+                does not need to be built (e.g., installed from a binary
+                cache)"""
 
         cache_only = kwargs.get('cache_only', False)
-        dirty = kwargs.get('dirty', False)
         fake = kwargs.get('fake', False)
         install_source = kwargs.get('install_source', False)
         keep_stage = kwargs.get('keep_stage', False)
@@ -1022,10 +1204,10 @@ def _install_task(self, task, **kwargs):
         task.status = STATUS_INSTALLING
 
         # Use the binary cache if requested
-        if use_cache and \
-                _install_from_cache(pkg, cache_only, explicit, unsigned):
+        if use_cache and _install_from_cache(
+                pkg, cache_only, explicit, unsigned, self.prefetcher):
             self._update_installed(task)
-            return
+            return None
 
         pkg.run_tests = (tests is True or tests and pkg.name in tests)
 
@@ -1097,6 +1279,7 @@ def build_process():
 
                         # Spawn a daemon that reads from a pipe and redirects
                         # everything to log_path
+                        phase_times = {}
                         with log_output(pkg.log_path, echo, True) as logger:
                             for phase_name, phase_attr in zip(
                                     pkg.phases, pkg._InstallPhase_phases):
@@ -1110,11 +1293,18 @@ def build_process():
 
                                 # Redirect stdout and stderr to daemon pipe
                                 phase = getattr(pkg, phase_attr)
+                                phase_start = time.time()
                                 phase(pkg.spec, pkg.prefix)
+                                phase_times[phase_name] = \
+                                    time.time() - phase_start
 
                     echo = logger.echo
                     log(pkg)
 
+                    # Remember how long the build took to schedule the
+                    # next ones
+                    spack.build_times.record(pkg.spec, phase_times)
+
                 # Run post install hooks before build stage is removed.
                 spack.hooks.post_install(pkg.spec)
 
@@ -1135,15 +1325,25 @@ def build_process():
         # hook that allows tests to inspect the Package before installation
         # see unit_test_check() docs.
         if not pkg.unit_test_check():
-            return
+            return None
 
-        try:
-            self._setup_install_dir(pkg)
+        return build_process
+
+    def _complete_install_task(self, task, wait):
+        """
+        Wait for the build process of the task and record the installation.
+
+        Args:
+            task (BuildTask): the installation build task for a package
+            wait (callable): argless function waiting for the build process
+                and returning its result
+        """
+        pkg = task.pkg
+        explicit = task.pkg_id == self.pkg_id
 
-            # Fork a child to do the actual installation.
+        try:
             # Preserve verbosity settings across installs.
-            spack.package.PackageBase._verbose = spack.build_environment.fork(
-                pkg, build_process, dirty=dirty, fake=fake)
+            spack.package.PackageBase._verbose = wait()
 
             # Note: PARENT of the build process adds the new package to
             # the database, so that we don't need to re-read from file.
@@ -1162,7 +1362,167 @@ def build_process():
             tty.msg('Package stage directory : {0}'
                     .format(pkg.stage.source_path))
 
-    _install_task.__doc__ += install_args_docstring
+    def _run_install_step(self, task, keep_prefix, step):
+        """
+        Run a step of the installation of the task and handle its outcome.
+
+        The step either completes the installation or starts a build
+        process, which is returned so that its completion can be handled
+        with a later call.
+
+        Args:
+            task (BuildTask): the installation build task for a package
+            keep_prefix (bool): ``True`` if the prefix is to be kept on
+                failure, otherwise ``False``
+            step (callable): argless function performing the step
+
+        Return:
+            (build, keep_prefix) tuple where build is the build process
+                started by the step, or None, and keep_prefix is the
+                updated value of keep_prefix
+        """
+        pkg, pkg_id = task.pkg, task.pkg_id
+        build = None
+        try:
+            build = step()
+            if build is not None:
+                return build, keep_prefix
+
+            self._update_installed(task)
+
+            # If we installed then we should keep the prefix
+            last_phase = getattr(pkg, 'last_phase', None)
+            keep_prefix = last_phase is None or keep_prefix
+
+        except spack.directory_layout.InstallDirectoryAlreadyExistsError:
+            tty.debug("Keeping existing install prefix in place.")
+            self._update_installed(task)
+            raise
+
+        except (Exception, KeyboardInterrupt, SystemExit) as exc:
+            # Assuming best effort installs so suppress the exception and
+            # mark as a failure UNLESS this is the explicit package.
+            err = 'Failed to install {0} due to {1}: {2}'
+            tty.error(err.format(pkg.name, exc.__class__.__name__,
+                      str(exc)))
+            self._update_failed(task, True, exc)
+
+            if pkg_id == self.pkg_id:
+                raise
+
+        finally:
+            if build is None:
+                # Remove the install prefix if anything went wrong during
+                # install.
+                if not keep_prefix:
+                    pkg.remove_prefix()
+
+                # The subprocess *may* have removed the build stage. Mark it
+                # not created so that the next time pkg.stage is invoked, we
+                # check the filesystem for it.
+                pkg.stage.created = False
+
+        # Perform basic task cleanup for the installed spec to
+        # include downgrading the write to a read lock
+        self._cleanup_task(pkg)
+        return None, keep_prefix
+
+    def _build_jobs(self, task, concurrent):
+        """
+        Number of build jobs for a package about to be built in the
+        background, taken from the cores of ``config:build_jobs`` that are
+        not used by running builds.
+
+        Free cores are shared evenly among the packages that are ready to
+        be built, up to the number of builds that may still start.
+
+        Args:
+            task (BuildTask): the installation build task for a package
+            concurrent (int): maximum number of builds at the same time
+        """
+        if not task.pkg.parallel:
+            return 1
+
+        # Jobs are rather taken from the jobserver as the build needs them
+        if self.jobserver is not None:
+            return None
+
+        ready = sum(1 for t in self.build_tasks.values() if t.priority == 0)
+        share = max(1, min(concurrent - len(self.building), ready + 1))
+        return max(1, self._free_build_jobs() // share)
+
+    def _free_build_jobs(self):
+        """Cores of ``config:build_jobs`` not used by running builds."""
+        used = sum(jobs for _, _, jobs, _ in self.building.values())
+        return spack.config.get('config:build_jobs') - used
+
+    def _can_start_build(self, concurrent):
+        """
+        Determine if another build may start while builds are running, i.e.
+        if there is room for it and the next build task is ready.
+
+        With a jobserver, there is room for another build when a token can
+        be taken for it, since every build runs one job without a token.
+
+        Args:
+            concurrent (int): maximum number of builds at the same time
+        """
+        self.waiting_for_token = False
+        if len(self.building) >= concurrent:
+            return False
+        if self.jobserver is None and self._free_build_jobs() < 1:
+            return False
+
+        # Skip removed tasks, so the first entry is the next task popped
+        while self.build_pq and \
+                self.build_pq[0][1].status == STATUS_REMOVED:
+            heapq.heappop(self.build_pq)
+        if not self.build_pq or not self._next_is_pri0():
+            return False
+
+        if self.jobserver is not None and not self.jobserver_token:
+            self.jobserver_token = self.jobserver.acquire()
+            self.waiting_for_token = not self.jobserver_token
+            return self.jobserver_token
+        return True
+
+    def _release_tokens(self):
+        """Return the jobserver tokens held for background builds."""
+        tokens = len(self.token_holders) + int(self.jobserver_token)
+        for _ in range(tokens):
+            self.jobserver.release()
+        self.token_holders.clear()
+        self.jobserver_token = False
+
+    def _complete_builds(self):
+        """Wait for background builds, then complete all that finished.
+
+        Waiting also stops when a jobserver token becomes available for
+        the next build if it is waiting for one."""
+        builds = dict((build, pkg_id) for pkg_id, (_, build, _, _)
+                      in self.building.items())
+        waitables = list(builds)
+        if self.waiting_for_token:
+            waitables.append(self.jobserver)
+            self.waiting_for_token = False
+        try:
+            finished, _, _ = select.select(waitables, [], [])
+
+            for build in finished:
+                if build not in builds:
+                    continue
+                pkg_id = builds[build]
+                task, _, _, keep_prefix = self.building.pop(pkg_id)
+                if pkg_id in self.token_holders:
+                    self.token_holders.remove(pkg_id)
+                    self.jobserver.release()
+                step = functools.partial(
+                    self._complete_install_task, task, build.complete)
+                self._run_install_step(task, keep_prefix, step)
+        except (Exception, KeyboardInterrupt, SystemExit):
+            # Stop the builds still running before giving up
+            self._cleanup_all_tasks()
+            raise
 
     def _next_is_pri0(self):
         """
@@ -1215,6 +1575,7 @@ def _push_task(self, pkg, compiler, start, attempts, status):
         # was decremented due to the installation of one of its dependencies.
         task = BuildTask(pkg, compiler, start, attempts, status,
                          self.installed)
+        task.critical_path = self.critical_paths.get(pkg_id, 0)
         self.build_tasks[pkg_id] = task
         heapq.heappush(self.build_pq, (task.key, task))
 
@@ -1388,11 +1749,32 @@ def install(self, **kwargs):
         if not_local:
             return
 
+        # Number of packages that may be built at the same time
+        concurrent = max(1, kwargs.get('concurrent_packages') or
+                         spack.config.get('config:concurrent_packages', 1))
+
         # Initialize the build task queue
         self._init_queue(install_deps, install_package)
 
+        # Download the binary packages while the previous ones install
+        if kwargs.get('use_cache', True):
+            self._start_prefetcher()
+
+        # Share the build jobs of the session between concurrent builds
+        # and their make and ninja processes. A single build keeps -jN.
+        self.jobserver = None
+        if concurrent > 1 and spack.config.get('config:jobserver', True):
+            self.jobserver = spack.util.jobserver.start(
+                min(spack.config.get('config:build_jobs'),
+                    multiprocessing.cpu_count()))
+
         # Proceed with the installation
-        while self.build_pq:
+        while self.build_pq or self.building:
+            # Collect background builds whenever no other build can start
+            if self.building and not self._can_start_build(concurrent):
+                self._complete_builds()
+                continue
+
             task = self._pop_task()
             if task is None:
                 continue
@@ -1493,44 +1875,23 @@ def install(self, **kwargs):
 
             # Proceed with the installation since we have an exclusive write
             # lock on the package.
-            try:
-                self._install_task(task, **kwargs)
-                self._update_installed(task)
-
-                # If we installed then we should keep the prefix
-                last_phase = getattr(pkg, 'last_phase', None)
-                keep_prefix = last_phase is None or keep_prefix
-
-            except spack.directory_layout.InstallDirectoryAlreadyExistsError:
-                tty.debug("Keeping existing install prefix in place.")
-                self._update_installed(task)
-                raise
-
-            except (Exception, KeyboardInterrupt, SystemExit) as exc:
-                # Assuming best effort installs so suppress the exception and
-                # mark as a failure UNLESS this is the explicit package.
-                err = 'Failed to install {0} due to {1}: {2}'
-                tty.error(err.format(pkg.name, exc.__class__.__name__,
-                          str(exc)))
-                self._update_failed(task, True, exc)
-
-                if pkg_id == self.pkg_id:
-                    raise
-
-            finally:
-                # Remove the install prefix if anything went wrong during
-                # install.
-                if not keep_prefix:
-                    pkg.remove_prefix()
-
-                # The subprocess *may* have removed the build stage. Mark it
-                # not created so that the next time pkg.stage is invoked, we
-                # check the filesystem for it.
-                pkg.stage.created = False
+            if concurrent > 1:
+                # Build in the background, so that other ready packages can
+                # be built at the same time
+                jobs = self._build_jobs(task, concurrent)
+                step = functools.partial(
+                    self._start_install_task, task, jobs=jobs, **kwargs)
+            else:
+                jobs = None
+                step = functools.partial(self._install_task, task, **kwargs)
 
-            # Perform basic task cleanup for the installed spec to
-            # include downgrading the write to a read lock
-            self._cleanup_task(pkg)
+            build, keep_prefix = self._run_install_step(
+                task, keep_prefix, step)
+            if build is not None:
+                self.building[pkg_id] = (task, build, jobs, keep_prefix)
+                if self.jobserver_token:
+                    self.token_holders.add(pkg_id)
+                    self.jobserver_token = False
 
         # Cleanup, which includes releasing all of the read locks
         self._cleanup_all_tasks()
@@ -1633,6 +1994,10 @@ def __init__(self, pkg, compiler, start, attempts, status, installed):
         self.uninstalled_deps = set(pkg_id for pkg_id in self.dependencies if
                                     pkg_id not in installed)
 
+        # Estimated time to build the package and its dependents, in
+        # seconds, which orders the build tasks with the same priority.
+        self.critical_path = 0
+
         # Ensure the task gets a unique sequence number to preserve the
         # order in which it was added.
         self.sequence = next(_counter)
@@ -1666,8 +2031,9 @@ def flag_installed(self, installed):
 
     @property
     def key(self):
-        """The key is the tuple (# uninstalled dependencies, sequence)."""
-        return (self.priority, self.sequence)
+        """The key is the tuple (# uninstalled dependencies, -critical path,
+        sequence)."""
+        return (self.priority, -self.critical_path, self.sequence)
 
     @property
     def priority(self):
@@ -4,13 +4,19 @@
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
 
+import codecs
+import io
+import multiprocessing
 import os
 import re
 import shutil
 import platform
+import struct
 import spack.repo
 import spack.cmd
+import spack.util.elf
 import llnl.util.lang
+from ordereddict_backport import OrderedDict
 from spack.util.executable import Executable, ProcessError
 import llnl.util.tty as tty
 from macholib.MachO import MachO
@@ -61,6 +67,71 @@ def __init__(self, old_path, new_path):
         super(BinaryTextReplaceException, self).__init__(msg, err_msg)
 
 
+class RelocationError(spack.error.SpackError):
+    """
+    Raised when some files of a package could not be relocated.
+    """
+
+    def __init__(self, errors):
+        msg = "Relocation failed for %d file(s)" % len(errors)
+        err_msg = "\n".join("%s: %s" % error for error in errors)
+        super(RelocationError, self).__init__(msg, err_msg)
+        self.errors = errors
+
+
+def _call_on_file(call):
+    """Return the result of ``function(path_name, *args)`` for a
+    ``(function, path_name, args)`` call, and the error it raised, if any,
+    as a string that can be passed back from a worker process."""
+    function, path_name, args = call
+    try:
+        return function(path_name, *args), None
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+
+
+def _map_files(function, files, jobs=1):
+    """Call ``function(path_name, *args)`` for each file, in a pool of
+    ``jobs`` processes if more than one.
+
+    The function and its arguments must be picklable, and each call must
+    only modify its own file.
+
+    Args:
+        function: module level function taking a file as first argument
+        files (list): (path_name, args) for each file
+        jobs (int): number of processes
+
+    Returns:
+        (list): the results of the calls, in the order of the files
+
+    Raises:
+        RelocationError: listing, in order, all the files for which the
+            function raised an error
+    """
+    calls = [(function, path_name, tuple(args)) for path_name, args in files]
+    pool = None
+    if jobs > 1 and len(calls) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(calls)))
+    try:
+        if pool:
+            chunksize = max(1, min(64, len(calls) // (4 * jobs)))
+            outcomes = pool.map(_call_on_file, calls, chunksize)
+        else:
+            outcomes = [_call_on_file(call) for call in calls]
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    errors = [(call[1], error)
+              for call, (_, error) in zip(calls, outcomes)
+              if error is not None]
+    if errors:
+        raise RelocationError(errors)
+    return [result for result, _ in outcomes]
+
+
 def get_patchelf():
     """
     Returns the full patchelf binary path if available in $PATH.
@@ -87,18 +158,29 @@ def get_patchelf():
             return patchelf_executable
 
 
-def get_existing_elf_rpaths(path_name):
+def get_existing_elf_rpaths(path_name, patchelf_path=None):
     """
     Return the RPATHS returned by patchelf --print-rpath path_name
     as a list of strings.
+
+    The RPATHS are read directly from the file, patchelf is only run for
+    files that cannot be parsed. It is looked up with get_patchelf unless
+    its path is given.
     """
+    try:
+        return (spack.util.elf.get_rpath(path_name) or '').split(':')
+    except (spack.util.elf.ElfParsingError, IOError, OSError,
+            ValueError) as e:
+        # ValueError covers RPATHs that are not valid UTF-8
+        tty.debug('Cannot read the RPATH of {0}: {1}'.format(
+            path_name, str(e)))
 
     # if we're relocating patchelf itself, use it
 
     if path_name[-13:] == "/bin/patchelf":
         patchelf = Executable(path_name)
     else:
-        patchelf = Executable(get_patchelf())
+        patchelf = Executable(patchelf_path or get_patchelf())
 
     rpaths = list()
     try:
@@ -347,13 +429,25 @@ def macholib_get_paths(cur_path):
     return (rpaths, deps, ident)
 
 
-def modify_elf_object(path_name, new_rpaths):
+def modify_elf_object(path_name, new_rpaths, patchelf_path=None):
     """
     Replace orig_rpath with new_rpath in RPATH of elf object path_name
+
+    The RPATH is rewritten in place when the new one is not longer than
+    the current one, patchelf is only run when it must grow. It is looked
+    up with get_patchelf unless its path is given.
     """
 
     new_joined = ':'.join(new_rpaths)
 
+    try:
+        if spack.util.elf.set_rpath(path_name, new_joined):
+            return
+    except (spack.util.elf.ElfParsingError, IOError, OSError,
+            ValueError) as e:
+        tty.debug('Cannot set the RPATH of {0}: {1}'.format(
+            path_name, str(e)))
+
     # if we're relocating patchelf itself, use it
     bak_path = path_name + ".bak"
 
@@ -361,7 +455,7 @@ def modify_elf_object(path_name, new_rpaths):
         shutil.copy(path_name, bak_path)
         patchelf = Executable(bak_path)
     else:
-        patchelf = Executable(get_patchelf())
+        patchelf = Executable(patchelf_path or get_patchelf())
 
     try:
         patchelf('--force-rpath', '--set-rpath', '%s' % new_joined,
@@ -392,61 +486,286 @@ def needs_text_relocation(m_type, m_subtype):
     return (m_type == "text")
 
 
-def replace_prefix_text(path_name, old_dir, new_dir):
+def _encode_prefixes(prefixes):
+    """Encode an ordered sequence of (old, new) prefix pairs to utf-8.
+
+    The first new prefix given for an old prefix is kept, as well as only
+    the pairs actually changing a prefix.
     """
-    Replace old install prefix with new install prefix
-    in text files using utf-8 encoded strings.
+    encoded = OrderedDict()
+    for old_dir, new_dir in prefixes:
+        if not old_dir or new_dir is None or old_dir == new_dir:
+            continue
+        encoded.setdefault(old_dir.encode('utf-8'), new_dir.encode('utf-8'))
+    return encoded
+
+
+def _prefixes_alternation(prefixes):
+    """Regular expression alternation matching any of the old prefixes.
+
+    Longer prefixes come first so that a dependency prefix is matched as a
+    whole rather than through the layout root containing it.
     """
+    olds = sorted(prefixes, key=len, reverse=True)
+    return b'(' + b'|'.join(re.escape(old) for old in olds) + b')'
+
+
+def _text_regex(olds):
+    """Regular expression matching old prefixes at the beginning of paths
+    in text files, with the prefix in its second group.
+    """
+    # Replace an old prefix if it appears at the beginning of a path
+    # Negative lookbehind for a character legal in a path
+    # Then a match group for any characters legal in a compiler flag
+    # Then the old prefix
+    # Then characters legal in a path
+    # Ensures we only match an old prefix if it's precedeed by a flag or by
+    # characters not legal in a path, but not if it's preceeded by other
+    # components of a path.
+    return re.compile(b'(?<![\\w\\-_/])([\\w\\-_]*?)' +
+                      _prefixes_alternation(olds) +
+                      b'([\\w\\-_/]*)')
+
+
+def _text_relocator(prefixes):
+    """Return the regular expression and replacement function relocating
+    all the old prefixes of text files in a single pass.
+
+    Args:
+        prefixes (list): ordered (old prefix, new prefix) pairs
+    """
+    prefixes = _encode_prefixes(prefixes)
+    if not prefixes:
+        return None
+
+    regex = _text_regex(prefixes)
+
+    def replace(match):
+        return (match.group(1) + prefixes[match.group(2)] +
+                match.group(3))
+
+    return regex, replace
+
+
+def _padded_prefixes(prefixes):
+    """Map old prefixes to new prefixes padded with leading path separators
+    to the same length, skipping the new prefixes longer than the old ones.
+
+    Args:
+        prefixes (list): ordered (old prefix, new prefix) pairs
+    """
+    return dict(
+        (old, os.sep.encode('utf-8') * (len(old) - len(new)) + new)
+        for old, new in _encode_prefixes(prefixes).items()
+        if len(new) <= len(old))
+
+
+def _binary_relocator(prefixes):
+    """Return the regular expression and replacement function relocating
+    all the old prefixes of binary files in a single pass.
+
+    New prefixes are padded with leading path separators to the length of
+    the old ones, so that the offsets in the binary are unchanged. Pairs
+    where the new prefix is longer than the old one are skipped.
+
+    Args:
+        prefixes (list): ordered (old prefix, new prefix) pairs
+    """
+    padded = _padded_prefixes(prefixes)
+    if not padded:
+        return None
+
+    regex = re.compile(_prefixes_alternation(padded))
+
+    def replace(match):
+        return padded[match.group(1)]
+
+    return regex, replace
+
+
+def _relocate_file(path_name, relocator, binary=False):
+    """Relocate a file with the regular expression and replacement function
+    of a relocator, reading and writing it at most once.
+
+    Files without any old prefix are not rewritten.
+
+    Returns:
+        True if the file was modified, False otherwise
+    """
+    if relocator is None:
+        return False
+    regex, replace = relocator
+
     with open(path_name, 'rb+') as f:
         data = f.read()
+        ndata = regex.sub(replace, data)
+        if ndata == data:
+            return False
+        if binary and len(ndata) != len(data):
+            raise BinaryStringReplacementException(
+                path_name, len(data), len(ndata))
         f.seek(0)
-        # Replace old_dir with new_dir if it appears at the beginning of a path
-        # Negative lookbehind for a character legal in a path
-        # Then a match group for any characters legal in a compiler flag
-        # Then old_dir
-        # Then characters legal in a path
-        # Ensures we only match the old_dir if it's precedeed by a flag or by
-        # characters not legal in a path, but not if it's preceeded by other
-        # components of a path.
-        old_bytes = old_dir.encode('utf-8')
-        pat = b'(?<![\\w\\-_/])([\\w\\-_]*?)%s([\\w\\-_/]*)' % old_bytes
-        repl = b'\\1%s\\2' % new_dir.encode('utf-8')
-        ndata = re.sub(pat, repl, data)
         f.write(ndata)
         f.truncate()
+    return True
 
 
-def replace_prefix_bin(path_name, old_dir, new_dir):
+def prefix_offsets(path_name, prefixes, binary=False):
+    """Find where prefixes appear in a file, so that it can be relocated
+    later without being scanned again.
+
+    Prefixes are matched as when relocating the file: at the beginning of
+    paths in text files, and anywhere in binary files.
+
+    Args:
+        path_name (str): path of the file
+        prefixes (list): prefixes to look for
+        binary (bool): whether the file is a binary
+
+    Returns:
+        (list): (offset, index of the prefix, length) of each occurrence of
+            a prefix, in order. The length is the one of the path starting
+            with the prefix in text files, and of the null-terminated string
+            starting with the prefix in binary files.
     """
-    Attempt to replace old install prefix with new install prefix
-    in binary files by prefixing new install prefix with os.sep
-    until the lengths of the prefixes are the same.
+    with open(path_name, 'rb') as f:
+        return data_prefix_offsets(f.read(), prefixes, binary)
+
+
+def data_prefix_offsets(data, prefixes, binary=False):
+    """Find where prefixes appear in the content of a file, as
+    ``prefix_offsets``.
+
+    Args:
+        data (bytes): content of the file
+        prefixes (list): prefixes to look for
+        binary (bool): whether the file is a binary
     """
+    olds = [p.encode('utf-8') for p in prefixes]
+    index = dict((old, i) for i, old in enumerate(olds))
+    if not olds:
+        return []
+
+    offsets = []
+    if binary:
+        for match in re.finditer(_prefixes_alternation(olds), data):
+            start = match.start()
+            end = data.find(b'\0', start)
+            if end < 0:
+                end = len(data)
+            offsets.append((start, index[match.group(1)], end - start))
+    else:
+        for match in _text_regex(olds).finditer(data):
+            start = match.start(2)
+            offsets.append(
+                (start, index[match.group(2)], match.end(3) - start))
+    return offsets
 
-    def replace(match):
-        occurances = match.group().count(old_dir.encode('utf-8'))
-        olen = len(old_dir.encode('utf-8'))
-        nlen = len(new_dir.encode('utf-8'))
-        padding = (olen - nlen) * occurances
-        if padding < 0:
-            return data
-        return match.group().replace(old_dir.encode('utf-8'),
-                                     os.sep.encode('utf-8') * padding +
-                                     new_dir.encode('utf-8'))
 
+def _matching_prefix(olds, string):
+    """Longest of the old prefixes the string starts with, or None."""
+    for old in olds:
+        if string.startswith(old):
+            return old
+    return None
+
+
+def _relocate_text_offsets(path_name, manifest, prefixes):
+    """Relocate a text file at the offsets where its old prefixes were
+    recorded by ``prefix_offsets``.
+
+    Args:
+        path_name (str): path of the file
+        manifest (tuple): size of the file when its prefixes were recorded,
+            and the (offset, old prefix, length) of each occurrence
+        prefixes (dict): new prefix of each old prefix, encoded
+
+    Returns:
+        (bool): True if the file was relocated, False if it changed since
+            the offsets were recorded
+    """
+    size, occurrences = manifest
+    olds = sorted(prefixes, key=len, reverse=True)
     with open(path_name, 'rb+') as f:
         data = f.read()
-        f.seek(0)
-        original_data_len = len(data)
-        pat = re.compile(old_dir.encode('utf-8'))
-        if not pat.search(data):
-            return
-        ndata = pat.sub(replace, data)
-        if not len(ndata) == original_data_len:
-            raise BinaryStringReplacementException(
-                path_name, original_data_len, len(ndata))
-        f.write(ndata)
-        f.truncate()
+        if len(data) != size:
+            return False
+
+        pieces, end = [], 0
+        for offset, old, length in occurrences:
+            string = data[offset:offset + length]
+            if not string.startswith(old.encode('utf-8')):
+                return False
+            # A prefix without a new prefix may still be relocated through
+            # a shorter prefix it starts with, like the layout root
+            match = _matching_prefix(olds, string)
+            if match is None:
+                continue
+            pieces.extend((data[end:offset], prefixes[match]))
+            end = offset + len(match)
+
+        if pieces:
+            pieces.append(data[end:])
+            f.seek(0)
+            f.write(b''.join(pieces))
+            f.truncate()
+    return True
+
+
+def _relocate_binary_offsets(path_name, manifest, padded):
+    """Relocate a binary file in place at the offsets where its old
+    prefixes were recorded by ``prefix_offsets``.
+
+    Occurrences that no longer hold their old prefix were relocated
+    already, like RPATHs set in place.
+
+    Args:
+        path_name (str): path of the file
+        manifest (tuple): size of the file when its prefixes were recorded,
+            and the (offset, old prefix, length) of each occurrence
+        padded (dict): new prefix of each old prefix, encoded and padded to
+            the length of the old prefix
+
+    Returns:
+        (bool): True if the file was relocated, False if its size changed
+            since the offsets were recorded
+    """
+    size, occurrences = manifest
+    olds = sorted(padded, key=len, reverse=True)
+    with open(path_name, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() != size:
+            return False
+
+        for offset, old, length in occurrences:
+            f.seek(offset)
+            string = f.read(length)
+            if not string.startswith(old.encode('utf-8')):
+                continue
+            match = _matching_prefix(olds, string)
+            if match is None:
+                continue
+            f.seek(offset)
+            f.write(padded[match])
+    return True
+
+
+def replace_prefix_text(path_name, old_dir, new_dir):
+    """
+    Replace old install prefix with new install prefix
+    in text files using utf-8 encoded strings.
+    """
+    _relocate_file(path_name, _text_relocator([(old_dir, new_dir)]))
+
+
+def replace_prefix_bin(path_name, old_dir, new_dir):
+    """
+    Attempt to replace old install prefix with new install prefix
+    in binary files by prefixing new install prefix with os.sep
+    until the lengths of the prefixes are the same.
+    """
+    _relocate_file(path_name, _binary_relocator([(old_dir, new_dir)]),
+                   binary=True)
 
 
 def replace_prefix_nullterm(path_name, old_dir, new_dir):
@@ -572,37 +891,52 @@ def elf_find_paths(orig_rpaths, old_layout_root, prefix_to_prefix):
     return new_rpaths
 
 
+def _relocate_elf_binary(path_name, old_layout_root, new_layout_root,
+                         prefix_to_prefix, rel, old_prefix, new_prefix,
+                         patchelf_path=None):
+    """Replace the rpaths of one binary, as in relocate_elf_binaries."""
+    orig_rpaths = get_existing_elf_rpaths(path_name, patchelf_path)
+    new_rpaths = list()
+    if rel:
+        # get the file path in the old_prefix
+        orig_path_name = re.sub(re.escape(new_prefix), old_prefix,
+                                path_name)
+        # get the normalized rpaths in the old prefix using the file path
+        # in the orig prefix
+        orig_norm_rpaths = get_normalized_elf_rpaths(orig_path_name,
+                                                     orig_rpaths)
+        # get the normalize rpaths in the new prefix
+        norm_rpaths = elf_find_paths(orig_norm_rpaths, old_layout_root,
+                                     prefix_to_prefix)
+        # get the relativized rpaths in the new prefix
+        new_rpaths = get_relative_elf_rpaths(path_name, new_layout_root,
+                                             norm_rpaths)
+        modify_elf_object(path_name, new_rpaths, patchelf_path)
+    else:
+        new_rpaths = elf_find_paths(orig_rpaths, old_layout_root,
+                                    prefix_to_prefix)
+        modify_elf_object(path_name, new_rpaths, patchelf_path)
+
+
 def relocate_elf_binaries(path_names, old_layout_root, new_layout_root,
-                          prefix_to_prefix, rel, old_prefix, new_prefix):
+                          prefix_to_prefix, rel, old_prefix, new_prefix,
+                          jobs=1):
     """
-    Use patchelf to get the original rpaths and then replace them with
+    Read the original rpaths and then replace them with
     rpaths in the new directory layout.
     New rpaths are determined from a dictionary mapping the prefixes in the
     old directory layout to the prefixes in the new directory layout if the
     rpath was in the old layout root, i.e. system paths are not replaced.
+    Binaries are relocated by ``jobs`` processes.
     """
-    for path_name in path_names:
-        orig_rpaths = get_existing_elf_rpaths(path_name)
-        new_rpaths = list()
-        if rel:
-            # get the file path in the old_prefix
-            orig_path_name = re.sub(re.escape(new_prefix), old_prefix,
-                                    path_name)
-            # get the normalized rpaths in the old prefix using the file path
-            # in the orig prefix
-            orig_norm_rpaths = get_normalized_elf_rpaths(orig_path_name,
-                                                         orig_rpaths)
-            # get the normalize rpaths in the new prefix
-            norm_rpaths = elf_find_paths(orig_norm_rpaths, old_layout_root,
-                                         prefix_to_prefix)
-            # get the relativized rpaths in the new prefix
-            new_rpaths = get_relative_elf_rpaths(path_name, new_layout_root,
-                                                 norm_rpaths)
-            modify_elf_object(path_name, new_rpaths)
-        else:
-            new_rpaths = elf_find_paths(orig_rpaths, old_layout_root,
-                                        prefix_to_prefix)
-            modify_elf_object(path_name, new_rpaths)
+    # Pool workers cannot install patchelf, so it is looked up beforehand
+    patchelf_path = None
+    if jobs > 1 and len(path_names) > 1:
+        patchelf_path = get_patchelf()
+    args = (old_layout_root, new_layout_root, prefix_to_prefix, rel,
+            old_prefix, new_prefix, patchelf_path)
+    _map_files(_relocate_elf_binary,
+               [(path_name, args) for path_name in path_names], jobs)
 
 
 def make_link_relative(cur_path_names, orig_path_names):
@@ -649,6 +983,35 @@ def make_elf_binaries_relative(cur_path_names, orig_path_names,
             modify_elf_object(cur_path, new_rpaths)
 
 
+def make_elf_data_relative(data, orig_path_name, old_layout_root):
+    """Return the content of an ELF binary with the rpaths in the old layout
+    root made relative to its original path, as make_elf_binaries_relative
+    but in memory.
+
+    Args:
+        data (bytes): content of the binary
+        orig_path_name (str): path of the binary in the install prefix
+        old_layout_root (str): layout root of the install prefix
+
+    Returns:
+        (bytes or None): the new content, or None if the binary cannot be
+            parsed or its rpaths must grow
+    """
+    f = io.BytesIO(data)
+    try:
+        rpath = spack.util.elf.get_file_rpath(f)
+        if not rpath:
+            return data
+        new_rpaths = get_relative_elf_rpaths(orig_path_name, old_layout_root,
+                                             rpath.split(':'))
+        if spack.util.elf.set_file_rpath(f, ':'.join(new_rpaths)):
+            return f.getvalue()
+    except spack.util.elf.ElfParsingError as e:
+        tty.debug('Cannot set the RPATH of {0}: {1}'.format(
+            orig_path_name, str(e)))
+    return None
+
+
 def check_files_relocatable(cur_path_names, allow_root):
     """
     Check binary files for the current install root
@@ -688,41 +1051,84 @@ def relocate_links(linknames, old_layout_root, new_layout_root,
             tty.warn(msg)
 
 
+def sbang_shebang(spack_prefix):
+    """Shebang line of scripts run through the sbang script of a Spack."""
+    return '#!/bin/bash %s/bin/sbang' % spack_prefix
+
+
+def _relocate_text_file(path_name, prefixes, manifest=None):
+    """Relocate the old prefixes of a text file, at the offsets recorded
+    in its manifest if it has one and did not change since.
+
+    Regular expressions are compiled again for each file, which is cheap
+    thanks to the cache of the re module.
+    """
+    if manifest and _relocate_text_offsets(path_name, manifest,
+                                           _encode_prefixes(prefixes)):
+        return
+    _relocate_file(path_name, _text_relocator(prefixes))
+
+
+def _relocate_binary_file(path_name, prefixes, manifest=None):
+    """Relocate the old prefixes of a binary, as _relocate_text_file."""
+    if manifest and _relocate_binary_offsets(path_name, manifest,
+                                             _padded_prefixes(prefixes)):
+        return
+    _relocate_file(path_name, _binary_relocator(prefixes), binary=True)
+
+
 def relocate_text(path_names, old_layout_root, new_layout_root,
                   old_install_prefix, new_install_prefix,
                   old_spack_prefix, new_spack_prefix,
-                  prefix_to_prefix):
+                  prefix_to_prefix, offsets=None, jobs=1):
     """
     Replace old paths with new paths in text files
     including the path the the spack sbang script
+
+    Files with an entry in ``offsets``, mapping them to their size and the
+    (offset, old prefix, length) occurrences found by ``prefix_offsets``,
+    are only patched at those offsets, unless they changed since.
+    Files are relocated by ``jobs`` processes.
     """
-    sbangre = '#!/bin/bash %s/bin/sbang' % old_spack_prefix
-    sbangnew = '#!/bin/bash %s/bin/sbang' % new_spack_prefix
+    sbangre = sbang_shebang(old_spack_prefix)
+    sbangnew = sbang_shebang(new_spack_prefix)
+
+    # All the prefixes are replaced in a single pass over each file
+    prefixes = [(old_install_prefix, new_install_prefix)]
+    prefixes.extend(prefix_to_prefix.items())
+    prefixes.append((old_layout_root, new_layout_root))
+    prefixes.append((sbangre, sbangnew))
+    if not _encode_prefixes(prefixes):
+        return
 
-    for path_name in path_names:
-        replace_prefix_text(path_name, old_install_prefix, new_install_prefix)
-        for orig_dep_prefix, new_dep_prefix in prefix_to_prefix.items():
-            replace_prefix_text(path_name, orig_dep_prefix, new_dep_prefix)
-        replace_prefix_text(path_name, old_layout_root, new_layout_root)
-        replace_prefix_text(path_name, sbangre, sbangnew)
+    offsets = offsets or {}
+    _map_files(_relocate_text_file,
+               [(path_name, (prefixes, offsets.get(path_name)))
+                for path_name in path_names], jobs)
 
 
 def relocate_text_bin(path_names, old_layout_root, new_layout_root,
                       old_install_prefix, new_install_prefix,
                       old_spack_prefix, new_spack_prefix,
-                      prefix_to_prefix):
+                      prefix_to_prefix, offsets=None, jobs=1):
     """
       Replace null terminated path strings hard coded into binaries.
       Raise an exception when the new path in longer than the old path
       because this breaks the binary.
+      Files with an entry in ``offsets`` are patched as in relocate_text,
+      and files are relocated by ``jobs`` processes.
       """
     if len(new_install_prefix) <= len(old_install_prefix):
-        for path_name in path_names:
-            for old_dep_prefix, new_dep_prefix in prefix_to_prefix.items():
-                if len(new_dep_prefix) <= len(old_dep_prefix):
-                    replace_prefix_bin(
-                        path_name, old_dep_prefix, new_dep_prefix)
-            replace_prefix_bin(path_name, old_spack_prefix, new_spack_prefix)
+        # All the prefixes are replaced in a single pass over each file
+        prefixes = list(prefix_to_prefix.items())
+        prefixes.append((old_spack_prefix, new_spack_prefix))
+        if not _padded_prefixes(prefixes):
+            return
+
+        offsets = offsets or {}
+        _map_files(_relocate_binary_file,
+                   [(path_name, (prefixes, offsets.get(path_name)))
+                    for path_name in path_names], jobs)
     else:
         if len(path_names) > 0:
             raise BinaryTextReplaceException(
@@ -821,6 +1227,26 @@ def file_is_relocatable(file, paths_to_relocate=None):
     return True
 
 
+def non_relocatable_files(path_names, paths_to_relocate=None, jobs=1):
+    """Return the files which are not relocatable as they are, checking
+    them with ``file_is_relocatable`` in ``jobs`` processes.
+
+    Args:
+        path_names (list): absolute paths of the files to be analyzed
+        paths_to_relocate (list): paths looked for in the files
+        jobs (int): number of processes
+
+    Returns:
+        (list): the files which are not relocatable, in the same order
+    """
+    relocatable = _map_files(
+        file_is_relocatable,
+        [(path_name, (paths_to_relocate,)) for path_name in path_names],
+        jobs)
+    return [path_name for path_name, ok in zip(path_names, relocatable)
+            if not ok]
+
+
 def is_binary(file):
     """Returns true if a file is binary, False otherwise
 
@@ -841,10 +1267,164 @@ def is_binary(file):
     return False
 
 
+#: Number of bytes read to classify a file, like ``file`` does by default
+_mime_bytes = 1048576
+
+#: Bytes allowed in UTF-8 text files: all but most control characters
+_text_bytes = bytes(bytearray(
+    [7, 8, 9, 10, 12, 13, 27] + list(range(0x20, 0x7f)) +
+    list(range(0x80, 0x100))))
+
+#: ELF object types and their MIME subtypes
+_elf_types = {
+    1: 'x-object',
+    2: 'x-executable',
+    3: 'x-sharedlib',
+    4: 'x-coredump',
+}
+
+#: Mach-O magic numbers, in either byte order. Universal binaries are left
+#: to ``file`` since they share their magic number with Java classes.
+_macho_magics = (
+    b'\xfe\xed\xfa\xce', b'\xce\xfa\xed\xfe',
+    b'\xfe\xed\xfa\xcf', b'\xcf\xfa\xed\xfe',
+)
+
+#: Magic numbers of other common binary files, and their MIME types
+_binary_magics = (
+    (b'\x1f\x8b', ('application', 'gzip')),
+    (b'BZh', ('application', 'x-bzip2')),
+    (b'\xfd7zXZ\x00', ('application', 'x-xz')),
+    (b'PK\x03\x04', ('application', 'zip')),
+    (b'\x89PNG\r\n\x1a\n', ('image', 'png')),
+    (b'\xff\xd8\xff', ('image', 'jpeg')),
+    (b'GIF8', ('image', 'gif')),
+    (b'%PDF-', ('application', 'pdf')),
+)
+
+#: Script MIME subtypes by interpreter
+_script_types = {
+    'sh': 'x-shellscript',
+    'bash': 'x-shellscript',
+    'dash': 'x-shellscript',
+    'ksh': 'x-shellscript',
+    'zsh': 'x-shellscript',
+    'csh': 'x-shellscript',
+    'tcsh': 'x-shellscript',
+    'perl': 'x-perl',
+    'python': 'x-python',
+    'ruby': 'x-ruby',
+}
+
+
+def _script_type(data):
+    """Returns the MIME subtype of a script from its shebang line."""
+    line = data.split(b'\n', 1)[0][2:].decode('utf-8', 'replace').split()
+    if line and os.path.basename(line[0]) == 'env':
+        line = line[1:]
+    if not line:
+        return 'plain'
+    interpreter = os.path.basename(line[0])
+    # python3.8 -> python
+    interpreter = re.sub(r'[\d.]+$', '', interpreter)
+    return _script_types.get(interpreter, 'plain')
+
+
+def _is_text(data, complete):
+    """Returns True if the data is UTF-8 (or ASCII) text.
+
+    Args:
+        data (bytes): content of the file, or its beginning
+        complete (bool): whether the data is the whole file
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        # A character may be split at the end of an incomplete read
+        decoder.decode(data, final=complete)
+    except UnicodeDecodeError:
+        return False
+    return not data.translate(None, _text_bytes)
+
+
+def _magic_mime_type(file):
+    """Returns the MIME type and subtype of a file from its content, or
+    None if it cannot be told for sure without ``file``.
+
+    Args:
+        file: file to be analyzed
+    """
+    if os.path.islink(file):
+        return ('inode', 'symlink')
+    if os.path.isdir(file):
+        return ('inode', 'directory')
+
+    with open(file, 'rb') as f:
+        data = f.read(_mime_bytes)
+
+    if not data:
+        return ('inode', 'x-empty')
+
+    if data.startswith(b'\x7fELF') and len(data) >= 18:
+        byte_order = {1: '<', 2: '>'}.get(bytearray(data)[5])
+        if byte_order is None:
+            return None
+        e_type, = struct.unpack(byte_order + 'H', data[16:18])
+        subtype = _elf_types.get(e_type)
+        return ('application', subtype) if subtype else None
+
+    if data[:4] in _macho_magics:
+        return ('application', 'x-mach-binary')
+
+    if data.startswith(b'!<arch>\n'):
+        return ('application', 'x-archive')
+
+    if _is_text(data, len(data) < _mime_bytes):
+        if data.startswith(b'#!'):
+            return ('text', _script_type(data))
+        return ('text', 'plain')
+
+    for magic, m_type in _binary_magics:
+        if data.startswith(magic):
+            return m_type
+
+    # Null bytes are not in text, but for UTF-16 and UTF-32 text
+    if b'\0' in data and not data.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return ('application', 'octet-stream')
+
+    return None
+
+
 @llnl.util.lang.memoized
 def mime_type(file):
     """Returns the mime type and subtype of a file.
 
+    ELF and Mach-O binaries, archives, scripts, UTF-8 text and other
+    binary data are told from the content of the file. The remaining files,
+    e.g. text in other encodings, are classified by ``file``. The subtype of
+    text files is only that of common scripts, or ``plain``.
+
+    Args:
+        file: file to be analyzed
+
+    Returns:
+        Tuple containing the MIME type and subtype
+    """
+    try:
+        m_type = _magic_mime_type(file)
+    except (IOError, OSError, ValueError) as e:
+        tty.debug('[MIME_TYPE] {0}: {1}'.format(file, str(e)))
+        m_type = None
+
+    if m_type is None:
+        return _file_mime_type(file)
+
+    tty.debug('[MIME_TYPE] {0} -> {1}'.format(file, '/'.join(m_type)))
+    return m_type
+
+
+def _file_mime_type(file):
+    """Returns the mime type and subtype of a file, as given by ``file``.
+
     Args:
         file: file to be analyzed
 
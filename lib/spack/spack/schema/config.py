@@ -65,8 +65,28 @@
             'dirty': {'type': 'boolean'},
             'build_language': {'type': 'string'},
             'build_jobs': {'type': 'integer', 'minimum': 1},
+            'concurrent_packages': {'type': 'integer', 'minimum': 1},
+            'jobserver': {'type': 'boolean'},
+            'relocation_jobs': {'type': 'integer', 'minimum': 1},
+            'buildcache_compression': {
+                'type': 'string',
+                'enum': ['gzip', 'zstd']
+            },
+            'buildcache_compression_level': {'type': 'integer', 'minimum': 1},
+            'buildcache_layout': {
+                'type': 'string',
+                'enum': ['archive', 'blobs']
+            },
+            'buildcache_prefetch_jobs': {'type': 'integer', 'minimum': 0},
+            'buildcache_prefetch_size': {'type': 'integer', 'minimum': 1},
             'ccache': {'type': 'boolean'},
             'db_lock_timeout': {'type': 'integer', 'minimum': 1},
+            'db_journal': {'type': 'boolean'},
+            'db_reindex_jobs': {'type': 'integer', 'minimum': 1},
+            'db_backend': {
+                'type': 'string',
+                'enum': ['json', 'sqlite']
+            },
             'package_lock_timeout': {
                 'anyOf': [
                     {'type': 'integer', 'minimum': 1},
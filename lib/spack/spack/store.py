@@ -63,9 +63,9 @@ def __init__(self, root, path_scheme=None, hash_length=None):
         self.layout = spack.directory_layout.YamlDirectoryLayout(
             root, hash_len=hash_length, path_scheme=path_scheme)
 
-    def reindex(self):
+    def reindex(self, jobs=None):
         """Convenience function to reindex the store DB with its own layout."""
-        return self.db.reindex(self.layout)
+        return self.db.reindex(self.layout, jobs=jobs)
 
 
 def _store():
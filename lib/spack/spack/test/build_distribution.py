@@ -7,9 +7,18 @@
 
 import os
 import os.path
+import shutil
+import tarfile
+from contextlib import closing
 
+import spack.caches
+import spack.config
+import spack.fetch_strategy
+import spack.mirror
 import spack.spec
 import spack.binary_distribution
+import spack.util.compression
+import spack.util.spack_yaml
 
 install = spack.main.SpackCommand('install')
 
@@ -39,3 +48,223 @@ def test_build_tarball_overwrite(
 
         with pytest.raises(spack.binary_distribution.NoOverwriteException):
             spack.binary_distribution.build_tarball(spec, '.', unsigned=True)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_build_tarballs(
+        install_mockery, mock_fetch, monkeypatch, tmpdir, jobs):
+    bindist = spack.binary_distribution
+    spec = spack.spec.Spec('dependent-install').concretized()
+    spec.package.do_install()
+    specs = [spec, spec['dependency-install']]
+
+    indexed = []
+    update_package_index = bindist.update_package_index
+    monkeypatch.setattr(bindist, 'update_package_index',
+                        lambda url, spec_files: indexed.append(spec_files) or
+                        update_package_index(url, spec_files))
+
+    outdir = str(tmpdir.join('mirror'))
+    bindist.build_tarballs(specs, outdir, unsigned=True,
+                           regenerate_index=True, jobs=jobs)
+
+    # The index is updated once with all the specs
+    names = sorted(bindist.tarball_name(s, '.spec.yaml') for s in specs)
+    assert len(indexed) == 1
+    assert sorted(indexed[0]) == names
+    cache_prefix = bindist.build_cache_prefix(outdir)
+    index = bindist.read_index_data(
+        open(os.path.join(cache_prefix, 'index.json.gz'), 'rb').read())
+    assert sorted(index) == names
+
+    for s in specs:
+        spackfile = os.path.join(
+            cache_prefix, bindist.tarball_path_name(s, '.spack'))
+        with closing(tarfile.open(spackfile)) as tar:
+            assert bindist.tarball_name(s, '.spec.yaml') in tar.getnames()
+
+    # Specs that cannot be pushed are reported together, after the others
+    # are pushed
+    os.remove(os.path.join(
+        cache_prefix, bindist.tarball_path_name(spec, '.spack')))
+    os.remove(os.path.join(
+        cache_prefix, bindist.tarball_name(spec, '.spec.yaml')))
+    with pytest.raises(bindist.TarballCreationError) as error:
+        bindist.build_tarballs(specs, outdir, unsigned=True,
+                               regenerate_index=True, jobs=jobs)
+    assert 'dependency-install' in error.value.long_message
+    assert 'dependent-install' not in error.value.long_message
+    assert os.path.exists(os.path.join(
+        cache_prefix, bindist.tarball_path_name(spec, '.spack')))
+    assert sorted(indexed[1]) == [bindist.tarball_name(spec, '.spec.yaml')]
+
+
+def test_build_tarballs_stops_pool_on_error(
+        install_mockery, mock_fetch, monkeypatch, tmpdir):
+    bindist = spack.binary_distribution
+    spec = spack.spec.Spec('dependent-install').concretized()
+
+    class Pool(object):
+        def __init__(self, jobs):
+            pools.append(self)
+            self.terminated = False
+
+        def terminate(self):
+            self.terminated = True
+
+        def join(self):
+            pass
+
+    class Thread(object):
+        def __init__(self, target):
+            pass
+
+        def start(self):
+            raise RuntimeError('cannot start thread')
+
+    pools = []
+    monkeypatch.setattr(bindist.multiprocessing, 'Pool', Pool)
+    monkeypatch.setattr(bindist.threading, 'Thread', Thread)
+    with pytest.raises(RuntimeError):
+        bindist.build_tarballs([spec, spec['dependency-install']],
+                               str(tmpdir.join('mirror')), jobs=2)
+    assert len(pools) == 1
+    assert pools[0].terminated
+
+
+@pytest.mark.parametrize('compression', [
+    'gzip',
+    pytest.param('zstd', marks=pytest.mark.skipif(
+        not spack.util.compression.have_zstd_support,
+        reason='the zstandard module is not installed'))])
+def test_build_tarball_compression(
+        install_mockery, mock_fetch, monkeypatch, tmpdir, compression):
+
+    with tmpdir.as_cwd():
+        spec = spack.spec.Spec('trivial-install-test-package').concretized()
+        install(str(spec))
+        spack.binary_distribution.build_tarball(
+            spec, '.', unsigned=True, compression=compression,
+            compression_level=1)
+
+        # The compression is recorded in the spec file
+        cache_prefix = spack.binary_distribution.build_cache_prefix('.')
+        specfile = os.path.join(cache_prefix, spack.binary_distribution
+                                .tarball_name(spec, '.spec.yaml'))
+        with open(specfile) as f:
+            spec_dict = spack.util.spack_yaml.load(f)
+        assert spec_dict['binary_cache_compression'] == compression
+
+        # and used to extract the tarball
+        spackfile = os.path.join(
+            cache_prefix,
+            spack.binary_distribution.tarball_directory_name(spec),
+            spack.binary_distribution.tarball_name(spec, '.spack'))
+        spack.binary_distribution.extract_tarball(
+            spec, spackfile, unsigned=True, force=True)
+        assert os.path.exists(
+            os.path.join(spec.prefix, '.spack', 'spec.yaml'))
+
+
+def test_extract_tarball_checksum_mismatch(
+        install_mockery, mock_fetch, monkeypatch, tmpdir):
+
+    with tmpdir.as_cwd():
+        spec = spack.spec.Spec('trivial-install-test-package').concretized()
+        install(str(spec))
+        spack.binary_distribution.build_tarball(spec, '.', unsigned=True)
+
+        spackfile = os.path.join(
+            spack.binary_distribution.build_cache_prefix('.'),
+            spack.binary_distribution.tarball_directory_name(spec),
+            spack.binary_distribution.tarball_name(spec, '.spack'))
+        specfile = spack.binary_distribution.tarball_name(spec, '.spec.yaml')
+
+        # Record a wrong checksum in the spec file of the archive
+        with closing(tarfile.open(spackfile, 'r')) as tar:
+            names = tar.getnames()
+            tar.extractall('archive')
+        with open(os.path.join('archive', specfile)) as f:
+            spec_dict = spack.util.spack_yaml.load(f)
+        spec_dict['binary_cache_checksum']['hash'] = '0' * 64
+        with open(os.path.join('archive', specfile), 'w') as f:
+            f.write(spack.util.spack_yaml.dump(spec_dict))
+        with closing(tarfile.open(spackfile, 'w')) as tar:
+            for name in names:
+                tar.add(os.path.join('archive', name), arcname=name)
+
+        # The files extracted before the checksum is known are removed
+        with pytest.raises(spack.binary_distribution.NoChecksumException):
+            spack.binary_distribution.extract_tarball(
+                spec, spackfile, unsigned=True, force=True)
+        assert not os.path.exists(spec.prefix)
+
+
+def test_build_tarball_blobs(
+        install_mockery, mock_fetch, monkeypatch, tmpdir):
+    bindist = spack.binary_distribution
+    spec = spack.spec.Spec('trivial-install-test-package').concretized()
+    install(str(spec))
+    outdir = str(tmpdir.join('mirror'))
+
+    pushed = []
+    push_to_url = bindist.web_util.push_to_url
+    monkeypatch.setattr(bindist.web_util, 'push_to_url',
+                        lambda local, remote, **kwargs: pushed.append(remote)
+                        or push_to_url(local, remote, **kwargs))
+
+    bindist.build_tarball(spec, outdir, unsigned=True, layout='blobs')
+    blobs = [url for url in pushed if '/blobs/sha256/' in url]
+    assert blobs
+
+    # The archive holds the manifest of the prefix instead of a tarball
+    cache_prefix = bindist.build_cache_prefix(outdir)
+    spackfile = os.path.join(
+        cache_prefix, bindist.tarball_path_name(spec, '.spack'))
+    with closing(tarfile.open(spackfile)) as tar:
+        assert sorted(tar.getnames()) == sorted([
+            bindist.tarball_name(spec, '.manifest.json'),
+            bindist.tarball_name(spec, '.spec.yaml')])
+
+    # Blobs already in the mirror are not pushed again
+    del pushed[:]
+    bindist.build_tarball(
+        spec, outdir, force=True, unsigned=True, layout='blobs')
+    assert len(pushed) == 2
+    assert not any('/blobs/' in url for url in pushed)
+
+    # Blobs are downloaded once to the local blob cache
+    mirrors = spack.mirror.MirrorCollection({'test': 'file://' + outdir})
+    monkeypatch.setattr(spack.mirror, 'MirrorCollection', lambda: mirrors)
+    monkeypatch.setattr(spack.caches, 'fetch_cache',
+                        spack.fetch_strategy.FsCache(str(tmpdir.join('c'))))
+    read = []
+    read_from_url = bindist.web_util.read_from_url
+    monkeypatch.setattr(bindist.web_util, 'read_from_url',
+                        lambda url, *args: read.append(url)
+                        or read_from_url(url, *args))
+
+    def extract():
+        path = str(tmpdir.join(bindist.tarball_name(spec, '.spack')))
+        shutil.copy(spackfile, path)
+        bindist.extract_tarball(spec, path, unsigned=True, force=True)
+
+    extract()
+    assert len(read) == len(blobs)
+    assert os.path.exists(os.path.join(spec.prefix, '.spack', 'spec.yaml'))
+
+    del read[:]
+    extract()
+    assert not read
+    assert os.path.exists(os.path.join(spec.prefix, '.spack', 'spec.yaml'))
+
+    # Blobs are checked as the prefix is extracted
+    for root, _, files in os.walk(str(tmpdir.join('c'))):
+        for name in files:
+            with open(os.path.join(root, name), 'wb') as f:
+                writer = spack.util.compression.compressed_writer(f, 'gzip')
+                writer.write(b'corrupt')
+                writer.close()
+    with pytest.raises(bindist.NoChecksumException):
+        extract()
+    assert not os.path.exists(spec.prefix)
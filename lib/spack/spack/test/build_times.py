@@ -0,0 +1,52 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+"""Test the durations of past builds kept for scheduling."""
+import pytest
+
+import spack.build_times
+import spack.caches
+import spack.spec
+from spack.util.file_cache import FileCache
+
+
+@pytest.fixture()
+def build_times_cache(tmpdir, monkeypatch):
+    """Keep build durations in a temporary misc cache."""
+    cache = FileCache(str(tmpdir))
+    monkeypatch.setattr(spack.caches, 'misc_cache', cache)
+    return cache
+
+
+def test_build_times_record(build_times_cache, mock_packages, config):
+    """Recorded builds give the duration of the same build, and of the
+    other builds of the package."""
+    spec = spack.spec.Spec('libelf@0.8.13').concretized()
+    other = spack.spec.Spec('libelf@0.8.12').concretized()
+
+    assert spack.build_times.duration(spec) == \
+        spack.build_times.default_duration
+
+    spack.build_times.record(spec, {'configure': 10.0, 'build': 20.0})
+    assert spack.build_times.duration(spec) == 30.0
+    assert spack.build_times.duration(other) == 30.0
+
+    spack.build_times.record(other, {'configure': 10.0, 'build': 50.0})
+    assert spack.build_times.duration(spec) == 30.0
+    assert spack.build_times.duration(other) == 60.0
+
+
+def test_build_times_corrupt(build_times_cache, mock_packages, config):
+    """Unreadable build durations are ignored, then replaced."""
+    spec = spack.spec.Spec('libelf').concretized()
+    with build_times_cache.write_transaction('build-times/libelf.json') as \
+            (old, new):
+        new.write('not json')
+
+    assert spack.build_times.duration(spec) == \
+        spack.build_times.default_duration
+
+    spack.build_times.record(spec, {'build': 5.0})
+    assert spack.build_times.duration(spec) == 5.0
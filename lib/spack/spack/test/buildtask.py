@@ -33,7 +33,7 @@ def test_build_task_basics(install_mockery):
     # Ensure key properties match expectations
     task = inst.BuildTask(spec.package, False, 0, 0, inst.STATUS_ADDED, [])
     assert task.priority == len(task.uninstalled_deps)
-    assert task.key == (task.priority, task.sequence)
+    assert task.key == (task.priority, -task.critical_path, task.sequence)
 
     # Ensure flagging installed works as expected
     assert len(task.uninstalled_deps) > 0
@@ -56,3 +56,19 @@ def test_buildcache_create_fail_on_perm_denied(
                    '--unsigned', 'trivial-install-test-package')
     assert error.value.errno == errno.EACCES
     tmpdir.chmod(0o700)
+
+
+def test_buildcache_create_jobs(
+        install_mockery, mock_fetch, monkeypatch, tmpdir):
+    """Ensure that buildcache create -j pushes all the specs."""
+    install('dependent-install')
+
+    buildcache('create', '-d', str(tmpdir), '-j', '2',
+               '--unsigned', 'dependent-install')
+    cache = tmpdir.join('build_cache')
+    assert len(cache.listdir('*.spec.yaml')) == 2
+    assert cache.join('index.json.gz').exists()
+
+    output = buildcache('create', '-d', str(tmpdir), '-j', '0',
+                        'dependent-install', fail_on_error=False)
+    assert 'invalid value for --jobs' in output
@@ -23,6 +23,19 @@ def test_reindex_basic(mock_packages, mock_archive, mock_fetch,
     assert spack.store.db.query() == all_installed
 
 
+def test_reindex_parallel(mock_packages, mock_archive, mock_fetch,
+                          install_mockery):
+    install('libelf@0.8.13')
+    install('libelf@0.8.12')
+
+    all_installed = spack.store.db.query()
+
+    os.remove(spack.store.db._index_path)
+    reindex('--jobs', '2')
+
+    assert spack.store.db.query() == all_installed
+
+
 def test_reindex_db_deleted(mock_packages, mock_archive, mock_fetch,
                             install_mockery):
     install('libelf@0.8.13')
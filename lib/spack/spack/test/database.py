@@ -13,6 +13,7 @@
 import os
 import pytest
 import json
+import sys
 try:
     import uuid
     _use_uuid = True
@@ -28,6 +29,7 @@
 import spack.database
 import spack.package
 import spack.spec
+import spack.util.file_cache
 from spack.test.conftest import MockPackage, MockPackageMultiRepo
 from spack.util.executable import Executable
 
@@ -511,6 +513,26 @@ def test_026_reindex_after_deprecate(mutable_database):
     _check_db_sanity(mutable_database)
 
 
+def test_027_parallel_reindex(mutable_database, monkeypatch, capfd):
+    """Reindexing with a process pool gives the same database as a serial
+    reindex, and reports its progress."""
+    mpich = mutable_database.query_one('mpich')
+    zmpi = mutable_database.query_one('zmpi')
+    mutable_database.deprecate(mpich, zmpi)
+
+    mutable_database.reindex(spack.store.layout, jobs=1)
+    serial = _db_state(mutable_database)
+
+    monkeypatch.setattr(spack.database, '_reindex_report_interval', 0)
+    mutable_database.reindex(spack.store.layout, jobs=4)
+    _check_db_sanity(mutable_database)
+    assert _db_state(mutable_database) == serial
+
+    out, _ = capfd.readouterr()
+    assert 'Read {0} spec files'.format(len(
+        spack.store.layout.all_specs())) in out
+
+
 def test_030_db_sanity_from_another_process(mutable_database):
     def read_and_modify():
         # check that other process can read DB
@@ -756,6 +778,40 @@ def test_query_unused_specs(mutable_database):
     assert unused[0].name == 'cmake'
 
 
+def test_dependents_index_matches_traversal(mutable_database):
+    """Dependents and unused specs computed from the edge index must match
+    the ones found by traversing the dependencies of every spec."""
+    s = spack.spec.Spec('simple-inheritance')
+    s.concretize()
+    s.package.do_install(fake=True, explicit=True)
+    mutable_database.update_explicit('mpileaks ^mpich', False)
+    mutable_database.remove('mpileaks ^zmpi')
+
+    installed = mutable_database.query()
+    for spec in installed:
+        for deptype in ('all', 'link', 'build'):
+            expected = set(
+                s for s in installed if spec.dag_hash() in
+                [d.dag_hash() for d in s.traverse(root=False,
+                                                  deptype=deptype)])
+            assert mutable_database.installed_relatives(
+                spec, 'parents', deptype=deptype) == expected
+
+            expected = set(
+                s for s in installed if spec.dag_hash() in
+                [d.dag_hash() for d in s.dependencies(deptype=deptype)])
+            assert mutable_database.installed_relatives(
+                spec, 'parents', transitive=False, deptype=deptype) == expected
+
+    needed = set()
+    for rec in mutable_database._data.values():
+        if rec.explicit:
+            needed.update(s.dag_hash() for s in rec.spec.traverse())
+    expected = set(s for s in installed if s.dag_hash() not in needed)
+    assert set(mutable_database.unused_specs) == expected
+    assert 'mpileaks' in [s.name for s in expected]
+
+
 @pytest.mark.regression('10019')
 def test_query_spec_with_conditional_dependency(mutable_database):
     # The issue is triggered by having dependencies that are
@@ -889,3 +945,321 @@ def _raise(db, spec):
     with pytest.raises(Exception):
         with spack.store.db.prefix_write_lock(s):
             assert False
+
+
+@pytest.mark.parametrize('query_args', [
+    {},
+    {'query_spec': 'mpileaks'},
+    {'query_spec': 'mpi'},
+    {'query_spec': 'mpi@:1'},
+    {'query_spec': 'mpi@2:'},
+    {'query_spec': 'mpi@3'},
+    {'query_spec': 'mpi%clang'},
+    {'query_spec': 'mpi target=x86_64', 'explicit': False},
+    {'query_spec': 'mpileaks ^mpich'},
+    {'query_spec': 'callpath@1.0'},
+    {'query_spec': 'libelf@0.8.10:'},
+    {'query_spec': '%gcc'},
+    {'query_spec': '%clang'},
+    {'query_spec': 'target=x86_64'},
+    {'query_spec': 'target=x86_64:'},
+    {'query_spec': 'not-a-package'},
+    {'explicit': True},
+    {'explicit': False},
+    {'start_date': datetime.datetime.min},
+    {'end_date': datetime.datetime.max},
+    {'start_date': datetime.datetime.now() - datetime.timedelta(days=1)},
+    {'query_spec': 'mpileaks', 'installed': any, 'explicit': True},
+])
+def test_query_index_matches_full_scan(database, monkeypatch, query_args):
+    """Queries narrowed by the secondary indexes must return the same
+    results as a full scan of the database.
+    """
+    with_index = database.query_local(**query_args)
+
+    monkeypatch.setattr(
+        spack.database.InstallRecordIndex, 'candidates',
+        lambda *args, **kwargs: None)
+    full_scan = database.query_local(**query_args)
+
+    assert with_index == full_scan
+
+
+def test_query_index_consistent_after_updates(mutable_database):
+    """The incrementally updated indexes must match freshly built ones."""
+    def _index_state(index):
+        dependencies = dict((key, sorted(edges))
+                            for key, edges in index.dependencies.items())
+        return (index.by_name, index.by_version, index.by_compiler,
+                index.by_target, index.by_explicit, index.by_time,
+                index.dependents, dependencies)
+
+    mutable_database.remove('mpileaks ^mpich')
+    mutable_database.remove('mpileaks ^zmpi')
+    mutable_database.update_explicit('libelf', True)
+    _mock_install('libdwarf')
+
+    with mutable_database.read_transaction():
+        expected = spack.database.InstallRecordIndex()
+        expected.rebuild(mutable_database._data)
+        assert _index_state(mutable_database._index) == _index_state(expected)
+
+    assert mutable_database.query_local('libelf', explicit=True)
+
+
+def _db_state(db):
+    with db.read_transaction():
+        return dict((k, v.to_dict()) for k, v in db._data.items())
+
+
+def test_journal_write_and_read(mutable_database):
+    """Journaled writes leave the index file alone and are replayed by
+    other readers on top of it.
+    """
+    mutable_database.journal = True
+    with open(mutable_database._index_path) as f:
+        original_index = f.read()
+
+    # A second reader, which follows the journal incrementally
+    other_db = spack.database.Database(mutable_database.root)
+    other_db.query()
+
+    mutable_database.remove('mpileaks ^mpich')
+    mutable_database.update_explicit('libelf', True)
+    mutable_database.deprecate(
+        mutable_database.query_one('zmpi'),
+        mutable_database.query_one('mpich2'))
+
+    with open(mutable_database._index_path) as f:
+        assert f.read() == original_index
+    assert os.path.exists(mutable_database._journal_path)
+
+    expected = _db_state(mutable_database)
+    assert _db_state(other_db) == expected
+    assert _db_state(spack.database.Database(mutable_database.root)) == \
+        expected
+    assert other_db.query_local('libelf', explicit=True)
+    other_db._check_ref_counts()
+
+    # Readers catch up with records added later too
+    mutable_database.add(
+        spack.spec.Spec('mpileaks ^mpich').concretized(), spack.store.layout)
+    assert _db_state(other_db) == _db_state(mutable_database)
+    assert len(other_db.query('mpileaks')) == 3
+
+
+def test_journal_compacted_on_reindex(mutable_database):
+    mutable_database.journal = True
+    mutable_database.update_explicit('libelf', True)
+    assert os.path.exists(mutable_database._journal_path)
+
+    mutable_database.reindex(spack.store.layout)
+    assert not os.path.exists(mutable_database._journal_path)
+
+    fresh_db = spack.database.Database(mutable_database.root)
+    assert fresh_db.query_local('libelf', explicit=True)
+
+
+def test_journal_compacted_when_larger_than_index(mutable_database):
+    mutable_database.journal = True
+    index_size = os.path.getsize(mutable_database._index_path)
+
+    # Flip a flag back and forth until the journal outgrows the index
+    explicit = True
+    while (not os.path.exists(mutable_database._journal_path) or
+           os.path.getsize(mutable_database._journal_path) <= index_size):
+        mutable_database.update_explicit('libelf', explicit)
+        explicit = not explicit
+
+    mutable_database.update_explicit('libelf', explicit)
+    assert not os.path.exists(mutable_database._journal_path)
+    assert spack.database.Database(mutable_database.root).query_local(
+        'libelf', explicit=explicit)
+
+
+def test_specs_are_read_lazily(database):
+    """Specs are built only for the records that are accessed, and the
+    records that weren't accessed are written back unchanged.
+    """
+    db = spack.database.Database(database.root)
+    with db.read_transaction():
+        assert db._data
+        assert all(rec._spec is None for rec in db._data.values())
+        records_before = json.loads(json.dumps(
+            dict((k, v.to_dict()) for k, v in db._data.items())))
+
+    specs = db.query_local('libdwarf')
+    assert len(specs) == 1
+    assert specs[0].concrete
+    assert specs[0].dependencies() == db.query_local('libelf')
+    assert specs[0].dependencies()[0] is db.query_local('libelf')[0]
+
+    with db.read_transaction():
+        built = set(rec.spec.name for rec in db._data.values()
+                    if rec._spec is not None)
+        assert built == set(['libdwarf', 'libelf'])
+
+        for key, rec in db._data.items():
+            assert rec.to_dict() == records_before[key]
+
+
+@pytest.fixture()
+def sqlite_database(mutable_database):
+    """A database using the SQLite backend, imported from the mock one."""
+    pytest.importorskip('sqlite3')
+    with spack.config.override('config:db_backend', 'sqlite'):
+        db = spack.database.Database(mutable_database.root)
+    yield db
+
+
+def test_sqlite_backend_imports_json_index(sqlite_database):
+    json_db = spack.database.Database(sqlite_database.root)
+    expected = _db_state(json_db)
+
+    assert not os.path.exists(sqlite_database._sqlite_path)
+    assert _db_state(sqlite_database) == expected
+
+    # The first write imports the JSON index
+    sqlite_database.update_explicit('libelf', True)
+    assert os.path.exists(sqlite_database._sqlite_path)
+
+    with spack.config.override('config:db_backend', 'sqlite'):
+        fresh_db = spack.database.Database(sqlite_database.root)
+    assert len(fresh_db.query()) == len(json_db.query())
+    assert fresh_db.query_local('libelf', explicit=True)
+    fresh_db._check_ref_counts()
+
+
+def test_sqlite_backend_write_and_read(sqlite_database):
+    sqlite3 = pytest.importorskip('sqlite3')
+    sqlite_database.reindex(spack.store.layout)
+    with open(sqlite_database._index_path) as f:
+        original_index = f.read()
+
+    with spack.config.override('config:db_backend', 'sqlite'):
+        other_db = spack.database.Database(sqlite_database.root)
+    other_db.query()
+
+    mpileaks = sqlite_database.remove('mpileaks ^mpich')
+    sqlite_database.deprecate(
+        sqlite_database.query_one('zmpi'),
+        sqlite_database.query_one('mpich2'))
+    assert _db_state(other_db) == _db_state(sqlite_database)
+
+    sqlite_database.add(mpileaks, spack.store.layout)
+    assert _db_state(other_db) == _db_state(sqlite_database)
+    other_db._check_ref_counts()
+
+    # index.json is not written by the SQLite backend
+    with open(sqlite_database._index_path) as f:
+        assert f.read() == original_index
+
+    # Indexed columns and dependency edges are kept up to date
+    connection = sqlite3.connect(sqlite_database._sqlite_path)
+    rows = connection.execute(
+        'SELECT ref_count FROM records WHERE name = ?', ('callpath',))
+    assert sorted(r[0] for r in rows) == [1, 1, 1]
+    rows = connection.execute(
+        'SELECT COUNT(*) FROM dependencies WHERE child = ?',
+        (sqlite_database.query_one('mpich').dag_hash(),))
+    assert rows.fetchone()[0] == 2
+    connection.close()
+
+
+def test_sqlite_backend_reads_records_as_needed(sqlite_database):
+    json_db = spack.database.Database(sqlite_database.root)
+    sqlite_database.update_explicit('libelf', True)
+
+    with spack.config.override('config:db_backend', 'sqlite'):
+        db = spack.database.Database(sqlite_database.root)
+
+    # Lookups by hash, hash prefix and name only read the matching records
+    mpileaks = json_db.query_one('mpileaks ^mpich')
+    assert db.get_record(mpileaks).spec == mpileaks
+    assert db.get_by_hash(mpileaks.dag_hash()[:7]) == [mpileaks]
+    assert db.query_local('callpath') == json_db.query_local('callpath')
+    assert db.query_local('libelf', explicit=True)
+    assert not db._data._complete
+    assert len(db._data._records) < len(json_db.query(installed=any))
+
+    # Changes not written yet are seen by lookups of the same transaction
+    with db.write_transaction():
+        db._data[mpileaks.dag_hash()].explicit = False
+        db._journal_dirty.add(mpileaks.dag_hash())
+        assert mpileaks not in db._query('mpileaks', explicit=True)
+        assert mpileaks in db._query('mpileaks', explicit=False)
+    assert mpileaks in db.query_local('mpileaks', explicit=False)
+
+    # Queries that cannot be narrowed down read all the records
+    assert db.query_local() == json_db.query_local()
+    assert db._data._complete
+
+
+def test_sqlite_backend_export_and_upstream(
+        sqlite_database, tmpdir, monkeypatch):
+    sqlite_database.update_explicit('libelf', True)
+    expected = _db_state(sqlite_database)
+
+    # Upstream databases are read with the backend they were written with
+    upstream_db = spack.database.Database(
+        sqlite_database.root, is_upstream=True)
+    upstream_db._read()
+    assert upstream_db._sqlite
+    assert dict((k, v.to_dict()) for k, v in upstream_db._data.items()) == \
+        expected
+
+    # and opened read-only, without creating the schema
+    sqlite3 = pytest.importorskip('sqlite3')
+    connect = sqlite3.connect
+    opened = []
+    monkeypatch.setattr(sqlite3, 'connect', lambda *args, **kwargs:
+                        opened.append((args, kwargs)) or
+                        connect(*args, **kwargs))
+    upstream_db = spack.database.Database(
+        sqlite_database.root, is_upstream=True)
+    upstream_db._read()
+    assert upstream_db._data
+    assert upstream_db._query('libelf')
+    assert opened
+    if sys.version_info >= (3, 4):
+        for args, kwargs in opened:
+            assert kwargs == {'uri': True}
+            assert args[0].endswith('?mode=ro&immutable=1')
+
+    exported = str(tmpdir.join('index.json'))
+    sqlite_database.export_json(exported)
+
+    json_db = spack.database.Database(str(tmpdir.join('store')))
+    json_db.import_json(exported)
+    assert _db_state(json_db) == expected
+
+
+def test_upstream_index_is_cached(database, tmpdir, monkeypatch):
+    """Upstream indexes are read from the misc cache until they change."""
+    cache = spack.util.file_cache.FileCache(str(tmpdir.join('cache')))
+    monkeypatch.setattr(spack.caches, 'misc_cache', cache)
+
+    def _upstream_hashes():
+        upstream_db = spack.database.Database(database.root, is_upstream=True)
+        upstream_db._read()
+        return set(upstream_db._data)
+
+    expected = _upstream_hashes()
+    cached_file, = tmpdir.join('cache', 'upstream-db').listdir('*.json')
+
+    # Drop a record from the cached copy: it must be what's read next
+    with open(str(cached_file)) as f:
+        cached = json.load(f)
+    removed = database.query_one('externaltest').dag_hash()
+    del cached['index']['database']['installs'][removed]
+    with open(str(cached_file), 'w') as f:
+        json.dump(cached, f)
+
+    assert _upstream_hashes() == expected - set([removed])
+
+    # Any change to the index file invalidates the cached copy
+    index_stat = os.stat(database._index_path)
+    os.utime(database._index_path,
+             (index_stat.st_atime, index_stat.st_mtime + 1))
+
+    assert _upstream_hashes() == expected
@@ -12,6 +12,7 @@
 import llnl.util.lock as ulk
 
 import spack.binary_distribution
+import spack.build_times
 import spack.compilers
 import spack.directory_layout as dl
 import spack.installer as inst
@@ -19,6 +20,7 @@
 import spack.repo
 import spack.spec
 import spack.store
+import spack.util.jobserver
 import spack.util.lock as lk
 
 
@@ -183,6 +185,28 @@ def _spec(spec):
     assert 'Installing a from binary cache' in capfd.readouterr()[0]
 
 
+def test_process_binary_cache_tarball_prefetched(install_mockery,
+                                                 monkeypatch):
+    """Tests of _process_binary_cache_tarball with a prefetched tarball."""
+    class Prefetcher(object):
+        def take(self, spec):
+            return 'prefetched.spack'
+
+    extracted = []
+    monkeypatch.setattr(spack.binary_distribution, 'download_tarball',
+                        lambda spec: 'downloaded.spack')
+    monkeypatch.setattr(spack.binary_distribution, 'extract_tarball',
+                        lambda spec, tarball, **kwargs:
+                        extracted.append(tarball))
+    monkeypatch.setattr(spack.database.Database, 'add', _noop)
+
+    spec = spack.spec.Spec('a').concretized()
+    assert inst._process_binary_cache_tarball(
+        spec.package, spec, False, False, Prefetcher())
+    assert inst._process_binary_cache_tarball(spec.package, spec, False, False)
+    assert extracted == ['prefetched.spack', 'downloaded.spack']
+
+
 def test_try_install_from_binary_cache(install_mockery, mock_packages,
                                        monkeypatch, capsys):
     """Tests SystemExit path for_try_install_from_binary_cache."""
@@ -538,6 +562,66 @@ def test_installer_init_queue(install_mockery):
         assert 'dependent-install' in ids
 
 
+@pytest.mark.parametrize('durations,first', [
+    ({}, 'libelf'),
+    ({'mpich': 1000}, 'mpich'),
+])
+def test_installer_init_queue_critical_path(install_mockery, monkeypatch,
+                                            durations, first):
+    """Ready tasks on the longest chain of dependents come out first."""
+    monkeypatch.setattr(spack.build_times, 'duration',
+                        lambda spec: durations.get(spec.name, 1))
+
+    spec, installer = create_installer('mpileaks')
+    installer._init_queue(True, True)
+
+    # libelf -> libdwarf -> dyninst -> callpath -> mpileaks
+    assert installer.critical_paths['mpileaks'] == 1
+    assert installer.critical_paths['libelf'] == 5
+    assert installer._pop_task().pkg.name == first
+
+
+def test_installer_start_prefetcher(install_mockery, monkeypatch):
+    """The tarballs of the binary packages are prefetched in dependency
+    order."""
+    class Prefetcher(object):
+        def __init__(self, specs, jobs, budget):
+            self.specs, self.jobs, self.budget = specs, jobs, budget
+
+        def stop(self):
+            self.specs = None
+
+    monkeypatch.setattr(spack.binary_distribution, 'TarballPrefetcher',
+                        Prefetcher)
+    monkeypatch.setattr(inst, '_binary_cache_spec', lambda pkg: pkg.spec)
+
+    spec, installer = create_installer('dependent-install')
+    installer._init_queue(True, True)
+
+    # Nothing to download from without mirrors
+    installer._start_prefetcher()
+    assert installer.prefetcher is None
+
+    mirrors = {'test': 'file:///mirror'}
+    with spack.config.override('mirrors', mirrors):
+        installer._start_prefetcher()
+    prefetcher = installer.prefetcher
+    assert [s.name for s in prefetcher.specs] == \
+        ['dependency-install', 'dependent-install']
+    assert prefetcher.jobs == 4
+    assert prefetcher.budget == 2048 << 20
+
+    # The downloads are stopped with the installation
+    installer._cleanup_all_tasks()
+    assert installer.prefetcher is None
+    assert prefetcher.specs is None
+
+    with spack.config.override('mirrors', mirrors):
+        with spack.config.override('config:buildcache_prefetch_jobs', 0):
+            installer._start_prefetcher()
+    assert installer.prefetcher is None
+
+
 def test_install_task_use_cache(install_mockery, monkeypatch):
     spec, installer = create_installer('trivial-install-test-package')
     task = create_build_task(spec.package)
@@ -843,3 +927,59 @@ def test_install_skip_patch(install_mockery, mock_fetch):
     installer.install(fake=False, skip_patch=True)
 
     assert 'b' in installer.installed
+
+
+def test_install_concurrent_packages(install_mockery, monkeypatch):
+    """Ready packages are built at the same time, sharing the build jobs."""
+    running = []
+
+    complete_builds = inst.PackageInstaller._complete_builds
+
+    def _complete_builds(installer):
+        jobs = [j for _, _, j, _ in installer.building.values()]
+        assert sum(jobs) <= 4
+        running.append(len(jobs))
+        complete_builds(installer)
+
+    monkeypatch.setattr(
+        inst.PackageInstaller, '_complete_builds', _complete_builds)
+
+    spec, installer = create_installer('mpileaks')
+    with spack.config.override('config:build_jobs', 4):
+        with spack.config.override('config:jobserver', False):
+            installer.install(fake=True, use_cache=False,
+                              concurrent_packages=2)
+
+    assert not installer.building
+    assert max(running) == 2
+    for s in spec.traverse():
+        assert inst.package_id(s.package) in installer.installed
+        assert s.package.installed
+
+
+def test_install_serial_packages_no_jobserver(install_mockery,
+                                              monkeypatch):
+    """Builds one at a time keep their -jN rather than a jobserver."""
+    def _start(jobs):
+        raise AssertionError('no jobserver for builds one at a time')
+    monkeypatch.setattr(spack.util.jobserver, 'start', _start)
+
+    spec, installer = create_installer('mpileaks')
+    installer.install(fake=True, use_cache=False, concurrent_packages=1)
+
+    assert installer.jobserver is None
+    for s in spec.traverse():
+        assert s.package.installed
+
+
+def test_install_concurrent_packages_jobserver(install_mockery):
+    """Concurrent builds beyond the first hold a jobserver token."""
+    spec, installer = create_installer('mpileaks')
+    installer.install(fake=True, use_cache=False, concurrent_packages=2)
+
+    assert not installer.building
+    assert not installer.token_holders
+    assert not installer.jobserver_token
+    assert installer.jobserver is spack.util.jobserver.current()
+    for s in spec.traverse():
+        assert s.package.installed
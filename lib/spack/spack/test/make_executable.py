@@ -14,6 +14,7 @@
 import unittest
 
 from spack.build_environment import MakeExecutable
+from spack.util.jobserver import Jobserver
 from spack.util.environment import path_put_first
 
 
@@ -110,3 +111,22 @@ def test_make_jobs_env(self):
         self.assertEqual(make(output=str, jobs_env='MAKE_PARALLELISM',
                               _dump_env=dump_env).strip(), '-j8')
         self.assertEqual(dump_env['MAKE_PARALLELISM'], '8')
+
+    def test_make_jobserver(self):
+        jobserver = Jobserver.create(8)
+        try:
+            make = MakeExecutable('make', 8, jobserver)
+            dump_env = {}
+            self.assertEqual(make('install', output=str,
+                                  _dump_env=dump_env).strip(), 'install')
+            self.assertEqual(
+                dump_env['MAKEFLAGS'], '-j --jobserver-fds={0},{1}'.format(
+                    jobserver.read_fd, jobserver.write_fd))
+
+            # Serial calls do not take jobs from the jobserver
+            dump_env = {}
+            self.assertEqual(make(parallel=False, output=str,
+                                  _dump_env=dump_env).strip(), '')
+            self.assertNotIn('--jobserver', dump_env.get('MAKEFLAGS', ''))
+        finally:
+            jobserver.close()
@@ -6,22 +6,30 @@
 """
 This test checks the binary packaging infrastructure
 """
+import collections
+import io
 import os
 import stat
 import shutil
+import tarfile
 import pytest
 import argparse
 import re
 import platform
 
+from contextlib import closing
+
 from llnl.util.filesystem import mkdirp
 
+import spack.caches
 import spack.repo
 import spack.store
 import spack.binary_distribution as bindist
 import spack.cmd.buildcache as buildcache
+import spack.util.spack_yaml as syaml
 from spack.spec import Spec
 from spack.paths import mock_gpg_keys_path
+from spack.util.file_cache import FileCache
 from spack.fetch_strategy import URLFetchStrategy, FetchStrategyComposite
 from spack.relocate import needs_binary_relocation, needs_text_relocation
 from spack.relocate import relocate_text, relocate_links
@@ -221,6 +229,354 @@ def test_relocate_text(tmpdir):
     bindist._cached_specs = set()
 
 
+def test_streamed_prefix_tarball(tmpdir):
+    old_root = '/home/spack/opt/spack'
+    old_prefix = old_root + '/linux/pkg-1.0'
+    prefix = tmpdir.join('linux', 'pkg-1.0')
+    prefix.join('bin', 'script').write(
+        '#!/bin/bash /home/spack/bin/sbang\n{0}/bin\n'.format(old_prefix),
+        ensure=True)
+    prefix.join('lib', 'libfoo.so').write(
+        b'\x7fELF\0' + old_root.encode('utf-8') + b'\0', mode='wb',
+        ensure=True)
+    prefix.join('share', 'README').write('nothing to relocate\n',
+                                         ensure=True)
+    os.symlink('README', str(prefix.join('share', 'link')))
+    # A stale buildinfo file, from an install of a buildcache
+    prefix.join('.spack', 'binary_distribution').write('{}', ensure=True)
+
+    spec = collections.namedtuple('Spec', ['prefix'])(str(prefix))
+    buildinfo = {
+        'buildpath': old_root,
+        'spackprefix': '/home/spack',
+        'prefix_to_hash': {old_prefix: 'abcdef'},
+        'relocate_textfiles': ['bin/script', 'share/README'],
+        'relocate_binaries': ['lib/libfoo.so'],
+        'relocate_links': [],
+    }
+
+    def write_prefix(fileobj):
+        with closing(tarfile.open(mode='w|gz', fileobj=fileobj)) as tar:
+            bindist.add_prefix_to_tarball(
+                tar, spec, buildinfo, False, str(tmpdir))
+
+    # The tarball is written directly in the .spack archive
+    spackfile = str(tmpdir.join('pkg.spack'))
+    with open(spackfile, 'wb') as f:
+        checksum = bindist._add_streamed_member(f, 'pkg.tar.gz', write_prefix)
+        with closing(tarfile.open(fileobj=f, mode='w')) as tar:
+            tar.add(name=str(prefix.join('share', 'README')), arcname='x')
+
+    with closing(tarfile.open(spackfile, 'r')) as tar:
+        assert tar.getnames() == ['pkg.tar.gz', 'x']
+        tar.extractall(str(tmpdir.join('spack')))
+    tarball = str(tmpdir.join('spack', 'pkg.tar.gz'))
+    assert bindist.checksum_tarball(tarball) == checksum
+    with closing(tarfile.open(tarball, 'r')) as tar:
+        tar.extractall(str(tmpdir.join('extracted')))
+
+    workdir = tmpdir.join('extracted', 'pkg-1.0')
+    assert workdir.join('share', 'README').read() == 'nothing to relocate\n'
+    assert os.readlink(str(workdir.join('share', 'link'))) == 'README'
+
+    buildinfo = bindist.read_buildinfo_file(str(workdir))
+    offsets = bindist.read_relocation_offsets(
+        str(workdir), buildinfo,
+        buildinfo['relocate_textfiles'] + buildinfo['relocate_binaries'])
+
+    # Files without prefixes are left out
+    script = str(workdir.join('bin', 'script'))
+    library = str(workdir.join('lib', 'libfoo.so'))
+    assert sorted(offsets) == [script, library]
+    assert offsets[script] == (os.path.getsize(script), [
+        (0, '#!/bin/bash /home/spack/bin/sbang', 33),
+        (34, old_prefix, len(old_prefix) + 4)])
+    assert offsets[library] == (os.path.getsize(library), [
+        (5, old_root, len(old_root))])
+
+    # Buildcaches created without offsets are scanned
+    del buildinfo['relocation_offsets']
+    assert bindist.read_relocation_offsets(
+        str(workdir), buildinfo, buildinfo['relocate_textfiles']) is None
+
+
+def test_prefix_members_stay_in_prefix(tmpdir):
+    outside = tmpdir.join('outside').ensure(dir=True)
+    tarball = io.BytesIO()
+
+    def add(name, data=None, **attrs):
+        info = tarfile.TarInfo(name)
+        for attr, value in attrs.items():
+            setattr(info, attr, value)
+        if data is not None:
+            info.size = len(data)
+            data = io.BytesIO(data)
+        tar.addfile(info, data)
+
+    with closing(tarfile.open(fileobj=tarball, mode='w')) as tar:
+        add('pkg', type=tarfile.DIRTYPE, mode=0o755)
+        add('pkg/file', b'file')
+        add('pkg/../../outside/dotdot', b'dotdot')
+        add(str(outside.join('absolute')), b'absolute')
+        # an absolute link is kept, but nothing is written through it
+        add('pkg/link', type=tarfile.SYMTYPE, linkname=str(outside))
+        add('pkg/link/through', b'through')
+        add('pkg/link', b'over')
+        add('pkg/hard', type=tarfile.LNKTYPE, linkname='pkg/file')
+        add('pkg/hardlink', type=tarfile.LNKTYPE, linkname='pkg/link')
+        add('pkg/hardout', type=tarfile.LNKTYPE,
+            linkname=str(outside.join('x')))
+
+    prefix = tmpdir.join('prefix')
+    tarball.seek(0)
+    with closing(tarfile.open(fileobj=tarball, mode='r|')) as tar:
+        tar.extractall(str(prefix), members=bindist._prefix_members(tar))
+
+    assert sorted(os.listdir(str(prefix))) == ['file', 'hard', 'link']
+    assert os.readlink(str(prefix.join('link'))) == str(outside)
+    assert prefix.join('hard').read() == 'file'
+    assert outside.listdir() == []
+
+
+def add_spec_file(cache, spec):
+    """Write the spec.yaml file of a spec in a build cache directory, and
+    return its name and content."""
+    spec_dict = spec.to_dict()
+    spec_dict['full_hash'] = spec.full_hash()
+    spec_dict['binary_cache_checksum'] = {
+        'hash_algorithm': 'sha256', 'hash': spec.dag_hash()}
+    name = bindist.tarball_name(spec, '.spec.yaml')
+    cache.join(name).write(syaml.dump(spec_dict), ensure=True)
+    return name, spec_dict
+
+
+def test_package_index(mock_packages, mutable_config, monkeypatch, tmpdir):
+    monkeypatch.setattr(bindist, '_cached_specs', set())
+    monkeypatch.setattr(bindist, '_cached_indices', {})
+    monkeypatch.setattr(spack.caches, 'misc_cache',
+                        FileCache(str(tmpdir.join('misc_cache'))))
+
+    mirror = tmpdir.join('mirror')
+    cache = mirror.join('build_cache')
+    cache_url = 'file://' + str(cache)
+    spack.config.set('mirrors', {'test': 'file://' + str(mirror)})
+    spec = Spec('libdwarf').concretized()
+    add_spec_file(cache, spec)
+    bindist.generate_package_index(cache_url)
+
+    reads = []
+    read_url = bindist._read_url
+    monkeypatch.setattr(bindist, '_read_url',
+                        lambda url: reads.append(os.path.basename(url)) or
+                        read_url(url))
+    index = bindist.get_index(cache_url)
+    spec_file = bindist.tarball_name(spec, '.spec.yaml')
+    assert list(index) == [spec_file]
+    assert index[spec_file]['full_hash'] == spec.full_hash()
+    assert cache.join('index.json.hash').read() == \
+        bindist.checksum_tarball(str(cache.join('index.json.gz')))
+    assert spec in bindist.get_specs(allarch=True)
+
+    # The index is read again only if its hash changes, specs pushed
+    # without updating it are still found one by one
+    other = Spec('libelf').concretized()
+    add_spec_file(cache, other)
+    assert other not in bindist.get_specs(allarch=True)
+    assert other in bindist.get_spec(other)
+    assert reads.count('index.json.gz') == 1
+    bindist.generate_package_index(cache_url)
+    assert sorted(bindist.get_index(cache_url)) == \
+        sorted([spec_file, bindist.tarball_name(other, '.spec.yaml')])
+    assert reads.count('index.json.gz') == 2
+
+    # Other processes only check the hash of the copy in the misc cache
+    monkeypatch.setattr(bindist, '_cached_indices', {})
+    del reads[:]
+    assert sorted(bindist.get_index(cache_url, revalidate=False)) == \
+        sorted([spec_file, bindist.tarball_name(other, '.spec.yaml')])
+    assert bindist.get_index(cache_url, revalidate=False)
+    assert reads == ['index.json.hash']
+
+    # Build caches without an index are still read spec by spec
+    cache.join('index.json.gz').remove()
+    cache.join('index.json.hash').remove()
+    monkeypatch.setattr(bindist, '_cached_specs', set())
+    assert set([spec, other]) <= bindist.get_specs(allarch=True)
+    assert bindist.get_index(cache_url) is None
+
+
+def test_update_package_index(mock_packages, config, monkeypatch, tmpdir):
+    cache = tmpdir.join('build_cache')
+    cache_url = 'file://' + str(cache)
+
+    def index():
+        with open(str(cache.join('index.json.gz')), 'rb') as f:
+            return bindist.read_index_data(f.read())
+
+    # Build caches without an index get a complete one
+    libelf = add_spec_file(cache, Spec('libelf').concretized())
+    libdwarf = add_spec_file(cache, Spec('libdwarf').concretized())
+    bindist.update_package_index(cache_url, dict([libdwarf]))
+    assert sorted(index()) == sorted([libelf[0], libdwarf[0]])
+
+    # Otherwise entries are added without listing the build cache
+    def list_url(url):
+        raise AssertionError('the build cache is listed')
+    monkeypatch.setattr(bindist.web_util, 'list_url', list_url)
+    mpileaks = add_spec_file(cache, Spec('mpileaks').concretized())
+    bindist.update_package_index(cache_url, dict([mpileaks]))
+    assert sorted(index()) == sorted([libelf[0], libdwarf[0], mpileaks[0]])
+    assert index()[mpileaks[0]]['full_hash'] == mpileaks[1]['full_hash']
+    assert cache.join('index.json.hash').read() == \
+        bindist.checksum_tarball(str(cache.join('index.json.gz')))
+
+    # An index updated by another process in between is read again
+    read_versioned_url = bindist.web_util.read_versioned_url
+    callpath = add_spec_file(cache, Spec('callpath').concretized())
+    dyninst = add_spec_file(cache, Spec('dyninst').concretized())
+
+    def concurrent_read(url):
+        result = read_versioned_url(url)
+        monkeypatch.setattr(
+            bindist.web_util, 'read_versioned_url', read_versioned_url)
+        bindist.update_package_index(cache_url, dict([dyninst]))
+        return result
+    monkeypatch.setattr(
+        bindist.web_util, 'read_versioned_url', concurrent_read)
+    bindist.update_package_index(cache_url, dict([callpath]))
+    assert callpath[0] in index()
+    assert dyninst[0] in index()
+
+    # The hash pushed last is the one of the index stored last, even when
+    # another process pushes an index and its hash in between
+    monkeypatch.setattr(
+        bindist.web_util, 'read_versioned_url', read_versioned_url)
+    push_to_url_if_version = bindist.web_util.push_to_url_if_version
+    a = add_spec_file(cache, Spec('a').concretized())
+    b = add_spec_file(cache, Spec('b').concretized())
+
+    def concurrent_push(local, remote, version, **kwargs):
+        if remote.endswith('index.json.hash'):
+            monkeypatch.setattr(bindist.web_util, 'push_to_url_if_version',
+                                push_to_url_if_version)
+            bindist.update_package_index(cache_url, dict([b]))
+        return push_to_url_if_version(local, remote, version, **kwargs)
+    monkeypatch.setattr(
+        bindist.web_util, 'push_to_url_if_version', concurrent_push)
+    bindist.update_package_index(cache_url, dict([a]))
+    assert a[0] in index()
+    assert b[0] in index()
+    assert cache.join('index.json.hash').read() == \
+        bindist.checksum_tarball(str(cache.join('index.json.gz')))
+
+
+def test_specs_needing_rebuild(mock_packages, config, monkeypatch, tmpdir):
+    monkeypatch.setattr(bindist, '_cached_indices', {})
+    monkeypatch.setattr(spack.caches, 'misc_cache',
+                        FileCache(str(tmpdir.join('misc_cache'))))
+
+    mirror_url = 'file://' + str(tmpdir.join('mirror'))
+    cache = tmpdir.join('mirror', 'build_cache')
+    cache_url = 'file://' + str(cache)
+    specs = [Spec(name).concretized() for name in ('libdwarf', 'libelf')]
+    for spec in specs:
+        add_spec_file(cache, spec)
+
+    checked = []
+    needs_rebuild = bindist.needs_rebuild
+    monkeypatch.setattr(bindist, 'needs_rebuild',
+                        lambda spec, *args: checked.append(spec.name) or
+                        needs_rebuild(spec, *args))
+
+    # Without an index, each spec.yaml file is read
+    assert bindist.specs_needing_rebuild(specs, mirror_url) == []
+    assert sorted(checked) == ['libdwarf', 'libelf']
+
+    # With an index, the specs are only compared to it
+    bindist.generate_package_index(cache_url)
+    del checked[:]
+    assert bindist.specs_needing_rebuild(specs, mirror_url) == []
+
+    spec_dict = syaml.load(cache.join(
+        bindist.tarball_name(specs[1], '.spec.yaml')).read())
+    spec_dict['full_hash'] = 'outdated'
+    bindist.update_package_index(cache_url, {
+        bindist.tarball_name(specs[1], '.spec.yaml'): spec_dict})
+    missing = Spec('a').concretized()
+    assert bindist.specs_needing_rebuild(
+        [missing] + specs, mirror_url) == [missing, specs[1]]
+    assert checked == []
+
+
+def test_tarball_prefetcher(mock_packages, mutable_config, tmpdir):
+    mirror = tmpdir.join('mirror')
+    spack.config.set('mirrors', {'test': 'file://' + str(mirror)})
+    specs = [Spec(name).concretized()
+             for name in ('libelf', 'libdwarf', 'a', 'b')]
+    for spec in specs[:3]:
+        mirror.join('build_cache', bindist.tarball_path_name(
+            spec, '.spack')).write(spec.name, ensure=True)
+
+    prefetcher = bindist.TarballPrefetcher(specs, 2, 1 << 30)
+    try:
+        for spec in specs[:3]:
+            path = prefetcher.take(spec)
+            assert open(path).read() == spec.name
+            os.remove(path)
+
+        # Tarballs missing from the mirrors, or of specs not given, are
+        # left to download_tarball
+        assert prefetcher.take(specs[3]) is None
+        assert prefetcher.take(Spec('c').concretized()) is None
+    finally:
+        prefetcher.stop()
+
+    # Only one tarball fits in the budget until it is taken
+    prefetcher = bindist.TarballPrefetcher(specs[:2], 1, 1)
+    try:
+        with prefetcher.condition:
+            while prefetcher.downloads[specs[0].dag_hash()] is None:
+                prefetcher.condition.wait()
+        assert prefetcher.pending == [specs[1].dag_hash()]
+        assert prefetcher.take(specs[1]) is None
+        path = prefetcher.take(specs[0])
+        assert open(path).read() == 'libelf'
+        os.remove(path)
+    finally:
+        prefetcher.stop()
+
+    # Downloads reserve the size of their tarball before they start, and
+    # wait for tarballs to be taken when it does not fit in the budget
+    def wait_for_reservations(prefetcher):
+        with prefetcher.condition:
+            while not (prefetcher.waiting and
+                       any(prefetcher.downloads.values())):
+                prefetcher.condition.wait()
+            waiting = [s for s in specs[:2]
+                       if s.dag_hash() in prefetcher.waiting]
+            done = [s for s in specs[:2] if s not in waiting]
+            assert prefetcher.stored == len(done[0].name)
+        return done[0], waiting[0]
+
+    for cancel in (False, True):
+        prefetcher = bindist.TarballPrefetcher(specs[:2], 2, 10)
+        try:
+            done, waiting = wait_for_reservations(prefetcher)
+            if cancel:
+                # take() does not wait for a download waiting for space
+                assert prefetcher.take(waiting) is None
+            path = prefetcher.take(done)
+            assert open(path).read() == done.name
+            os.remove(path)
+            if not cancel:
+                path = prefetcher.take(waiting)
+                assert open(path).read() == waiting.name
+                os.remove(path)
+            assert prefetcher.stored == 0
+        finally:
+            prefetcher.stop()
+
+
 def test_relocate_links(tmpdir):
     with tmpdir.as_cwd():
         old_layout_root = os.path.join(
@@ -3,17 +3,22 @@
 #
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
+import io
 import os.path
 import platform
 import shutil
+import sys
+import time
 
 import pytest
 
 import llnl.util.filesystem
+import llnl.util.tty as tty
 import spack.paths
 import spack.relocate
 import spack.store
 import spack.tengine
+import spack.util.elf
 import spack.util.executable
 
 
@@ -87,3 +92,303 @@ def test_file_is_relocatable_errors(tmpdir):
         with pytest.raises(ValueError) as exc_info:
             spack.relocate.file_is_relocatable('delete.me')
         assert 'is not an absolute path' in str(exc_info.value)
+
+
+def test_relocate_text_single_pass(tmpdir):
+    old_root, new_root = '/old/opt/spack', '/new/opt/spack'
+    old_dep, new_dep = old_root + '/linux/dep-1.0', new_root + '/dep-2.0'
+    old_pkg, new_pkg = old_root + '/linux/pkg-1.0', '/old/opt/spack/pkg'
+
+    text = tmpdir.join('script.sh')
+    text.write('-I{0}/include -L{1}/lib {2}/share\n'.format(
+        old_pkg, old_dep, old_root))
+    untouched = tmpdir.join('untouched.txt')
+    untouched.write('nothing to relocate here\n')
+    mtime = int(os.path.getmtime(str(untouched))) - 100
+    os.utime(str(untouched), (mtime, mtime))
+
+    spack.relocate.relocate_text(
+        [str(text), str(untouched)], old_root, new_root, old_pkg, new_pkg,
+        '/old/spack', '/new/spack', {old_dep: new_dep})
+
+    # Each prefix is replaced once, even where the new prefix of the package
+    # contains the old layout root
+    assert text.read() == '-I{0}/include -L{1}/lib {2}/share\n'.format(
+        new_pkg, new_dep, new_root)
+    assert os.path.getmtime(str(untouched)) == mtime
+
+
+def test_relocate_text_bin_single_pass(tmpdir):
+    old_root, new_root = '/old/opt/spack', '/new/opt'
+    old_dep, new_dep = old_root + '/dep-1.0', new_root + '/dep'
+    old_long, new_long = old_root + '/short', old_root + '/much-longer'
+
+    binary = tmpdir.join('libfoo.so')
+    data = b'\x7fELF\0' + b'\0'.join(
+        p.encode('utf-8') + b'/lib' for p in (old_dep, old_root, old_long))
+    binary.write(data, mode='wb')
+
+    spack.relocate.relocate_text_bin(
+        [str(binary)], old_root, new_root, old_dep, new_dep,
+        '/old/spack', '/new/spack',
+        {old_dep: new_dep, old_root: new_root, old_long: new_long})
+
+    # New prefixes are padded to the length of the old ones, and prefixes
+    # which would not fit are only relocated through the layout root
+    def padded(old, new):
+        return ('/' * (len(old) - len(new)) + new).encode('utf-8')
+
+    assert binary.read(mode='rb') == b'\x7fELF\0' + b'\0'.join([
+        padded(old_dep, new_dep) + b'/lib',
+        padded(old_root, new_root) + b'/lib',
+        padded(old_root, new_root) + b'/short/lib'])
+
+
+def test_relocate_at_recorded_offsets(tmpdir):
+    old_root, new_root = '/old/opt/spack', '/new/opt'
+    old_pkg, new_pkg = old_root + '/pkg-1.0', new_root + '/pkg'
+    prefixes = [old_pkg, old_root]
+
+    text = tmpdir.join('script.sh')
+    content = '-L{0}/lib /usr{0} {1}/share\n'.format(old_pkg, old_root)
+    text.write(content)
+    binary = tmpdir.join('libfoo.so')
+    binary.write(b'\x7fELF\0' + old_pkg.encode('utf-8') + b'/lib\0',
+                 mode='wb')
+
+    text_offsets = spack.relocate.prefix_offsets(str(text), prefixes)
+    bin_offsets = spack.relocate.prefix_offsets(
+        str(binary), prefixes, binary=True)
+
+    # Prefixes within other components of a path are not relocated in text
+    assert text_offsets == [(2, 0, len(old_pkg) + 4),
+                            (content.rindex(old_root), 1, len(old_root) + 6)]
+    assert bin_offsets == [(5, 0, len(old_pkg) + 4)]
+
+    def manifest(path, occurrences):
+        return (os.path.getsize(str(path)),
+                [(o, prefixes[i], n) for o, i, n in occurrences])
+
+    binary_data = binary.read(mode='rb')
+    spack.relocate.relocate_text(
+        [str(text)], old_root, new_root, old_pkg, new_pkg,
+        '/old/spack', '/new/spack', {old_pkg: new_pkg, old_root: new_root},
+        offsets={str(text): manifest(text, text_offsets)})
+    spack.relocate.relocate_text_bin(
+        [str(binary)], old_root, new_root, old_pkg, new_pkg,
+        '/old/spack', '/new/spack', {old_pkg: new_pkg, old_root: new_root},
+        offsets={str(binary): manifest(binary, bin_offsets)})
+
+    assert text.read() == '-L{0}/lib /usr{1} {2}/share\n'.format(
+        new_pkg, old_pkg, new_root)
+    padding = b'/' * (len(old_pkg) - len(new_pkg))
+    assert binary.read(mode='rb') == binary_data.replace(
+        old_pkg.encode('utf-8'), padding + new_pkg.encode('utf-8'))
+
+
+def test_relocate_changed_file_at_recorded_offsets(tmpdir):
+    old_root, new_root = '/old/opt/spack', '/new/opt'
+    text = tmpdir.join('script.sh')
+    text.write('{0}/bin\n'.format(old_root))
+    offsets = spack.relocate.prefix_offsets(str(text), [old_root])
+
+    # Files changed since their offsets were recorded are scanned
+    text.write('# changed\n{0}/bin\n'.format(old_root))
+    spack.relocate.relocate_text(
+        [str(text)], old_root, new_root, old_root, new_root,
+        '/old/spack', '/new/spack', {},
+        offsets={str(text): (4 + len(old_root), [
+            (o, old_root, n) for o, _, n in offsets])})
+
+    assert text.read() == '# changed\n{0}/bin\n'.format(new_root)
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_relocate_text_jobs(tmpdir, jobs):
+    old_root, new_root = '/old/opt/spack', '/new/opt/spack'
+    files = [tmpdir.join('file-{0}.txt'.format(i)) for i in range(8)]
+    for i, f in enumerate(files):
+        f.write('{0}/pkg-{1}/bin\n'.format(old_root, i))
+
+    spack.relocate.relocate_text(
+        [str(f) for f in files], old_root, new_root, old_root, new_root,
+        '/old/spack', '/new/spack', {}, jobs=jobs)
+
+    for i, f in enumerate(files):
+        assert f.read() == '{0}/pkg-{1}/bin\n'.format(new_root, i)
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_relocate_text_errors(tmpdir, jobs):
+    old_root, new_root = '/old/opt/spack', '/new/opt/spack'
+    good = tmpdir.join('good.txt')
+    good.write(old_root)
+    missing = [str(tmpdir.join('missing-{0}.txt'.format(i)))
+               for i in range(2)]
+
+    with pytest.raises(spack.relocate.RelocationError) as exc_info:
+        spack.relocate.relocate_text(
+            [missing[0], str(good), missing[1]], old_root, new_root,
+            old_root, new_root, '/old/spack', '/new/spack', {}, jobs=jobs)
+
+    # All the files are attempted, and the errors are reported in order
+    assert [p for p, _ in exc_info.value.errors] == missing
+    assert good.read() == new_root
+
+
+@pytest.mark.parametrize('jobs,lookups', [(1, 0), (3, 1)])
+def test_relocate_elf_binaries_patchelf_lookup(monkeypatch, jobs, lookups):
+    found = []
+
+    def _get_patchelf():
+        found.append('/usr/bin/patchelf')
+        return found[-1]
+    monkeypatch.setattr(spack.relocate, 'get_patchelf', _get_patchelf)
+
+    mapped = []
+
+    def _map_files(function, files, jobs=1):
+        mapped.extend(files)
+    monkeypatch.setattr(spack.relocate, '_map_files', _map_files)
+
+    spack.relocate.relocate_elf_binaries(
+        ['/new/a.so', '/new/b.so'], '/old', '/new', {}, False, '/old/p',
+        '/new/p', jobs=jobs)
+
+    # Pool workers are given patchelf, as they cannot install it
+    assert len(found) == lookups
+    assert [args[-1] for _, args in mapped] == (found or [None]) * 2
+
+
+@pytest.mark.parametrize('content,expected', [
+    (b'', ('inode', 'x-empty')),
+    (b'\x7fELF\x02\x01\x01' + b'\0' * 9 + b'\x03\x00',
+     ('application', 'x-sharedlib')),
+    (b'\x7fELF\x02\x02\x01' + b'\0' * 9 + b'\x00\x02',
+     ('application', 'x-executable')),
+    (b'\xcf\xfa\xed\xfe\x07\x00\x00\x01', ('application', 'x-mach-binary')),
+    (b'!<arch>\nfoo.o/', ('application', 'x-archive')),
+    (b'#!/bin/bash\necho hello\n', ('text', 'x-shellscript')),
+    (b'#!/usr/bin/env python3.8\nprint(1)\n', ('text', 'x-python')),
+    (u'prefix = /opt/spack\n\xe9\n'.encode('utf-8'), ('text', 'plain')),
+    (b'\x89PNG\r\n\x1a\n\0\0\0\rIHDR', ('image', 'png')),
+    (b'\x01\x02\0\0data', ('application', 'octet-stream')),
+])
+def test_mime_type(tmpdir, content, expected):
+    path = tmpdir.join('file')
+    path.write(content, mode='wb')
+    assert spack.relocate.mime_type(str(path)) == expected
+
+
+def test_mime_type_falls_back_to_file(tmpdir, monkeypatch):
+    # Latin-1 text cannot be told from binary data without ``file``
+    path = tmpdir.join('latin1.txt')
+    path.write(u'caf\xe9\n'.encode('latin-1'), mode='wb')
+    monkeypatch.setattr(spack.relocate, '_file_mime_type',
+                        lambda f: ('text', 'plain'))
+    assert spack.relocate.mime_type(str(path)) == ('text', 'plain')
+
+
+@pytest.mark.maybeslow
+@pytest.mark.requires_executables('file')
+def test_mime_type_benchmark():
+    """Classify the files of a real prefix, the one of the Python running
+    Spack, like ``file`` does, and report how much faster it is."""
+    paths = []
+    for root, _, files in os.walk(sys.prefix):
+        paths.extend(os.path.join(root, f) for f in files)
+        if len(paths) >= 1000:
+            break
+
+    start = time.time()
+    ours = [spack.relocate._magic_mime_type(p) for p in paths]
+    magic_time = time.time() - start
+
+    start = time.time()
+    theirs = [spack.relocate._file_mime_type(p) for p in paths]
+    file_time = time.time() - start
+
+    elf_subtypes = set(spack.relocate._elf_types.values())
+    elf_subtypes.add('x-pie-executable')
+    for path, our_type, file_type in zip(paths, ours, theirs):
+        if our_type is None:
+            continue
+        # Binaries needing relocation are always found
+        assert (our_type[1] in elf_subtypes) == \
+            (file_type[1] in elf_subtypes), path
+        if file_type[0] == 'text':
+            assert our_type[0] == 'text', path
+
+    tty.msg('Classified {0} files in {1:.2f}s, vs {2:.2f}s with file'
+            .format(len(paths), magic_time, file_time))
+
+
+@pytest.mark.requires_executables('/usr/bin/gcc')
+@pytest.mark.skipif(
+    platform.system().lower() != 'linux', reason='ELF files only on linux')
+def test_modify_elf_object_in_place(tmpdir, monkeypatch):
+    src = tmpdir.join('main.c')
+    src.write('int main() { return 0; }\n')
+    executable = str(tmpdir.join('main.x'))
+    compiler = spack.util.executable.Executable('/usr/bin/gcc')
+    compiler(str(src), '-o', executable, '-Wl,-rpath,/old/prefix/lib')
+
+    # RPATHs that fit are rewritten without patchelf
+    def _no_patchelf():
+        raise AssertionError('patchelf should not be needed')
+    monkeypatch.setattr(spack.relocate, 'get_patchelf', _no_patchelf)
+
+    assert spack.relocate.get_existing_elf_rpaths(executable) == \
+        ['/old/prefix/lib']
+    spack.relocate.modify_elf_object(executable, ['/new/lib', '/lib'])
+    assert spack.relocate.get_existing_elf_rpaths(executable) == \
+        ['/new/lib', '/lib']
+
+
+def test_elf_rpaths_fall_back_to_patchelf(tmpdir, monkeypatch):
+    # RPATHs that are not valid UTF-8 are read and written by patchelf
+    def _get_rpath(path):
+        return b'/lib/\xff'.decode('utf-8')
+    monkeypatch.setattr(spack.util.elf, 'get_rpath', _get_rpath)
+
+    def _set_rpath(path, rpath):
+        return b'/lib/\xff'.decode('utf-8')
+    monkeypatch.setattr(spack.util.elf, 'set_rpath', _set_rpath)
+
+    log = tmpdir.join('patchelf.log')
+    patchelf = tmpdir.join('fake-patchelf')
+    patchelf.write('#!/bin/sh\necho "$@" >> {0}\necho /fallback/lib\n'
+                   .format(log))
+    patchelf.chmod(0o755)
+
+    binary = str(tmpdir.join('libfoo.so'))
+    assert spack.relocate.get_existing_elf_rpaths(
+        binary, str(patchelf)) == ['/fallback/lib']
+    spack.relocate.modify_elf_object(binary, ['/new/lib'], str(patchelf))
+    assert log.read().splitlines() == [
+        '--print-rpath ' + binary,
+        '--force-rpath --set-rpath /new/lib ' + binary]
+
+
+@pytest.mark.requires_executables('/usr/bin/gcc')
+@pytest.mark.skipif(
+    platform.system().lower() != 'linux', reason='ELF files only on linux')
+def test_make_elf_data_relative(tmpdir):
+    src = tmpdir.join('main.c')
+    src.write('int main() { return 0; }\n')
+    executable = str(tmpdir.join('main.x'))
+    compiler = spack.util.executable.Executable('/usr/bin/gcc')
+    compiler(str(src), '-o', executable,
+             '-Wl,-rpath,/old/opt/spack/dep/lib:/usr/lib')
+    with open(executable, 'rb') as f:
+        data = f.read()
+
+    new_data = spack.relocate.make_elf_data_relative(
+        data, '/old/opt/spack/pkg/bin/main.x', '/old/opt/spack')
+
+    # Only the content in memory is changed
+    assert len(new_data) == len(data)
+    assert spack.util.elf.get_rpath(executable) == \
+        '/old/opt/spack/dep/lib:/usr/lib'
+    assert spack.util.elf.get_file_rpath(io.BytesIO(new_data)) == \
+        '$ORIGIN/../../dep/lib:/usr/lib'
@@ -0,0 +1,179 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+import gzip
+import io
+import multiprocessing
+import os
+import tarfile
+import time
+from contextlib import closing
+
+import pytest
+
+import llnl.util.tty as tty
+
+import spack.util.compression as compression
+
+#: Data compressing somewhat, spanning several blocks
+data = b''.join(
+    ('line {0} of {1}\n'.format(i, i * 7919 % 1013)).encode('utf-8')
+    for i in range(20000))
+
+requires_zstd = pytest.mark.skipif(
+    not compression.have_zstd_support,
+    reason='the zstandard module is not installed')
+
+
+def compress(data, fmt, **kwargs):
+    out = io.BytesIO()
+    writer = compression.compressed_writer(out, fmt, **kwargs)
+    # Write in chunks the size of the records of tarfile
+    for i in range(0, len(data), 10240):
+        writer.write(data[i:i + 10240])
+    writer.close()
+    return out.getvalue()
+
+
+def decompress(compressed, fmt):
+    reader = compression.decompressed_reader(io.BytesIO(compressed), fmt)
+    return reader.read()
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_parallel_gzip(jobs):
+    out = io.BytesIO()
+    writer = compression.ParallelGzipWriter(
+        out, level=6, jobs=jobs, block_size=64 * 1024)
+    for i in range(0, len(data), 10240):
+        writer.write(data[i:i + 10240])
+    writer.close()
+
+    # The output is made of several gzip members, readable as one stream
+    compressed = out.getvalue()
+    assert compressed.count(b'\x1f\x8b\x08') > 1
+    assert len(compressed) < len(data)
+    with closing(gzip.GzipFile(fileobj=io.BytesIO(compressed))) as f:
+        assert f.read() == data
+
+    # The file is left open
+    out.write(b'')
+
+
+def test_gzip_reader():
+    members = compress(data[:1000], 'gzip') + compress(data, 'gzip')
+
+    # Read from a file object that can't seek, in blocks ending anywhere
+    class Pipe(object):
+        def __init__(self, data):
+            self.data = io.BytesIO(data)
+
+        def read(self, size):
+            return self.data.read(size)
+
+    reader = compression.GzipReader(Pipe(members), block_size=1000)
+    assert reader.read(10) == data[:10]
+    assert reader.read() == data[10:1000] + data
+    assert reader.read(10) == b''
+
+
+def test_parallel_gzip_empty():
+    compressed = compress(b'', 'gzip', jobs=4)
+    with closing(gzip.GzipFile(fileobj=io.BytesIO(compressed))) as f:
+        assert f.read() == b''
+
+
+def test_gzip_member():
+    compressed = compression.gzip_member(data)
+    with closing(gzip.GzipFile(fileobj=io.BytesIO(compressed))) as f:
+        assert f.read() == data
+
+    # No mtime is recorded, so the output is reproducible
+    assert compressed[4:8] == b'\0' * 4
+    assert compression.gzip_member(data) == compressed
+
+
+@pytest.mark.parametrize('fmt', [
+    'gzip', pytest.param('zstd', marks=requires_zstd)])
+def test_compressed_tarball(tmpdir, fmt):
+    tmpdir.join('prefix', 'bin', 'tool').write('tool', ensure=True)
+    tmpdir.join('prefix', 'data').write_binary(data)
+
+    path = str(tmpdir.join('prefix' + compression.tarball_extensions[fmt]))
+    with open(path, 'wb') as f:
+        writer = compression.compressed_writer(f, fmt, jobs=2)
+        with closing(tarfile.open(mode='w|', fileobj=writer)) as tar:
+            tar.add(str(tmpdir.join('prefix')), arcname='prefix')
+        writer.close()
+
+    with open(path, 'rb') as f:
+        reader = compression.decompressed_reader(f, fmt)
+        with closing(tarfile.open(fileobj=reader, mode='r|')) as tar:
+            tar.extractall(str(tmpdir.join('extracted')))
+    extracted = tmpdir.join('extracted', 'prefix')
+    assert extracted.join('bin', 'tool').read() == 'tool'
+    assert extracted.join('data').read_binary() == data
+
+    # gzip tarballs remain readable by older versions of Spack
+    if fmt == 'gzip':
+        with closing(tarfile.open(path, 'r')) as tar:
+            assert 'prefix/data' in tar.getnames()
+
+
+@requires_zstd
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_zstd(jobs):
+    compressed = compress(data, 'zstd', level=5, jobs=jobs)
+    assert compressed.startswith(b'\x28\xb5\x2f\xfd')
+    assert decompress(compressed, 'zstd') == data
+
+
+def test_unsupported_compression(monkeypatch):
+    with pytest.raises(compression.UnsupportedCompressionError):
+        compression.compressed_writer(io.BytesIO(), 'lzma')
+
+    monkeypatch.setattr(compression, 'have_zstd_support', False)
+    with pytest.raises(compression.UnsupportedCompressionError):
+        compression.compressed_writer(io.BytesIO(), 'zstd')
+    with pytest.raises(compression.UnsupportedCompressionError):
+        compression.decompressed_reader(io.BytesIO(), 'zstd')
+
+
+@pytest.mark.maybeslow
+def test_compression_benchmark():
+    """Compress a tarball of the library of the Python running Spack
+    with each format, and report the throughput and size of each."""
+    lib = os.path.dirname(os.__file__)
+    tarball = io.BytesIO()
+    with closing(tarfile.open(mode='w|', fileobj=tarball)) as tar:
+        for name in sorted(os.listdir(lib)):
+            if name.endswith('.py'):
+                tar.add(os.path.join(lib, name), arcname=name)
+    tarball = tarball.getvalue()
+    size = len(tarball) / float(1 << 20)
+
+    def report(label, seconds, compressed):
+        tty.msg('{0}: {1:.1f} MB/s, {2:.1%} of {3:.1f} MB'.format(
+            label, size / seconds, len(compressed) / float(len(tarball)),
+            size))
+
+    # Baseline: gzip as written by tarfile before
+    start = time.time()
+    out = io.BytesIO()
+    with closing(gzip.GzipFile(fileobj=out, mode='wb',
+                               compresslevel=9)) as f:
+        f.write(tarball)
+    report('gzip -9, tarfile', time.time() - start, out.getvalue())
+
+    jobs = max(2, min(16, multiprocessing.cpu_count()))
+    cases = [('gzip', 9, 1), ('gzip', 9, jobs), ('gzip', 6, jobs)]
+    if compression.have_zstd_support:
+        cases += [('zstd', 3, 1), ('zstd', 3, jobs), ('zstd', 19, jobs)]
+    for fmt, level, threads in cases:
+        start = time.time()
+        compressed = compress(tarball, fmt, level=level, jobs=threads)
+        report('{0} -{1}, {2} threads'.format(fmt, level, threads),
+               time.time() - start, compressed)
+        assert decompress(compressed, fmt) == tarball
@@ -0,0 +1,60 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+"""Test reading and rewriting the RPATH of ELF files."""
+import platform
+
+import pytest
+
+import spack.util.elf
+import spack.util.executable
+
+pytestmark = pytest.mark.skipif(
+    platform.system().lower() != 'linux', reason='ELF files only on linux')
+
+
+@pytest.fixture(params=['--enable-new-dtags', '--disable-new-dtags'])
+def elf_executable(tmpdir, request):
+    """Returns the path to an executable with an RPATH or a RUNPATH."""
+    src = tmpdir.join('main.c')
+    src.write('int main() { return 0; }\n')
+    executable = str(tmpdir.join('main.x'))
+    compiler = spack.util.executable.Executable('/usr/bin/gcc')
+    compiler(str(src), '-o', executable,
+             '-Wl,-rpath,/old/prefix/lib:/usr/lib',
+             '-Wl,{0}'.format(request.param))
+    return executable
+
+
+@pytest.mark.requires_executables('/usr/bin/gcc')
+def test_get_rpath(elf_executable):
+    rpath = spack.util.elf.get_rpath(elf_executable)
+    assert rpath == '/old/prefix/lib:/usr/lib'
+
+
+@pytest.mark.requires_executables('/usr/bin/gcc')
+def test_set_rpath(elf_executable):
+    assert spack.util.elf.set_rpath(elf_executable, '/new/lib:/usr/lib')
+    assert spack.util.elf.get_rpath(elf_executable) == '/new/lib:/usr/lib'
+
+    # The file still runs after the rewrite
+    spack.util.executable.Executable(elf_executable)()
+
+    # Longer RPATHs do not fit in place
+    assert not spack.util.elf.set_rpath(
+        elf_executable, '/a/much/longer/prefix/lib:/usr/lib')
+    assert spack.util.elf.get_rpath(elf_executable) == '/new/lib:/usr/lib'
+
+
+def test_not_elf(tmpdir):
+    text = tmpdir.join('text.txt')
+    text.write('not an ELF file\n')
+    with pytest.raises(spack.util.elf.ElfParsingError):
+        spack.util.elf.get_rpath(str(text))
+
+    elf = tmpdir.join('truncated.so')
+    elf.write(b'\x7fELF\x02\x01\x01\0', mode='wb')
+    with pytest.raises(spack.util.elf.ElfParsingError):
+        spack.util.elf.set_rpath(str(elf), '/new/lib')
@@ -0,0 +1,57 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+"""Test Spack's jobserver."""
+import os
+
+import pytest
+from spack.util.jobserver import Jobserver
+
+
+@pytest.fixture()
+def jobserver():
+    """Returns a jobserver allowing 4 jobs"""
+    jobserver = Jobserver.create(4)
+    yield jobserver
+    jobserver.close()
+
+
+def test_jobserver_tokens(jobserver):
+    """A jobserver holds one token less than its jobs."""
+    assert all(jobserver.acquire() for _ in range(3))
+    assert not jobserver.acquire()
+
+    jobserver.release()
+    assert jobserver.acquire()
+
+
+def test_jobserver_close(jobserver):
+    """Closing a jobserver removes its pipe."""
+    assert os.path.exists(jobserver.fifo)
+    jobserver.close()
+    assert not os.path.exists(jobserver.fifo)
+
+
+def test_jobserver_from_makeflags(jobserver):
+    """Jobservers are joined through their MAKEFLAGS."""
+    joined = Jobserver.from_makeflags(jobserver.makeflags(fifo=True))
+    assert joined.fifo == jobserver.fifo
+    assert joined.acquire()
+    joined.close()
+    assert os.path.exists(jobserver.fifo)
+
+    joined = Jobserver.from_makeflags('-k ' + jobserver.makeflags())
+    assert joined.fds == jobserver.fds
+    assert joined.acquire()
+    assert jobserver.acquire()
+    assert not joined.acquire()
+
+
+@pytest.mark.parametrize('makeflags', [
+    '', '-k', '-j --jobserver-auth=fifo:/no/such/fifo'
+])
+def test_jobserver_from_makeflags_none(makeflags):
+    """MAKEFLAGS without a usable jobserver are ignored."""
+    assert Jobserver.from_makeflags(makeflags) is None
@@ -191,3 +191,28 @@ def test_get_header():
     # If there isn't even a fuzzy match, raise KeyError
     with pytest.raises(KeyError):
         web_util.get_header(headers, 'ContentLength')
+
+
+def test_push_to_url_if_version(tmpdir):
+    remote = 'file://' + str(tmpdir.join('remote', 'index'))
+    local = tmpdir.join('local')
+
+    assert web_util.read_versioned_url(remote) == (None, None)
+    local.write('first')
+    web_util.push_to_url_if_version(str(local), remote, None)
+    data, version = web_util.read_versioned_url(remote)
+    assert data == b'first'
+
+    # A file created or replaced since it was read is not overwritten
+    local.write('second')
+    with pytest.raises(web_util.PreconditionFailedError):
+        web_util.push_to_url_if_version(str(local), remote, None)
+    with pytest.raises(web_util.PreconditionFailedError):
+        web_util.push_to_url_if_version(str(local), remote, 'outdated')
+    assert web_util.read_versioned_url(remote) == (data, version)
+
+    web_util.push_to_url_if_version(str(local), remote, version)
+    assert web_util.read_versioned_url(remote)[0] == b'second'
+    assert local.read() == 'second'
+    assert sorted(os.listdir(str(tmpdir.join('remote')))) == \
+        ['index', 'index.lock']
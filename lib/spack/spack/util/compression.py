@@ -3,11 +3,21 @@
 #
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
+import collections
 import re
 import os
+import zlib
 from itertools import product
+from multiprocessing.pool import ThreadPool
+
 from spack.util.executable import which
 
+try:
+    import zstandard
+    have_zstd_support = True
+except ImportError:
+    have_zstd_support = False
+
 # Supported archive extensions.
 PRE_EXTS   = ["tar", "TAR"]
 EXTS       = ["gz", "bz2", "xz", "Z"]
@@ -64,3 +74,210 @@ def extension(path):
         if re.search(suffix, path):
             return t
     return None
+
+
+#: Formats buildcache tarballs can be compressed with, and their extensions
+tarball_extensions = {'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+
+#: Default compression level of each tarball format
+default_levels = {'gzip': 9, 'zstd': 3}
+
+
+class UnsupportedCompressionError(ValueError):
+    """Raised when a compression format cannot be used here."""
+
+
+def check_compression(compression):
+    """Raise ``UnsupportedCompressionError`` if tarballs can't be
+    compressed or decompressed in the format with this Python."""
+    if compression not in tarball_extensions:
+        raise UnsupportedCompressionError(
+            'unknown compression format: {0}'.format(compression))
+    if compression == 'zstd' and not have_zstd_support:
+        raise UnsupportedCompressionError(
+            'the zstandard Python module is required for zstd compression')
+
+
+def gzip_member(data, level=9):
+    """Compress data as a complete gzip member.
+
+    The header has a null mtime and no file name, so the output only
+    depends on the data and the level.
+    """
+    # wbits of 16 + 15 writes the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+    """Write-only file object compressing what is written to it as gzip,
+    with several threads.
+
+    The data is cut into blocks that are compressed independently, and
+    written as consecutive gzip members. Any gzip reader decompresses them
+    as a single stream, so the output is readable by ``gzip``, ``tarfile``
+    and older versions of Spack. Blocks compress in parallel because zlib
+    releases the GIL.
+    """
+
+    def __init__(self, fileobj, level=9, jobs=1, block_size=1 << 20):
+        """Compress to an open file object.
+
+        Args:
+            fileobj (file): file open in binary mode, left open by
+                ``close()``
+            level (int): gzip compression level, from 1 to 9
+            jobs (int): number of threads compressing blocks
+            block_size (int): size of the uncompressed blocks, in bytes
+        """
+        self.fileobj = fileobj
+        self.level = level
+        self.jobs = jobs
+        self.block_size = block_size
+        self.pool = ThreadPool(jobs) if jobs > 1 else None
+        self.buffer = []
+        self.buffered = 0
+        self.pending = collections.deque()
+        self.written = False
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self._compress_block()
+
+    def _output(self, member):
+        self.fileobj.write(member)
+        self.written = True
+
+    def _compress_block(self):
+        block = b''.join(self.buffer)
+        self.buffer, self.buffered = [], 0
+        if self.pool is None:
+            self._output(gzip_member(block, self.level))
+            return
+
+        self.pending.append(
+            self.pool.apply_async(gzip_member, (block, self.level)))
+        # Keep the compressed blocks in order, and bound the memory used
+        while self.pending and (self.pending[0].ready() or
+                                len(self.pending) > 2 * self.jobs):
+            self._output(self.pending.popleft().get())
+
+    def close(self):
+        """Write the remaining data, without closing the file."""
+        if self.buffered:
+            self._compress_block()
+        while self.pending:
+            self._output(self.pending.popleft().get())
+        if not self.written:
+            # An empty stream is still a valid gzip file
+            self._output(gzip_member(b'', self.level))
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class GzipReader(object):
+    """Read-only file object decompressing a gzip stream, possibly made of
+    several members, read sequentially from another file object.
+
+    Unlike ``gzip.GzipFile`` with Python 2, it never seeks, so the stream
+    can be a pipe or a member of a tar archive being read.
+    """
+
+    def __init__(self, fileobj, block_size=1 << 16):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.decompressor = zlib.decompressobj(31)
+        self.buffer = b''
+        self.offset = 0
+        self.eof = False
+
+    def _fill(self):
+        """Decompress the next block of the stream into the buffer."""
+        chunks = [self.buffer[self.offset:]]
+        data = self.fileobj.read(self.block_size)
+        if not data:
+            self.eof = True
+            chunks.append(self.decompressor.flush())
+        while data:
+            chunks.append(self.decompressor.decompress(data))
+            # The rest of the data is the beginning of the next member
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = zlib.decompressobj(31)
+        self.buffer = b''.join(chunks)
+        self.offset = 0
+
+    def read(self, size=-1):
+        while not self.eof and (
+                size < 0 or len(self.buffer) - self.offset < size):
+            self._fill()
+        end = len(self.buffer) if size < 0 else self.offset + size
+        data = self.buffer[self.offset:end]
+        self.offset += len(data)
+        return data
+
+
+class ZstdWriter(object):
+    """Write-only file object compressing what is written to it as zstd,
+    with the threads of the zstd library."""
+
+    def __init__(self, fileobj, level=3, jobs=1):
+        """Compress to an open file object.
+
+        Args:
+            fileobj (file): file open in binary mode, left open by
+                ``close()``
+            level (int): zstd compression level, from 1 to 22
+            jobs (int): number of threads compressing the stream
+        """
+        compressor = zstandard.ZstdCompressor(
+            level=level, threads=jobs if jobs > 1 else 0)
+        self.writer = compressor.stream_writer(fileobj)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        """End the zstd frame, without closing the file."""
+        self.writer.flush(zstandard.FLUSH_FRAME)
+
+
+def compressed_writer(fileobj, compression, level=None, jobs=1):
+    """Return a file object compressing what is written to it in a
+    tarball format, and writing it to ``fileobj``.
+
+    Args:
+        fileobj (file): file open in binary mode, left open when the
+            returned object is closed
+        compression (str): format of ``tarball_extensions``
+        level (int or None): compression level, or None for the default
+            level of the format
+        jobs (int): number of threads compressing the data
+
+    Returns:
+        (object): object with ``write()`` and ``close()`` methods
+    """
+    check_compression(compression)
+    if level is None:
+        level = default_levels[compression]
+    if compression == 'zstd':
+        return ZstdWriter(fileobj, level, jobs)
+    return ParallelGzipWriter(fileobj, level, jobs)
+
+
+def decompressed_reader(fileobj, compression):
+    """Return a file object reading decompressed data from ``fileobj``,
+    compressed in a format of ``tarball_extensions``.
+
+    The returned object only supports sequential reads, as needed by
+    ``tarfile`` in stream mode (``'r|'``), and only reads ``fileobj``
+    sequentially.
+    """
+    check_compression(compression)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    return GzipReader(fileobj)
@@ -0,0 +1,212 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+"""Read and rewrite the RPATH of ELF files without running ``patchelf``.
+
+Only the dynamic section and its string table are parsed. The RPATH (or
+RUNPATH) is rewritten in place, which is possible as long as the new string
+is not longer than the one it replaces, like ``patchelf`` does in that case.
+"""
+import struct
+
+import spack.error
+
+# Dynamic section tags
+DT_NULL = 0
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+# Program header types
+PT_LOAD = 1
+PT_DYNAMIC = 2
+
+
+class ElfParsingError(spack.error.SpackError):
+    """Raised when a file is not an ELF file that can be handled here."""
+
+
+class ElfDynamicSection(object):
+    """The dynamic section of an ELF file, and its string table."""
+
+    def __init__(self, f):
+        """Parse the dynamic section of an open ELF file.
+
+        Args:
+            f (file): ELF file open in binary mode
+        """
+        f.seek(0)
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF':
+            raise ElfParsingError('not an ELF file')
+
+        elf_class, data = bytearray(ident[4:6])
+        if elf_class not in (1, 2) or data not in (1, 2):
+            raise ElfParsingError('unknown ELF class or byte order')
+        self.is_64 = elf_class == 2
+        order = '<' if data == 1 else '>'
+
+        # Program headers: offset, entry size and number of entries
+        header_format = order + ('HHIQQQIHHH' if self.is_64 else 'HHIIIIIHHH')
+        header = struct.unpack(
+            header_format, f.read(struct.calcsize(header_format)))
+        phoff, phentsize, phnum = header[4], header[8], header[9]
+
+        phdr_format = order + ('IIQQQQ' if self.is_64 else 'IIIIII')
+
+        loads, dynamic = [], None
+        for i in range(phnum):
+            f.seek(phoff + i * phentsize)
+            fields = struct.unpack(
+                phdr_format, f.read(struct.calcsize(phdr_format)))
+            if self.is_64:
+                p_type, _, p_offset, p_vaddr, _, p_filesz = fields
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz, _ = fields
+            if p_type == PT_LOAD:
+                loads.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == PT_DYNAMIC:
+                dynamic = (p_offset, p_filesz)
+
+        if dynamic is None:
+            raise ElfParsingError('no dynamic section')
+
+        # Dynamic entries, as (file offset, tag, value) tuples
+        self.dyn_format = order + ('qQ' if self.is_64 else 'iI')
+        dyn_size = struct.calcsize(self.dyn_format)
+        f.seek(dynamic[0])
+        self.entries = []
+        for offset in range(dynamic[0], dynamic[0] + dynamic[1], dyn_size):
+            tag, value = struct.unpack(self.dyn_format, f.read(dyn_size))
+            if tag == DT_NULL:
+                break
+            self.entries.append((offset, tag, value))
+
+        # The string table is given by its address in memory
+        strtab = self.value(DT_STRTAB)
+        self.strsz = self.value(DT_STRSZ)
+        if strtab is None or self.strsz is None:
+            raise ElfParsingError('no dynamic string table')
+        for vaddr, offset, size in loads:
+            if vaddr <= strtab < vaddr + size:
+                self.strtab_offset = strtab - vaddr + offset
+                break
+        else:
+            raise ElfParsingError('dynamic string table not in a segment')
+
+    def value(self, tag):
+        """Value of the first dynamic entry with the tag, or None."""
+        for _, entry_tag, value in self.entries:
+            if entry_tag == tag:
+                return value
+        return None
+
+    def rpath_entries(self):
+        """Dynamic entries of RPATH and RUNPATH."""
+        return [e for e in self.entries if e[1] in (DT_RPATH, DT_RUNPATH)]
+
+    def string(self, f, offset):
+        """Read the null-terminated string at an offset of the table."""
+        if offset >= self.strsz:
+            raise ElfParsingError('string outside of the string table')
+        f.seek(self.strtab_offset + offset)
+        data = f.read(self.strsz - offset)
+        end = data.find(b'\0')
+        if end < 0:
+            raise ElfParsingError('unterminated string')
+        return data[:end]
+
+
+def get_file_rpath(f):
+    """Return the RPATH, or the RUNPATH, of an open ELF file.
+
+    Args:
+        f (file): ELF file open in binary mode, or an ``io.BytesIO``
+
+    Returns:
+        (str or None): the colon-separated search path, or None if the file
+            has neither RPATH nor RUNPATH
+
+    Raises:
+        ElfParsingError: if the file is not an ELF file with a dynamic
+            section
+    """
+    try:
+        dynamic = ElfDynamicSection(f)
+        entries = dynamic.rpath_entries()
+        if not entries:
+            return None
+        # RPATH takes precedence, as for patchelf --print-rpath
+        entries.sort(key=lambda e: e[1] != DT_RPATH)
+        return dynamic.string(f, entries[0][2]).decode('utf-8')
+    except struct.error:
+        raise ElfParsingError('truncated ELF file')
+
+
+def get_rpath(path):
+    """Return the RPATH, or the RUNPATH, of an ELF file, as
+    ``get_file_rpath``.
+
+    Args:
+        path (str): path of the ELF file
+    """
+    with open(path, 'rb') as f:
+        return get_file_rpath(f)
+
+
+def set_file_rpath(f, rpath):
+    """Set the RPATH of an open ELF file in place, if the new one fits in
+    the space of the current RPATH or RUNPATH string.
+
+    Like ``patchelf --force-rpath``, a RUNPATH is turned into an RPATH.
+
+    Args:
+        f (file): ELF file open in binary read-write mode, or an
+            ``io.BytesIO``
+        rpath (str): colon-separated search path
+
+    Returns:
+        (bool): True if the RPATH was set, False if it must grow, or the
+            file has neither RPATH nor RUNPATH or has both
+
+    Raises:
+        ElfParsingError: if the file is not an ELF file with a dynamic
+            section
+    """
+    new = rpath.encode('utf-8')
+    try:
+        dynamic = ElfDynamicSection(f)
+        entries = dynamic.rpath_entries()
+        if not entries:
+            # Nothing to do if no RPATH is wanted anyway
+            return not new
+        if len(entries) > 1:
+            return False
+
+        entry_offset, tag, value = entries[0]
+        old = dynamic.string(f, value)
+        if len(new) > len(old):
+            return False
+
+        f.seek(dynamic.strtab_offset + value)
+        f.write(new + b'\0' * (len(old) - len(new)))
+        if tag == DT_RUNPATH:
+            f.seek(entry_offset)
+            f.write(struct.pack(dynamic.dyn_format, DT_RPATH, value))
+        return True
+    except struct.error:
+        raise ElfParsingError('truncated ELF file')
+
+
+def set_rpath(path, rpath):
+    """Set the RPATH of an ELF file in place, as ``set_file_rpath``.
+
+    Args:
+        path (str): path of the ELF file
+        rpath (str): colon-separated search path
+    """
+    with open(path, 'rb+') as f:
+        return set_file_rpath(f, rpath)
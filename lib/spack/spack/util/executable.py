@@ -7,6 +7,7 @@
 import re
 import shlex
 import subprocess
+import sys
 from six import string_types, text_type
 
 import llnl.util.tty as tty
@@ -88,6 +89,8 @@ def __call__(self, *args, **kwargs):
             input: Where to read stdin from
             output: Where to send stdout
             error: Where to send stderr
+            pass_fds (tuple): File descriptors besides the standard streams
+                that the subprocess inherits
 
         Accepted values for input, output, and error:
 
@@ -123,6 +126,7 @@ def __call__(self, *args, **kwargs):
             ignore_errors = (ignore_errors, )
 
         input  = kwargs.pop('input',  None)
+        pass_fds = kwargs.pop('pass_fds', ())
         output = kwargs.pop('output', None)
         error  = kwargs.pop('error',  None)
 
@@ -158,13 +162,19 @@ def streamify(arg, mode):
 
         tty.debug(cmd_line)
 
+        # Python 2 does not close file descriptors by default
+        popen_args = {}
+        if pass_fds and sys.version_info >= (3, 2):
+            popen_args['pass_fds'] = pass_fds
+
         try:
             proc = subprocess.Popen(
                 cmd,
                 stdin=istream,
                 stderr=estream,
                 stdout=ostream,
-                env=env)
+                env=env,
+                **popen_args)
             out, err = proc.communicate()
 
             result = None
@@ -0,0 +1,200 @@
+# Copyright 2013-2020 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+"""A GNU make jobserver shared by the builds of an install session.
+
+A jobserver is a pipe holding one token (a byte) per job that may run in
+addition to the one every client is implicitly allowed.  Clients (``make``
+and recent versions of ``ninja``) read a token before starting another job
+and write it back when the job is done, so that the total parallelism of all
+the builds sharing the jobserver stays within the number of tokens.
+
+The jobserver of an install session is a named pipe, so that clients that
+only know how to open it by path (``ninja``) can use it as well as clients
+inheriting its file descriptors (``make``). If Spack itself runs under a
+``make`` with a jobserver, that jobserver is used instead.
+"""
+
+import atexit
+import errno
+import os
+import re
+import select
+import shutil
+import tempfile
+
+#: Jobserver of the session, if started
+_session = None
+
+#: Matches jobserver file descriptors in MAKEFLAGS
+_fds_re = re.compile(r'--jobserver-(?:auth|fds)=(\d+),(\d+)')
+
+#: Matches a jobserver named pipe in MAKEFLAGS
+_fifo_re = re.compile(r'--jobserver-auth=fifo:(\S+)')
+
+
+class Jobserver(object):
+    """Token pipe shared by the builds of an install session."""
+
+    def __init__(self, read_fd, write_fd, fifo=None, owned=False,
+                 tmpdir=None):
+        """Create a jobserver object from an open token pipe.
+
+        Args:
+            read_fd (int): file descriptor to read tokens from
+            write_fd (int): file descriptor to write tokens to
+            fifo (str or None): path of the pipe, if it is a named pipe
+            owned (bool): whether the file descriptors were opened by this
+                process, and are to be closed by ``close()``
+            tmpdir (str or None): directory of the pipe to be removed by
+                ``close()``
+        """
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.fifo = fifo
+        self.owned = owned
+        self.tmpdir = tmpdir
+        self.pid = os.getpid()
+
+        # Tokens are taken by Spack itself without blocking, through a
+        # separate non-blocking descriptor where the pipe has a path.
+        # Clients sharing read_fd expect it to block.
+        self.poll_fd = read_fd
+        if fifo:
+            self.poll_fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+
+    @classmethod
+    def create(cls, jobs):
+        """Create a jobserver allowing ``jobs`` jobs at the same time.
+
+        The pipe holds ``jobs - 1`` tokens, since every client may run one
+        job without a token.
+        """
+        tmpdir = tempfile.mkdtemp(prefix='spack-jobserver-')
+        fifo = os.path.join(tmpdir, 'fifo')
+        os.mkfifo(fifo, 0o600)
+
+        # Open for reading and writing so that neither open blocks
+        read_fd = os.open(fifo, os.O_RDWR)
+        write_fd = os.open(fifo, os.O_WRONLY)
+        os.write(write_fd, b'+' * (jobs - 1))
+        return cls(read_fd, write_fd, fifo=fifo, owned=True, tmpdir=tmpdir)
+
+    @classmethod
+    def from_makeflags(cls, makeflags):
+        """Return the jobserver advertised in ``makeflags``, or None if
+        there is none or it is not usable from this process."""
+        match = _fifo_re.search(makeflags)
+        if match and os.path.exists(match.group(1)):
+            fifo = match.group(1)
+            read_fd = os.open(fifo, os.O_RDWR)
+            write_fd = os.open(fifo, os.O_WRONLY)
+            return cls(read_fd, write_fd, fifo=fifo, owned=True)
+
+        match = _fds_re.search(makeflags)
+        if match:
+            read_fd, write_fd = int(match.group(1)), int(match.group(2))
+            try:
+                os.fstat(read_fd)
+                os.fstat(write_fd)
+            except OSError:
+                # The parent make did not pass its pipe to us
+                return None
+            return cls(read_fd, write_fd)
+
+        return None
+
+    def makeflags(self, fifo=False):
+        """MAKEFLAGS passing the jobserver to a client.
+
+        Args:
+            fifo (bool): if True, reference the pipe by path, as understood
+                by ``ninja``, rather than by file descriptors, as understood
+                by all versions of GNU make.
+        """
+        if fifo:
+            return '-j --jobserver-auth=fifo:{0}'.format(self.fifo)
+        return '-j --jobserver-fds={0},{1}'.format(self.read_fd, self.write_fd)
+
+    def fileno(self):
+        """File descriptor that becomes readable when a token is available,
+        so that the jobserver can be waited on with ``select``."""
+        return self.poll_fd
+
+    @property
+    def fds(self):
+        """File descriptors a client needs to inherit."""
+        return (self.read_fd, self.write_fd)
+
+    def acquire(self):
+        """Take a token from the pipe if one is available.
+
+        Returns:
+            (bool): True if a token was taken, otherwise False
+        """
+        ready, _, _ = select.select([self.poll_fd], [], [], 0)
+        if not ready:
+            return False
+        try:
+            return len(os.read(self.poll_fd, 1)) == 1
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return False
+            raise
+
+    def release(self):
+        """Put back a token taken with ``acquire()``."""
+        os.write(self.write_fd, b'+')
+
+    def close(self):
+        """Close the pipe, and remove it if created by this jobserver."""
+        if os.getpid() != self.pid:
+            # Forked processes leave the pipe to the parent
+            return
+        if self.poll_fd != self.read_fd:
+            os.close(self.poll_fd)
+        if self.owned:
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+        self.poll_fd = self.read_fd
+        self.owned = False
+        self.tmpdir = None
+
+
+def current():
+    """Return the jobserver of the session, or None if not started."""
+    return _session
+
+
+def start(jobs):
+    """Return the jobserver of the session, starting it if needed.
+
+    The session lasts until Spack exits, so that all the installs of a
+    command share one jobserver. A jobserver advertised in the MAKEFLAGS of
+    the environment is joined rather than creating a new one.
+
+    Args:
+        jobs (int): number of jobs allowed by a new jobserver
+
+    Returns:
+        (Jobserver): the jobserver of the session
+    """
+    global _session
+    if _session is None:
+        _session = Jobserver.from_makeflags(os.environ.get('MAKEFLAGS', ''))
+        if _session is None:
+            _session = Jobserver.create(jobs)
+        atexit.register(stop)
+    return _session
+
+
+def stop():
+    """Stop the jobserver of the session."""
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
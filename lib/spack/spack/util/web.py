@@ -7,6 +7,7 @@
 
 import codecs
 import errno
+import hashlib
 import re
 import os
 import os.path
@@ -38,6 +39,7 @@ class HTMLParseError(Exception):
 import spack.error
 import spack.url
 import spack.util.crypto
+import spack.util.lock as lk
 import spack.util.s3 as s3_util
 import spack.util.url as url_util
 
@@ -229,6 +231,124 @@ def push_to_url(
                 SCHEME=remote_url.scheme))
 
 
+def _s3_key(url):
+    key = url.path
+    while key.startswith('/'):
+        key = key[1:]
+    return key
+
+
+def read_versioned_url(url):
+    """Read a file of a mirror, with a token identifying its version.
+
+    The token is passed to ``push_to_url_if_version`` to replace the file
+    only if it did not change in between, for optimistic concurrency
+    between the processes updating it.
+
+    Args:
+        url (str): URL of a local file or of an S3 object
+
+    Returns:
+        (tuple): the content of the file, as bytes, and its version, or
+            (None, None) if the file does not exist
+    """
+    url = url_util.parse(url)
+    local_path = url_util.local_file_path(url)
+    if local_path:
+        try:
+            with open(local_path, 'rb') as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None, None
+            raise
+        return data, hashlib.sha256(data).hexdigest()
+
+    if url.scheme == 's3':
+        s3 = s3_util.create_s3_session(url)
+        from botocore.exceptions import ClientError
+        try:
+            obj = s3.get_object(Bucket=url.netloc, Key=_s3_key(url))
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'NoSuchKey':
+                return None, None
+            raise err
+        return obj['Body'].read(), obj['ETag']
+
+    raise NotImplementedError(
+        'Unrecognized URL scheme: {SCHEME}'.format(SCHEME=url.scheme))
+
+
+def push_to_url_if_version(
+        local_file_path, remote_path, version, extra_args=None):
+    """Push a file to a mirror, if the remote file is still at the version
+    returned by ``read_versioned_url``.
+
+    Local files are compared and replaced under an exclusive lock, and S3
+    objects with a conditional write. The local file is kept.
+
+    Args:
+        local_file_path (str): path of the file to push
+        remote_path (str): URL of a local file or of an S3 object
+        version (str or None): version of the remote file, or None if it
+            did not exist
+        extra_args (dict): extra arguments of the S3 upload
+
+    Raises:
+        PreconditionFailedError: if the remote file changed
+    """
+    remote_url = url_util.parse(remote_path)
+    remote_file_path = url_util.local_file_path(remote_url)
+    if remote_file_path is not None:
+        # Copy next to the remote file first, to replace it atomically
+        mkdirp(os.path.dirname(remote_file_path))
+        tmp_path = '{0}.{1}.tmp'.format(remote_file_path, os.getpid())
+        shutil.copy(local_file_path, tmp_path)
+        try:
+            lock = lk.Lock('{0}.lock'.format(remote_file_path))
+            with lk.WriteTransaction(lock):
+                if read_versioned_url(remote_path)[1] != version:
+                    raise PreconditionFailedError(remote_path)
+                os.rename(tmp_path, remote_file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    elif remote_url.scheme == 's3':
+        args = dict(extra_args or {})
+        if version is None:
+            args['IfNoneMatch'] = '*'
+        else:
+            args['IfMatch'] = version
+
+        s3 = s3_util.create_s3_session(remote_url)
+        from botocore.exceptions import ClientError, ParamValidationError
+        with open(local_file_path, 'rb') as f:
+            try:
+                s3.put_object(Bucket=remote_url.netloc,
+                              Key=_s3_key(remote_url), Body=f, **args)
+            except ClientError as err:
+                if err.response['Error']['Code'] in (
+                        'PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise PreconditionFailedError(remote_path)
+                raise err
+            except ParamValidationError:
+                # botocore before conditional writes
+                tty.warn('Overwriting {0} unconditionally, which can lose '
+                         'concurrent updates: conditional writes need a '
+                         'newer botocore'.format(remote_path))
+                args.pop('IfNoneMatch', None)
+                args.pop('IfMatch', None)
+                f.seek(0)
+                s3.put_object(Bucket=remote_url.netloc,
+                              Key=_s3_key(remote_url), Body=f, **args)
+
+    else:
+        raise NotImplementedError(
+            'Unrecognized URL scheme: {SCHEME}'.format(
+                SCHEME=remote_url.scheme))
+
+
 def url_exists(url):
     url = url_util.parse(url)
     local_path = url_util.local_file_path(url)
@@ -599,6 +719,14 @@ class SpackWebError(spack.error.SpackError):
     """Superclass for Spack web spidering errors."""
 
 
+class PreconditionFailedError(SpackWebError):
+    """Raised when a file to replace changed since it was read."""
+    def __init__(self, url):
+        super(PreconditionFailedError, self).__init__(
+            "{0} changed since it was read".format(url))
+        self.url = url
+
+
 class NoNetworkConnectionError(SpackWebError):
     """Raised when an operation can't get an internet connection."""
     def __init__(self, message, url):